@@ -1,107 +1,320 @@
+from __future__ import annotations
+
 import asyncio
+import hashlib
+import json
 import re
 import logging
-from openai import AsyncOpenAI
-from app.utils.markdown_utils import escape_markdown_v2 
-from app.utils.message_utils import split_text 
-from config import AI_TOKEN
+import time
+from app.utils.cache import TTLCache, SingleFlight
+from app.utils.plan_utils import (PlanDay, PlanDaysParser, parse_plan_days, apply_day_edit, CONTENT_PLAN_RESPONSE_FORMAT,
+                                  PLAN_DAY_RESPONSE_FORMAT, FIELD_RESPONSE_FORMATS)
+from app.database.requests import get_cached_generation, save_cached_generation, delete_expired_generations
+from app.llm import llm, LatencyWindow
+from app.metrics import metrics
+from app.routing import Route, route_for, record_route, record_route_error
+from app.utils.prompt_templates import PLAN_DAYS
+from app.utils.log_utils import LazyJson, Truncated, log_body
+from config import (GENERATION_CACHE_TTL, GENERATION_CACHE_SIZE, GENERATION_CACHE_PERSISTENT, GENERATION_CACHE_CLEANUP_INTERVAL,
+                    LLM_TIMEOUT)
 
 logger = logging.getLogger(__name__)
 
-client = AsyncOpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=AI_TOKEN,
-)
+# Провайдеры, повторы и дублирующие запросы — в app/llm.py; в ключ кэша идет основная модель
+MODEL = llm.model
+
+# Модель, бюджет и таймаут задач — в app/routing.py; без указанной задачи — прежние 4000 токенов
+MAX_TOKENS = 4000
+DEFAULT_ROUTE = Route("default", {}, MAX_TOKENS, LLM_TIMEOUT)
+
+# Кэш готовых ответов модели и объединение одинаковых одновременных запросов
+_cache = TTLCache(maxsize=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL)
+_in_flight = SingleFlight()
+_cleanup_task: asyncio.Task | None = None
+
+
+class UsageStats:
+    # Расход токенов по ответам провайдера (completion.usage): сколько входных токенов
+    # пришло из кэша префикса и сколько ждали первый фрагмент потока
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.first_token = LatencyWindow()
+
+    def record(self, usage, first_token: float | None = None):
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.requests += 1
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.cached_tokens += cached
+        self.completion_tokens += usage.completion_tokens or 0
+        if first_token is not None:
+            self.first_token.add(first_token)
+        metrics.add_tokens(usage.prompt_tokens or 0, cached, usage.completion_tokens or 0)
+        logger.info("Токены: вход %s (из кэша %s), ответ %s, первый фрагмент через %s с",
+                    usage.prompt_tokens, cached, usage.completion_tokens,
+                    f"{first_token:.2f}" if first_token is not None else "-")
+
+    @property
+    def cached_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+
+usage_stats = UsageStats()
+
+
+def _build_messages(prompt: str, system: str | None = None) -> list[dict]:
+    # Статичная системная часть идет первой: одинаковый префикс провайдер берет из кэша
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def cache_key(messages: list[dict], **params) -> str:
+    payload = json.dumps({"model": MODEL, "messages": messages, **params}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def _get_cached(key: str) -> str | None:
+    content = _cache.get(key)
+    if content is None and GENERATION_CACHE_PERSISTENT:
+        content = await get_cached_generation(key, GENERATION_CACHE_TTL)
+        if content is not None:
+            _cache.set(key, content)
+    if content is not None:
+        logger.info("Ответ ИИ взят из кэша (%.12s).", key)
+    return content
+
+
+async def _store_cached(key: str, content: str):
+    _cache.set(key, content)
+    if GENERATION_CACHE_PERSISTENT:
+        await save_cached_generation(key, content)
+
+
+async def _cleanup_loop():
+    while True:
+        removed = await delete_expired_generations(GENERATION_CACHE_TTL)
+        if removed:
+            logger.info("Из кэша генераций в БД удалено устаревших ответов: %s", removed)
+        await asyncio.sleep(GENERATION_CACHE_CLEANUP_INTERVAL)
+
+
+def start_cache_cleanup():
+    # Постоянный кэш чистится при запуске и затем раз в GENERATION_CACHE_CLEANUP_INTERVAL
+    global _cleanup_task
+    if GENERATION_CACHE_PERSISTENT and _cleanup_task is None:
+        _cleanup_task = asyncio.create_task(_cleanup_loop())
+
+
+def stop_cache_cleanup():
+    global _cleanup_task
+    if _cleanup_task is not None:
+        _cleanup_task.cancel()
+        _cleanup_task = None
 
-async def generate(prompt: str) -> str:
+
+def _format_params(response_format: dict | None) -> dict:
+    # response_format передается только когда нужен: так не меняются ключи кэша обычных ответов
+    return {"response_format": response_format} if response_format else {}
+
+
+class TruncatedResponse(Exception):
+    # Ответ модели оборвался на max_tokens маршрута (finish_reason == "length")
+    def __init__(self, route: Route):
+        super().__init__(f"ответ модели оборвался на лимите {route.max_tokens} токенов")
+        self.route = route
+
+
+async def _request_completion(messages: list[dict], key: str | None, response_format: dict | None = None,
+                              on_usage=None, route: Route = DEFAULT_ROUTE, retry_truncated: bool = True) -> str | None:
+    started = time.monotonic()
     try:
-        completion = await client.chat.completions.create(
-            model="google/gemini-2.5-flash-preview-05-20", 
-            messages=[
-                {"role": "user", "content": prompt}
-            ],
-            timeout=240,
-            max_tokens=4000
-        )
+        with metrics.stage("llm_request"):
+            completion = await llm.create(
+                messages,
+                models=route.models,
+                max_tokens=route.max_tokens,
+                timeout=route.timeout,
+                **_format_params(response_format)
+            )
+    except Exception as e:
+        metrics.error("llm", e)
+        record_route_error(route, e)
+        raise
+
+    if completion and completion.choices:
+        record_route(route, time.monotonic() - started, completion.usage, completion.choices[0].finish_reason)
+
+    if not completion or not completion.choices:
+        logger.error("Completion object has no choices or choices list is empty. Completion: %s", LazyJson(completion))
+        return None
+
+    log_body(logger, "Full Completion Object: %s", LazyJson(completion))
+
+    if not completion.choices[0].message or not completion.choices[0].message.content:
+        logger.error("Модель вернула пустой 'message.content' или 'message' отсутствует. Completion: %s", LazyJson(completion))
+        return None
+
+    content = completion.choices[0].message.content
+    if completion.usage is not None:
+        usage_stats.record(completion.usage)
+        if on_usage is not None:
+            on_usage(completion.usage)
+    if completion.choices[0].finish_reason == "length":
+        # Обрезанный ответ не кэшируется: запрос повторяется один раз с удвоенным бюджетом
+        wider = route.widened()
+        if retry_truncated and wider.max_tokens > route.max_tokens:
+            logger.warning("Повтор задачи %s с max_tokens=%s", route.task, wider.max_tokens)
+            return await _request_completion(messages, key, response_format, on_usage, wider, retry_truncated=False)
+        raise TruncatedResponse(route)
+    if key is not None:
+        await _store_cached(key, content)
+    return content
 
-        if completion and completion.choices:
-            logger.debug(f"Full Completion Object: {completion.model_dump_json(indent=2)}")
-
-            if completion.choices[0].message and completion.choices[0].message.content:
-                content = completion.choices[0].message.content
-                logger.debug(f"Raw AI response (content extracted):\n---\n{content}\n---")
-
-                first_day_match = re.search(r'^(?:.*?)(?=День \d+:\s*\w+)', content, flags=re.DOTALL | re.MULTILINE | re.IGNORECASE)
-                if first_day_match:
-                    content = content[first_day_match.start():].strip()
-                    logger.debug(f"Content after aggressive initial cleanup (before clean_content):\n---\n{content}\n---")
-                else:
-                    logger.warning("Не удалось найти начало контент-плана (День X:) в ответе ИИ. Пробуем обработать весь контент.")
-                    content = content.strip()
-
-                content = clean_content(content)
-                logger.debug(f"Content after clean_content:\n---\n{content}\n---")
-                
-                content = format_content_minimal(content)  # Calling minimal formatting function
-                logger.debug(f"Content after format_content_minimal (Markdown assumed):\n---\n{content}\n---")
-
-                final_content = escape_markdown_v2(content)
-                logger.debug(f"Content after final MarkdownV2 escaping:\n---\n{final_content}\n---")
-
-                return final_content.strip() if final_content.strip() else escape_markdown_v2("Модель не вернула содержание.")
-            else:
-                logger.error(f"Модель вернула пустой 'message.content' или 'message' отсутствует. Completion: {completion.model_dump_json(indent=2)}")
-                return escape_markdown_v2("Модель не вернула содержание или вернула пустой ответ.")
-        else:
-            logger.error(f"Completion object has no choices or choices list is empty. Completion: {completion.model_dump_json(indent=2)}")
-            return escape_markdown_v2("Модель не вернула варианты ответов.")
+
+async def complete(prompt: str, system: str | None = None, response_format: dict | None = None,
+                   on_usage=None, route: Route = DEFAULT_ROUTE, use_cache: bool = True) -> str | None:
+    # Сырой текст ответа модели: из кэша или одним запросом на все одинаковые вызовы.
+    # use_cache=False — всегда новый запрос мимо кэша и без объединения с одинаковыми вызовами
+    # (перегенерация: пользователь просит другой вариант на тот же промт).
+    # on_usage(usage) вызывается, только если запрос к модели действительно выполнялся этим вызовом.
+    # Ошибки API пробрасываются вызывающему коду.
+    messages = _build_messages(prompt, system)
+    if not use_cache:
+        return await _request_completion(messages, None, response_format, on_usage, route)
+    key = cache_key(messages, **route.cache_params(), **_format_params(response_format))
+
+    content = await _get_cached(key)
+    if content is not None:
+        return content
+
+    return await _in_flight.do(key, lambda: _request_completion(messages, key, response_format, on_usage, route))
+
+
+async def generate(prompt: str, system: str | None = None) -> str:
+    try:
+        content = await complete(prompt, system)
     except Exception as e:
-        logger.error(f"Ошибка при работе с ИИ: {e}", exc_info=True)
-        error_message = f"Произошла ошибка при генерации\\. Детали: `{escape_markdown_v2(str(e))}`\\. Пожалуйста, попробуйте еще раз\\."
-        return error_message
+        logger.error("Ошибка при работе с ИИ: %s", e, exc_info=True)
+        return generation_error_message(e)
 
+    if not content:
+        return "Модель не вернула содержание или вернула пустой ответ."
 
+    log_body(logger, "Raw AI response (content extracted):\n---\n%s\n---", content)
 
-def clean_content(content: str) -> str:
+    first_day_match = re.search(r'^(?:.*?)(?=День \d+:\s*\w+)', content, flags=re.DOTALL | re.MULTILINE | re.IGNORECASE)
+    if first_day_match:
+        content = content[first_day_match.start():].strip()
+        log_body(logger, "Content after aggressive initial cleanup:\n---\n%s\n---", content)
+    else:
+        logger.warning("Не удалось найти начало контент-плана (День X:) в ответе ИИ. Пробуем обработать весь контент.")
+        content = content.strip()
 
-    content = re.sub(r'\\+', '', content) # Удалить все последовательности бэкслешей
+    # Разметка (**, _, #) остается как есть — в сущности Telegram ее переводит render_markdown
+    return content if content else "Модель не вернула содержание."
 
-    content = re.sub(r'(\n\n|^)(—{3,}|-{3,})(\n\n|$)', '\n\n', content)
 
-    content = re.sub(r'(?<!\S)—{1}(?!\S)', '', content) 
+def generation_error_message(error: Exception) -> str:
+    if isinstance(error, TruncatedResponse):
+        return "Ответ модели получился слишком длинным и оборвался. Пожалуйста, попробуйте еще раз."
+    return f"Произошла ошибка при генерации. Детали: {error}. Пожалуйста, попробуйте еще раз."
 
-    # Удаляем двойные двоеточия (::)
-    content = re.sub(r'::+', ':', content)
 
-    # Удаляем удвоенные заголовки секций (например, "Заголовок: Заголовок:")
-    content = re.sub(r'(\b\w+\s*:\s*)\1', r'\1', content, flags=re.IGNORECASE)
-    # Также убираем " (ста):" если оно идет после "Призыв к действию"
-    content = re.sub(r'Призыв к действию \(СТА\)\s*\(\w+\):\s*', r'Призыв к действию (СТА): ', content, flags=re.IGNORECASE)
+async def stream_generate(prompt: str, system: str | None = None, response_format: dict | None = None,
+                          route: Route = DEFAULT_ROUTE):
+    # Отдает текст ответа по мере поступления фрагментов (stream=True).
+    # Кэшированный ответ или ответ на такой же одновременный запрос отдается одним фрагментом.
+    # Ошибки API пробрасываются вызывающему коду; если ответ оборвался на max_tokens, после всех
+    # фрагментов поднимается TruncatedResponse (уже отданный текст повтором не заменить) и ответ не кэшируется.
+    messages = _build_messages(prompt, system)
+    key = cache_key(messages, **route.cache_params(), **_format_params(response_format))
+
+    content = await _get_cached(key)
+    if content is None and (leader := _in_flight.pending(key)) is not None:
+        content = await asyncio.shield(leader)
+    if content is not None:
+        if content:
+            yield content
+        return
+
+    _in_flight.begin(key)
+    parts = []
+    started = time.monotonic()
+    first_token = None
+    usage = finish_reason = None
+    try:
+        stream = llm.stream(
+            messages,
+            models=route.models,
+            max_tokens=route.max_tokens,
+            timeout=route.timeout,
+            stream_options={"include_usage": True},  # Последний фрагмент несет usage
+            **_format_params(response_format)
+        )
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+                usage_stats.record(chunk.usage, first_token)
+            if chunk.choices and chunk.choices[0].finish_reason:
+                finish_reason = chunk.choices[0].finish_reason
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                if first_token is None:
+                    first_token = time.monotonic() - started
+                    metrics.observe_stage("llm_first_token", first_token)
+                parts.append(chunk.choices[0].delta.content)
+                yield parts[-1]
+    except BaseException as e:
+        if isinstance(e, Exception):
+            metrics.error("llm", e)
+            record_route_error(route, e)
+        _in_flight.end(key, error=e)
+        raise
+
+    metrics.observe_stage("llm_stream", time.monotonic() - started)
+    record_route(route, time.monotonic() - started, usage, finish_reason)
+    if finish_reason == "length":
+        error = TruncatedResponse(route)
+        _in_flight.end(key, error=error)
+        raise error
+    content = "".join(parts)
+    if content:
+        await _store_cached(key, content)
+    _in_flight.end(key, content)
 
 
-    # Нормализация пробелов и переносов строк
-    content = re.sub(r'[ \t]+', ' ', content).strip() 
-    content = re.sub(r'\n{3,}', '\n\n', content) 
-    content = re.sub(r' \n', '\n', content) 
-    content = re.sub(r'\n ', '\n', content) 
+async def stream_plan_days(prompt: str, system: str | None = None):
+    # Запрашивает план по JSON-схеме и отдает каждый день (PlanDay),
+    # как только в потоке закрылся его объект.
+    parser = PlanDaysParser()
+    async for delta in stream_generate(prompt, system, response_format=CONTENT_PLAN_RESPONSE_FORMAT,
+                                       route=route_for("plan", PLAN_DAYS)):
+        with metrics.stage("plan_parse"):
+            days = parser.feed(delta)
+        for day in days:
+            yield day
 
-    return content.strip()
+    if not parser.days_found:
+        logger.warning("В ответе ИИ не найден массив days. Начало ответа:\n---\n%s\n---", Truncated(parser.buffer))
 
 
-# НОВАЯ/ОБНОВЛЕННАЯ ФУНКЦИЯ ФОРМАТИРОВАНИЯ
-def format_content_minimal(content: str) -> str:
-    content = re.sub(r'(\n\n\s*—{3,}\s*\n\n)|(\n\n\s*-{3,}\s*\n\n)', '\n\n— — —\n\n', content)
-    
-    # Убедимся, что нет более одного разделителя подряд в конце.
-    content = re.sub(r'(\n\n— — —\n\n){2,}$', '\n\n— — —\n\n', content)
+async def generate_plan(prompt: str, system: str | None = None) -> list[PlanDay]:
+    # То же без потока: весь план одним ответом. Ошибки API пробрасываются.
+    content = await complete(prompt, system, response_format=CONTENT_PLAN_RESPONSE_FORMAT, route=route_for("plan", PLAN_DAYS))
+    return parse_plan_days(content or "")
 
-    # Нормализация абзацев (для избежания слишком частых \n)
-    # Если строка не заканчивается \n и за ней следует не \n (т.е. одиночный \n), добавляем вторую \n
-    content = re.sub(r'([^\n])\n(?!\n)', r'\1\n\n', content)
-    # Убираем больше двух \n подряд
-    content = re.sub(r'\n{3,}', '\n\n', content) 
 
-    content = re.sub(r'(#\w+):', r'_\1_:', content)
-    content = re.sub(r'(?<![#_])(#\w+)(?![_#])', r'_\1_', content)
-    
-    return content.strip()
+async def regenerate_plan_day(prompt: str, system: str, day: PlanDay, field: str | None = None) -> PlanDay | None:
+    # Новый вариант одного дня (field=None) или одного его поля по короткой JSON-схеме.
+    # None — модель вернула неподходящий ответ. Ошибки API пробрасываются.
+    if field is None:
+        response_format, route = PLAN_DAY_RESPONSE_FORMAT, route_for("edit")
+    else:
+        response_format, route = FIELD_RESPONSE_FORMATS[field], route_for("edit_field")
+    # Мимо кэша: повторная правка с теми же пожеланиями должна дать новый вариант, а не прежний ответ
+    content = await complete(prompt, system, response_format=response_format, route=route, use_cache=False)
+    return apply_day_edit(day, field, content or "")
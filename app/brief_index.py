@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import zlib
+from array import array
+from datetime import datetime, timedelta
+
+from app.database.requests import (ANSWER_COLUMN_ALIASES, get_brief_signatures, get_unsigned_answers,
+                                   save_brief_signatures)
+from app.metrics import metrics
+from app.utils.plan_utils import PlanDay
+from config import (BRIEF_SIMILARITY_THRESHOLD, BRIEF_MINHASH_SIZE, BRIEF_LSH_BANDS, BRIEF_INDEX_REFRESH)
+
+logger = logging.getLogger(__name__)
+
+# Поля анкеты (колонки ContentPlanAnswers), из которых складывается текст для сравнения
+BRIEF_FIELDS = ("topic_audience", "goal", "frequency_format", "usp", "examples", "content_tone", "specific_topics")
+# Шингл — пара соседних слов: правка одного слова меняет пару шинглов из сотни
+SHINGLE_WORDS = 2
+BACKFILL_BATCH = 500
+SYNC_YIELD_ROWS = 5000  # Большая загрузка отдает цикл событий каждые N записей
+# Запас при подтягивании чужих записей: часы процессов и моменты коммитов немного расходятся
+SYNC_OVERLAP = timedelta(seconds=5)
+
+_WORD_RE = re.compile(r"\w+")
+_MASK64 = (1 << 64) - 1
+_MASK32 = 0xFFFFFFFF
+_GOLDEN = 0x9E3779B97F4A7C15  # Множитель Фибоначчи: перемешивает crc32 по всем 64 битам
+_EMPTY = _MASK32
+_DENSIFY_OFFSET = 0x5BD1E995  # Сдвиг значения, одолженного у соседней корзины, — на каждый шаг
+
+
+def brief_text(answers: dict) -> str:
+    # answers — ответы по колонкам ContentPlanAnswers или данные FSM (ключи переводятся в колонки)
+    values = {ANSWER_COLUMN_ALIASES.get(key, key): value for key, value in answers.items()}
+    return "\n".join(str(values[field]) for field in BRIEF_FIELDS if values.get(field))
+
+
+def _shingles(text: str) -> set[int]:
+    words = _WORD_RE.findall(text.lower())
+    grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))]
+    return {(zlib.crc32(gram.encode("utf-8")) * _GOLDEN) & _MASK64 for gram in grams if gram}
+
+
+def brief_signature(text: str, size: int = BRIEF_MINHASH_SIZE) -> bytes:
+    # One permutation hashing: вместо size перестановок каждый шингл хэшируется один раз,
+    # старшие биты выбирают корзину, в корзине остается минимум следующих 32 бит.
+    # Пустые корзины (короткая анкета) берут значение ближайшей непустой справа со сдвигом —
+    # так подписи любых анкет сравниваются по позициям. Пустая анкета — b""
+    shingles = _shingles(text)
+    if not shingles:
+        return b""
+    shift = 64 - (size.bit_length() - 1)
+    signature = [_EMPTY] * size
+    for value in shingles:
+        index = value >> shift
+        low = (value >> (shift - 32)) & _MASK32
+        if low < signature[index]:
+            signature[index] = low
+    if _EMPTY in signature:
+        filled = list(signature)
+        for index in range(size):
+            if filled[index] != _EMPTY:
+                continue
+            step = 1
+            while filled[(index + step) % size] == _EMPTY:
+                step += 1
+            signature[index] = (filled[(index + step) % size] + step * _DENSIFY_OFFSET) & _MASK32
+    return array("I", signature).tobytes()
+
+
+def similarity(a: bytes, b: bytes) -> float:
+    # Доля совпавших позиций подписей — оценка коэффициента Жаккара множеств шинглов
+    if len(a) != len(b) or not a:
+        return 0.0
+    left, right = memoryview(a).cast("I"), memoryview(b).cast("I")
+    return sum(x == y for x, y in zip(left, right)) / len(left)
+
+
+def _terms(text: str) -> set[str]:
+    # Грубая основа слова (первые 5 букв), чтобы «студентов» и «студенты» совпадали
+    return {word[:5] for word in _WORD_RE.findall(text.lower()) if len(word) >= 4}
+
+
+def stale_days(days: list[PlanDay], old_text: str, new_text: str) -> list[int]:
+    # Дни плана, написанного по старой анкете, которые нужно переписать под новую:
+    # те, что опираются на исчезнувшие из анкеты слова. Если новое в анкете не затронуто
+    # ни одним днем — под него отдается день, меньше всего связанный с новой анкетой
+    old_terms, new_terms = _terms(old_text), _terms(new_text)
+    removed, added = old_terms - new_terms, new_terms - old_terms
+    day_terms = {day.day_number: _terms(" ".join((day.topic_title, day.description, day.cta, day.hashtags)))
+                 for day in days}
+    stale = [number for number, terms in day_terms.items() if terms & removed]
+    if added and not any(terms & added for terms in day_terms.values()):
+        fresh = [number for number in day_terms if number not in stale]
+        if fresh:
+            stale.append(min(fresh, key=lambda number: len(day_terms[number] & new_terms)))
+    return sorted(stale)
+
+
+class BriefIndex:
+    # Подписи анкет по tg_id и LSH-корзины: подпись режется на bands полос, анкеты с совпавшей
+    # полосой — кандидаты, сходство проверяется по всей подписи. Поиск — bands обращений к dict
+    # и сравнение с несколькими кандидатами, без перебора всех анкет.
+    # Подписи хранятся в brief_signature; каждый процесс держит свою копию индекса и раз в refresh
+    # секунд подтягивает записи других процессов (run_sharded.py)
+
+    def __init__(self, threshold: float = 0.7, size: int = 64, bands: int = 16, refresh: float = 60):
+        if size & (size - 1) or size % bands:
+            raise ValueError("BRIEF_MINHASH_SIZE должен быть степенью двойки и делиться на BRIEF_LSH_BANDS")
+        self.threshold = threshold
+        self.size = size
+        self.refresh = refresh
+        self.scheme = f"oph{size}-w{SHINGLE_WORDS}"  # При смене параметров подписи пересчитываются
+        self._band_bytes = size // bands * 4
+        self._signatures: dict[int, bytes] = {}
+        self._buckets: list[dict] = [{} for _ in range(bands)]  # hash(полоса) -> tg_id или список tg_id
+        self._synced_at: datetime | None = None
+        self._task: asyncio.Task | None = None
+        self.stats = {"lookups": 0, "candidates": 0, "matches": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: bytes):
+        step = self._band_bytes
+        for band in range(len(self._buckets)):
+            yield self._buckets[band], hash(signature[band * step:(band + 1) * step])
+
+    def add(self, tg_id: int, signature: bytes):
+        self.remove(tg_id)
+        if not signature:
+            return
+        self._signatures[tg_id] = signature
+        # Одна анкета в корзине хранится как int, а не список: корзин в индексе в bands раз больше, чем анкет
+        for bucket, key in self._band_keys(signature):
+            current = bucket.get(key)
+            if current is None:
+                bucket[key] = tg_id
+            elif isinstance(current, list):
+                current.append(tg_id)
+            else:
+                bucket[key] = [current, tg_id]
+
+    def remove(self, tg_id: int):
+        signature = self._signatures.pop(tg_id, None)
+        if signature is None:
+            return
+        for bucket, key in self._band_keys(signature):
+            current = bucket.get(key)
+            if isinstance(current, list):
+                current.remove(tg_id)
+                if len(current) == 1:
+                    bucket[key] = current[0]
+            elif current is not None:
+                del bucket[key]
+
+    def query(self, signature: bytes, limit: int = 3) -> list[tuple[int, float]]:
+        # Похожие анкеты: [(tg_id, сходство)] не ниже порога, самые похожие первыми
+        self.stats["lookups"] += 1
+        if not signature:
+            return []
+        candidates = set()
+        for bucket, key in self._band_keys(signature):
+            current = bucket.get(key)
+            if isinstance(current, list):
+                candidates.update(current)
+            elif current is not None:
+                candidates.add(current)
+        self.stats["candidates"] += len(candidates)
+        matches = [(tg_id, similarity(signature, self._signatures[tg_id])) for tg_id in candidates]
+        matches = sorted((match for match in matches if match[1] >= self.threshold), key=lambda match: -match[1])
+        if matches:
+            self.stats["matches"] += 1
+        return matches[:limit]
+
+    async def remember(self, tg_id: int, answers: dict) -> list[tuple[int, float]]:
+        # Похожие анкеты (включая прошлую анкету самого пользователя); новая анкета сразу попадает в индекс
+        signature = brief_signature(brief_text(answers), self.size)
+        with metrics.stage("brief_lookup"):
+            matches = self.query(signature)
+        self.add(tg_id, signature)
+        await save_brief_signatures([(tg_id, self.scheme, signature)])
+        return matches
+
+    async def sync(self):
+        # Первый вызов загружает все подписи, следующие — только измененные с прошлого раза
+        since = self._synced_at - SYNC_OVERLAP if self._synced_at is not None else None
+        rows = await get_brief_signatures(self.scheme, since)
+        for count, (tg_id, signature, updated_at) in enumerate(rows, 1):
+            if self._signatures.get(tg_id) != signature:
+                self.add(tg_id, signature)
+            if self._synced_at is None or updated_at > self._synced_at:
+                self._synced_at = updated_at
+            if count % SYNC_YIELD_ROWS == 0:
+                await asyncio.sleep(0)
+        if since is None:
+            logger.info("Индекс анкет загружен: %s подписей", len(self))
+
+    async def backfill(self):
+        # Анкеты, сохраненные до появления индекса или при другой схеме подписи, получают подписи пачками.
+        # Выполняется один раз при запуске (run.py, супервизор run_sharded.py)
+        if not self.enabled:
+            return
+        after_id = total = 0
+        while batch := await get_unsigned_answers(self.scheme, after_id, BACKFILL_BATCH):
+            after_id = batch[-1][0]
+            await save_brief_signatures([
+                (record.tg_id, self.scheme, brief_signature(brief_text(record._asdict()), self.size))
+                for _, record in batch
+            ])
+            total += len(batch)
+        if total:
+            logger.info("Подписи посчитаны для %s сохраненных анкет", total)
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await self.sync()
+        if self.refresh > 0:
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning("Не удалось обновить индекс анкет: %s", e)
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+brief_index = BriefIndex(BRIEF_SIMILARITY_THRESHOLD, BRIEF_MINHASH_SIZE, BRIEF_LSH_BANDS, BRIEF_INDEX_REFRESH)
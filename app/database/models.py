@@ -1,11 +1,24 @@
 from sqlalchemy.ext.asyncio import AsyncAttrs, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import BigInteger, String, Text, func
+from sqlalchemy import BigInteger, ForeignKey, Integer, LargeBinary, String, Text, UniqueConstraint, func
 from datetime import datetime
 
-from config import DB_URL
+from config import DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_STATEMENT_CACHE_SIZE
 
-engine = create_async_engine(DB_URL)
+def engine_options(url: str) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    # У SQLite свой пул (StaticPool для :memory:), размеры пула к нему не применяются
+    if not url.startswith("sqlite"):
+        options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE)
+    if "+asyncpg" in url:
+        # 0 отключает кэш подготовленных выражений (нужно за pgbouncer в режиме transaction)
+        options["connect_args"] = {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+    return options
+
+engine = create_async_engine(DB_URL, **engine_options(DB_URL))
 async_session = async_sessionmaker(engine, expire_on_commit=False)
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -14,7 +27,7 @@ class Base(AsyncAttrs, DeclarativeBase):
 class UserPreference1(Base):
     __tablename__ = 'user_preference1'
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False, index=True)
     question: Mapped[str] = mapped_column(Text, nullable=False)
     answer: Mapped[str] = mapped_column(Text, nullable=False)
     created_time: Mapped[datetime] = mapped_column(server_default=func.now(), nullable=False)
@@ -35,6 +48,66 @@ class ContentPlanAnswers(Base):
     created_at: Mapped[datetime] = mapped_column(server_default=func.now(), nullable=False)
     updated_at: Mapped[datetime] = mapped_column(server_default=func.now(), onupdate=func.now(), nullable=False)
 
+class GenerationCache(Base):
+    __tablename__ = 'generation_cache'
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)  # sha256 от модели, промта и параметров
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(nullable=False)
+
+class ContentPlan(Base):
+    __tablename__ = 'content_plan'
+    # Версии планов пользователя 1, 2, 3...; индекс (tg_id, version) обслуживает и поиск
+    # конкретной версии, и постраничный список /history
+    __table_args__ = (UniqueConstraint('tg_id', 'version'),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    tg_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    title: Mapped[str] = mapped_column(String(200), nullable=False)  # Тема первого дня — для списка без чтения дней
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now(), nullable=False)
+
+class ContentPlanDay(Base):
+    __tablename__ = 'content_plan_day'
+    # Уникальный индекс (plan_id, day_number): день для генерации поста берется одним поиском по индексу.
+    # Версия плана неизменяема — правка дня сохраняется новой версией со своими строками дней
+    __table_args__ = (UniqueConstraint('plan_id', 'day_number'),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    plan_id: Mapped[int] = mapped_column(ForeignKey('content_plan.id', ondelete='CASCADE'), nullable=False)
+    day_number: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    day_title: Mapped[str] = mapped_column(Text, nullable=False)
+    topic_title: Mapped[str] = mapped_column(Text, nullable=False)
+    description: Mapped[str] = mapped_column(Text, nullable=False)
+    cta: Mapped[str] = mapped_column(Text, nullable=False)
+    hashtags: Mapped[str] = mapped_column(Text, nullable=False)  # "#Тег1 #Тег2"
+    visuals: Mapped[str] = mapped_column(Text, nullable=False)
+
+class ContentPost(Base):
+    __tablename__ = 'content_post'
+    # Каждая генерация поста для дня — новая версия; старые остаются в истории
+    __table_args__ = (UniqueConstraint('plan_id', 'day_number', 'version'),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    plan_id: Mapped[int] = mapped_column(ForeignKey('content_plan.id', ondelete='CASCADE'), nullable=False)
+    day_number: Mapped[int] = mapped_column(Integer, nullable=False)
+    version: Mapped[int] = mapped_column(Integer, nullable=False)
+    codec: Mapped[str] = mapped_column(String(8), nullable=False)
+    body: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)  # Сжатый пост в разметке модели
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now(), nullable=False)
+
+class BriefSignature(Base):
+    __tablename__ = 'brief_signature'
+    # MinHash-подпись анкеты пользователя для поиска похожих анкет (app/brief_index.py)
+    tg_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    scheme: Mapped[str] = mapped_column(String(32), nullable=False)  # Параметры подписи; при их смене подпись пересчитывается
+    signature: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(nullable=False, index=True)  # По нему процессы подтягивают чужие записи
+
+def _create_missing_indexes(sync_conn):
+    # create_all не добавляет новые индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
 async def init_db():
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
\ No newline at end of file
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_create_missing_indexes)
\ No newline at end of file
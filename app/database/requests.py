@@ -1,58 +1,439 @@
-from sqlalchemy import select
-from sqlalchemy.exc import SQLAlchemyError
+from __future__ import annotations
 
-from app.database.models import UserPreference1, ContentPlanAnswers, async_session
+import json
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select, func, delete
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from app.database.models import (UserPreference1, ContentPlanAnswers, GenerationCache, ContentPlan, ContentPlanDay,
+                                 ContentPost, BriefSignature, async_session, engine)
+from app.database.write_buffer import WriteBehindBuffer
+from app.utils.cache import TTLCache
+from app.utils.compression import compress_text, decompress_text
+from app.utils.plan_utils import PlanDay
+from config import (PREFERENCE_FLUSH_ROWS, PREFERENCE_FLUSH_INTERVAL, ANSWERS_CACHE_SIZE, ANSWERS_CACHE_TTL,
+                    ANSWERS_CACHE_REDIS, REDIS_URL)
 
 # ====== Работа с UserPreference1 ======
+async def _write_user_preferences(rows: list[UserPreference1]):
+    # Одна транзакция на пачку ответов; ошибка пробрасывается, чтобы буфер повторил запись
+    async with async_session() as session:
+        session.add_all(rows)
+        await session.commit()
+
+# Ответы копятся в памяти и пишутся пачками (см. WriteBehindBuffer)
+preference_buffer = WriteBehindBuffer(_write_user_preferences, PREFERENCE_FLUSH_ROWS, PREFERENCE_FLUSH_INTERVAL)
+
 async def save_user_preference(tg_id: int, question: str, answer: str):
-    try:
-        async with async_session() as session:
-            new_record = UserPreference1(tg_id=tg_id, question=question, answer=answer)
-            session.add(new_record)
-            await session.commit()
-    except SQLAlchemyError as e:
-        print(f"Ошибка при сохранении данных в UserPreference1: {e}")
+    preference_buffer.add(UserPreference1(tg_id=tg_id, question=question, answer=answer))
+
+async def flush_user_preferences():
+    await preference_buffer.close()
 
 async def get_user_preferences(tg_id: int):
+    def is_users(row):
+        return row.tg_id == tg_id
+
+    # Снимок до запроса покрывает строки, которые успеют записаться, пока запрос выполняется
+    buffered = preference_buffer.snapshot(is_users)
     try:
         async with async_session() as session:
             result = await session.scalars(select(UserPreference1).where(UserPreference1.tg_id == tg_id))
-            return result.all()
+            rows = list(result.all())
     except SQLAlchemyError as e:
         print(f"Ошибка при получении данных из UserPreference1: {e}")
-        return []
+        rows = []
+
+    stored_ids = {row.id for row in rows}
+    seen = set()
+    for row in buffered + preference_buffer.snapshot(is_users):
+        if id(row) not in seen and (row.id is None or row.id not in stored_ids):
+            seen.add(id(row))
+            rows.append(row)
+    return rows
 
 # ====== Работа с ContentPlanAnswers ======
+# Ключи анкеты в FSM, которые хранятся в колонках со старыми названиями
+ANSWER_COLUMN_ALIASES = {
+    "main_rubrics_topics": "examples",
+    "content_style": "content_tone",
+}
+
+def _answer_values(data: dict) -> dict:
+    columns = ContentPlanAnswers.__table__.columns
+    values = {}
+    for key, value in data.items():
+        column = ANSWER_COLUMN_ALIASES.get(key, key)
+        # Пустые значения не затирают уже сохраненные ответы
+        if column in columns and column not in ("id", "created_at", "updated_at") and value is not None:
+            values[column] = value
+    return values
+
+def _upsert_statement(values: dict):
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+
+    stmt = insert(ContentPlanAnswers).values(**values)
+    update_values = {key: stmt.excluded[key] for key in values if key != "tg_id"}
+    update_values["updated_at"] = func.now()  # onupdate не срабатывает в ON CONFLICT DO UPDATE
+    return stmt.on_conflict_do_update(index_elements=[ContentPlanAnswers.tg_id], set_=update_values)
+
 async def save_content_plan_answers(data: dict):
     tg_id = data.get("tg_id")
     if not tg_id:
         raise ValueError("tg_id не найден в данных")
 
+    values = _answer_values(data)
     try:
         async with async_session() as session:
-            async with session.begin():
+            stmt = _upsert_statement(values)
+            if stmt is not None:
+                # INSERT ... ON CONFLICT (tg_id) DO UPDATE — один запрос вместо SELECT + INSERT/UPDATE
+                await session.execute(stmt)
+            else:
                 record = await session.scalar(
                     select(ContentPlanAnswers).where(ContentPlanAnswers.tg_id == tg_id)
                 )
-
                 if not record:
-                    new_record = ContentPlanAnswers(**data)
-                    session.add(new_record)
+                    session.add(ContentPlanAnswers(**values))
                 else:
-                    for key, value in data.items():
-                        if hasattr(record, key) and value is not None:
-                            setattr(record, key, value)
-                await session.commit()
+                    for key, value in values.items():
+                        setattr(record, key, value)
+            await session.commit()
     except Exception as e:
         print(f"Ошибка при сохранении данных в ContentPlanAnswers: {e}")
+    await _invalidate_answers(tg_id)
+
+class ContentPlanAnswersRecord(NamedTuple):
+    # Неизменяемая копия строки анкеты: в кэше не держим ORM-объекты и их сессии.
+    # Поля через Optional: аннотации NamedTuple вычисляются (get_type_hints), а X | None есть только с Python 3.10
+    tg_id: int
+    topic_audience: Optional[str]
+    goal: Optional[str]
+    frequency_format: Optional[str]
+    usp: Optional[str]
+    examples: Optional[str]
+    content_tone: Optional[str]
+    specific_topics: Optional[str]
+    updated_at: Optional[datetime]
+
+    @classmethod
+    def from_row(cls, row: ContentPlanAnswers) -> "ContentPlanAnswersRecord":
+        return cls(*(getattr(row, field) for field in cls._fields))
+
+    def to_json(self) -> str:
+        data = self._asdict()
+        data["updated_at"] = self.updated_at.isoformat() if self.updated_at else None
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, value) -> "ContentPlanAnswersRecord":
+        data = json.loads(value)
+        if data["updated_at"]:
+            data["updated_at"] = datetime.fromisoformat(data["updated_at"])
+        return cls(**data)
+
+# Анкета перечитывается при каждой генерации плана и поста — держим ее в кэше по tg_id
+_answers_cache = TTLCache(ANSWERS_CACHE_SIZE, ANSWERS_CACHE_TTL)
+_answers_generation = 0  # Растет при каждом сохранении: чтение, начатое до записи, не кладет в кэш старые данные
+_NO_ANSWERS = "none"  # Запоминаем и отсутствие анкеты
+_redis = None
+answers_cache_stats = {"redis_hits": 0, "db_loads": 0}
+
+def _answers_redis():
+    global _redis
+    if _redis is None and ANSWERS_CACHE_REDIS:
+        from redis.asyncio import Redis
+        _redis = Redis.from_url(REDIS_URL)
+    return _redis
+
+def _answers_key(tg_id: int) -> str:
+    return f"content_bot:answers:{tg_id}"
+
+async def _invalidate_answers(tg_id: int):
+    global _answers_generation
+    _answers_generation += 1
+    _answers_cache.pop(tg_id)
+    redis = _answers_redis()
+    if redis is not None:
+        try:
+            await redis.delete(_answers_key(tg_id))
+        except Exception as e:
+            print(f"Ошибка при сбросе кэша анкеты в Redis: {e}")
+
+def get_answers_cache_stats() -> dict:
+    return {
+        "hits": _answers_cache.hits,
+        "misses": _answers_cache.misses,
+        "size": len(_answers_cache),
+        **answers_cache_stats,
+    }
+
+async def get_content_plan_answers(tg_id: int) -> ContentPlanAnswersRecord | None:
+    cached = _answers_cache.get(tg_id)
+    if cached is not None:
+        return None if cached == _NO_ANSWERS else cached
+
+    generation = _answers_generation
+    redis = _answers_redis()
+    if redis is not None:
+        try:
+            value = await redis.get(_answers_key(tg_id))
+        except Exception as e:
+            print(f"Ошибка при чтении кэша анкеты из Redis: {e}")
+            value = None
+        if value is not None:
+            answers_cache_stats["redis_hits"] += 1
+            record = None if value == _NO_ANSWERS.encode() else ContentPlanAnswersRecord.from_json(value)
+            if generation == _answers_generation:
+                _answers_cache.set(tg_id, record or _NO_ANSWERS)
+            return record
 
-async def get_content_plan_answers(tg_id: int):
     try:
         async with async_session() as session:
             result = await session.scalar(
                 select(ContentPlanAnswers).where(ContentPlanAnswers.tg_id == tg_id)
             )
-            return result
     except Exception as e:
         print(f"Ошибка при получении данных: {e}")
-        return None
\ No newline at end of file
+        return None
+
+    answers_cache_stats["db_loads"] += 1
+    record = ContentPlanAnswersRecord.from_row(result) if result is not None else None
+    if generation == _answers_generation:
+        _answers_cache.set(tg_id, record or _NO_ANSWERS)
+        if redis is not None:
+            try:
+                await redis.set(_answers_key(tg_id), record.to_json() if record else _NO_ANSWERS, ex=int(ANSWERS_CACHE_TTL))
+            except Exception as e:
+                print(f"Ошибка при записи кэша анкеты в Redis: {e}")
+    return record
+
+# ====== Контент-планы и история ======
+# Новая версия плана (поста) — MAX(version) + 1 в той же транзакции; уникальный индекс
+# ловит редкую гонку двух одновременных сохранений, тогда запись повторяется
+VERSION_RETRIES = 3
+
+def _plan_day(row: ContentPlanDay) -> PlanDay:
+    return PlanDay(*(getattr(row, field) for field in PlanDay._fields))
+
+async def save_content_plan(tg_id: int, days: list[PlanDay]) -> tuple[int, int] | None:
+    # План и все его дни записываются одной транзакцией очередной версией пользователя;
+    # возвращает (id плана, версия)
+    title = days[0].topic_title[:200] if days else ""
+    for attempt in range(VERSION_RETRIES):
+        try:
+            async with async_session() as session:
+                version = await session.scalar(
+                    select(func.coalesce(func.max(ContentPlan.version), 0)).where(ContentPlan.tg_id == tg_id)
+                )
+                plan = ContentPlan(tg_id=tg_id, version=version + 1, title=title)
+                session.add(plan)
+                await session.flush()
+                session.add_all(ContentPlanDay(plan_id=plan.id, **day._asdict()) for day in days)
+                await session.commit()
+                return plan.id, plan.version
+        except IntegrityError:
+            continue
+        except SQLAlchemyError as e:
+            print(f"Ошибка при сохранении контент-плана: {e}")
+            return None
+    print(f"Не удалось выбрать версию контент-плана для {tg_id}")
+    return None
+
+async def get_content_plan_day(plan_id: int, day_number: int) -> PlanDay | None:
+    try:
+        async with async_session() as session:
+            row = await session.scalar(
+                select(ContentPlanDay).where(ContentPlanDay.plan_id == plan_id, ContentPlanDay.day_number == day_number)
+            )
+            return _plan_day(row) if row is not None else None
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении дня контент-плана: {e}")
+        return None
+
+async def get_content_plan_days(plan_id: int) -> list[PlanDay]:
+    try:
+        async with async_session() as session:
+            rows = await session.scalars(
+                select(ContentPlanDay).where(ContentPlanDay.plan_id == plan_id).order_by(ContentPlanDay.day_number)
+            )
+            return [_plan_day(row) for row in rows]
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении контент-плана: {e}")
+        return []
+
+async def save_content_posts(plan_id: int, posts: dict[int, str]):
+    # Посты плана по номерам дней; повторная генерация добавляет новую версию поста
+    if not posts:
+        return
+    packed = {day_number: compress_text(text) for day_number, text in posts.items()}
+    for attempt in range(VERSION_RETRIES):
+        try:
+            async with async_session() as session:
+                rows = await session.execute(
+                    select(ContentPost.day_number, func.max(ContentPost.version))
+                    .where(ContentPost.plan_id == plan_id, ContentPost.day_number.in_(posts))
+                    .group_by(ContentPost.day_number)
+                )
+                versions = dict(rows.all())
+                session.add_all(
+                    ContentPost(plan_id=plan_id, day_number=day_number, version=versions.get(day_number, 0) + 1,
+                                codec=codec, body=body)
+                    for day_number, (codec, body) in packed.items()
+                )
+                await session.commit()
+                return
+        except IntegrityError:
+            continue
+        except SQLAlchemyError as e:
+            print(f"Ошибка при сохранении постов контент-плана: {e}")
+            return
+    print(f"Не удалось выбрать версии постов плана {plan_id}")
+
+class PlanHistoryItem(NamedTuple):
+    id: int
+    version: int
+    title: str
+    created_at: datetime
+
+async def get_plan_history(tg_id: int, before_version: int | None = None, limit: int = 5) -> list[PlanHistoryItem]:
+    # Страница истории от новых к старым: поиск по индексу (tg_id, version) с условием
+    # version < before_version вместо OFFSET; дни планов не читаются
+    query = select(ContentPlan.id, ContentPlan.version, ContentPlan.title, ContentPlan.created_at).where(
+        ContentPlan.tg_id == tg_id
+    )
+    if before_version is not None:
+        query = query.where(ContentPlan.version < before_version)
+    try:
+        async with async_session() as session:
+            rows = await session.execute(query.order_by(ContentPlan.version.desc()).limit(limit))
+            return [PlanHistoryItem(*row) for row in rows]
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении истории планов: {e}")
+        return []
+
+async def get_plan_version(tg_id: int, version: int) -> tuple[int, list[PlanDay]] | None:
+    # (id плана, дни) для версии пользователя; чужой план по номеру версии не найти
+    try:
+        async with async_session() as session:
+            rows = (await session.execute(
+                select(ContentPlan.id, ContentPlanDay)
+                .join(ContentPlanDay, ContentPlanDay.plan_id == ContentPlan.id)
+                .where(ContentPlan.tg_id == tg_id, ContentPlan.version == version)
+                .order_by(ContentPlanDay.day_number)
+            )).all()
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении версии контент-плана: {e}")
+        return None
+    return (rows[0][0], [_plan_day(row[1]) for row in rows]) if rows else None
+
+async def get_latest_posts(plan_id: int) -> dict[int, str]:
+    # Последняя версия поста для каждого дня плана
+    latest = (
+        select(ContentPost.day_number, func.max(ContentPost.version).label("version"))
+        .where(ContentPost.plan_id == plan_id)
+        .group_by(ContentPost.day_number)
+        .subquery()
+    )
+    try:
+        async with async_session() as session:
+            rows = await session.execute(
+                select(ContentPost.day_number, ContentPost.codec, ContentPost.body)
+                .join(latest, (ContentPost.day_number == latest.c.day_number) & (ContentPost.version == latest.c.version))
+                .where(ContentPost.plan_id == plan_id)
+                .order_by(ContentPost.day_number)
+            )
+            rows = rows.all()
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении постов контент-плана: {e}")
+        return {}
+    return {row.day_number: decompress_text(row.codec, row.body) for row in rows}
+
+# ====== Кэш ответов ИИ ======
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+async def get_cached_generation(key: str, max_age: float) -> str | None:
+    try:
+        async with async_session() as session:
+            return await session.scalar(
+                select(GenerationCache.content).where(
+                    GenerationCache.key == key,
+                    GenerationCache.created_at >= _utcnow() - timedelta(seconds=max_age)
+                )
+            )
+    except SQLAlchemyError as e:
+        print(f"Ошибка при чтении кэша генераций: {e}")
+        return None
+
+async def save_cached_generation(key: str, content: str):
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                await session.merge(GenerationCache(key=key, content=content, created_at=_utcnow()))
+    except SQLAlchemyError as e:
+        print(f"Ошибка при сохранении кэша генераций: {e}")
+
+async def delete_expired_generations(max_age: float) -> int:
+    # Устаревшие ответы уже не читаются, но merge перезаписывает только тот же ключ — без чистки таблица только растет
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                result = await session.execute(
+                    delete(GenerationCache).where(GenerationCache.created_at < _utcnow() - timedelta(seconds=max_age))
+                )
+                return result.rowcount or 0
+    except SQLAlchemyError as e:
+        print(f"Ошибка при очистке кэша генераций: {e}")
+        return 0
+
+# ====== Подписи анкет для поиска похожих ======
+async def save_brief_signatures(rows: list[tuple[int, str, bytes]]):
+    # rows — (tg_id, схема, подпись); одна транзакция на пачку
+    if not rows:
+        return
+    try:
+        async with async_session() as session:
+            async with session.begin():
+                for tg_id, scheme, signature in rows:
+                    await session.merge(BriefSignature(tg_id=tg_id, scheme=scheme, signature=signature, updated_at=_utcnow()))
+    except SQLAlchemyError as e:
+        print(f"Ошибка при сохранении подписей анкет: {e}")
+
+async def get_brief_signatures(scheme: str, since: datetime | None = None) -> list[tuple[int, bytes, datetime]]:
+    # Подписи текущей схемы, измененные начиная с since (все — при since=None)
+    query = select(BriefSignature.tg_id, BriefSignature.signature, BriefSignature.updated_at).where(
+        BriefSignature.scheme == scheme
+    )
+    if since is not None:
+        query = query.where(BriefSignature.updated_at >= since)
+    try:
+        async with async_session() as session:
+            return [tuple(row) for row in await session.execute(query)]
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении подписей анкет: {e}")
+        return []
+
+async def get_unsigned_answers(scheme: str, after_id: int, limit: int) -> list[tuple[int, ContentPlanAnswersRecord]]:
+    # Анкеты без подписи текущей схемы, по возрастанию id: (id, анкета)
+    query = (
+        select(ContentPlanAnswers)
+        .outerjoin(BriefSignature, (BriefSignature.tg_id == ContentPlanAnswers.tg_id) & (BriefSignature.scheme == scheme))
+        .where(BriefSignature.tg_id.is_(None), ContentPlanAnswers.id > after_id)
+        .order_by(ContentPlanAnswers.id)
+        .limit(limit)
+    )
+    try:
+        async with async_session() as session:
+            return [(row.id, ContentPlanAnswersRecord.from_row(row)) for row in await session.scalars(query)]
+    except SQLAlchemyError as e:
+        print(f"Ошибка при получении анкет без подписи: {e}")
+        return []
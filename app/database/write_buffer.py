@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    # Копит строки в памяти и записывает их пачкой: когда набралось max_rows строк
+    # или через max_delay секунд после первой строки пачки. Пока строка не записана,
+    # ее можно увидеть через snapshot() — так чтение сразу видит свои же записи.
+
+    def __init__(self, write: Callable[[list], Awaitable[None]], max_rows: int = 100,
+                 max_delay: float = 0.2, max_pending: int = 10000):
+        self.write = write
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_pending = max_pending  # Если БД недоступна долго, старые строки отбрасываются
+        self.flushes = 0
+        self._pending: list = []
+        self._in_flight: list = []
+        # Создается при первой записи: в Python 3.9 Lock привязывается к циклу событий при создании,
+        # а буфер создается при импорте, до asyncio.run()
+        self._lock: asyncio.Lock | None = None
+        self._timer: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._in_flight)
+
+    def add(self, row) -> None:
+        self._pending.append(row)
+        if len(self._pending) >= self.max_rows:
+            self._spawn(self.flush())
+        elif self._timer is None:
+            self._timer = self._spawn(self._flush_later())
+
+    def snapshot(self, predicate: Callable[[object], bool]) -> list:
+        # Незаписанные строки, включая пачку, которая пишется прямо сейчас
+        return [row for row in self._in_flight + self._pending if predicate(row)]
+
+    def _spawn(self, coro: Awaitable) -> asyncio.Task:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.max_delay)
+        finally:
+            self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self._pending:
+                batch = self._pending[:self.max_rows]
+                del self._pending[:len(batch)]
+                self._in_flight = batch
+                try:
+                    await self.write(batch)
+                    self.flushes += 1
+                except Exception as e:
+                    logger.error("Не удалось записать пачку из %s строк: %s", len(batch), e)
+                    self._pending[:0] = batch
+                    overflow = len(self._pending) - self.max_pending
+                    if overflow > 0:
+                        logger.error("Буфер записи переполнен, отброшено %s строк", overflow)
+                        del self._pending[:overflow]
+                    if self._timer is None and self._pending:
+                        self._timer = self._spawn(self._flush_later())
+                    return
+                finally:
+                    self._in_flight = []
+
+    async def close(self) -> None:
+        # Записывает все, что осталось в буфере (вызывается при остановке бота)
+        if self._timer is not None:
+            self._timer.cancel()
+        await self.flush()
@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app.metrics import metrics
+from app.utils.cache import TTLCache, SingleFlight
+from app.utils.markdown_utils import render_markdown
+from app.utils.plan_utils import PlanDay
+from config import EXPORT_WORKERS, EXPORT_CACHE_SIZE, EXPORT_FONT_PATH, EXPORT_BOLD_FONT_PATH
+
+EXPORT_FORMATS = ("pdf", "md")
+
+# Подписи полей дня — те же, что в сообщениях бота (render_plan_day)
+DAY_LABELS = (
+    ("description", "Краткое описание:"),
+    ("cta", "Призыв к действию (СТА):"),
+    ("hashtags", "Хэштеги:"),
+    ("visuals", "Визуальные материалы:"),
+)
+
+# Готовые файлы по хэшу содержимого плана: повторный экспорт того же плана не верстается заново
+_cache = TTLCache(maxsize=EXPORT_CACHE_SIZE, ttl=24 * 3600)
+_in_flight = SingleFlight()
+_pool: ProcessPoolExecutor | None = None
+
+
+def plan_to_markdown(version: int, days: list[PlanDay], posts: dict[int, str]) -> str:
+    lines = [f"# Контент-план v{version}", ""]
+    for day in days:
+        lines += [f"## {day.day_title}", ""]
+        if day.topic_title:
+            lines += [f"**{day.topic_title}**", ""]
+        for field, label in DAY_LABELS:
+            value = getattr(day, field)
+            if value:
+                lines += [f"**{label}** {value}", ""]
+    if posts:
+        titles = {day.day_number: day.day_title for day in days}
+        lines += ["# Посты", ""]
+        for day_number, text in posts.items():
+            lines += [f"## {titles.get(day_number, f'День {day_number}')}", "", text.strip(), ""]
+    return "\n".join(lines)
+
+
+def pdf_safe(text: str) -> str:
+    # fpdf 1.7 падает на символах вне BMP (эмодзи), их в PDF не выводим
+    return "".join(char for char in text if ord(char) <= 0xFFFF)
+
+
+def render_pdf(version: int, days: list[tuple], posts: dict[int, str], font_path: str, bold_font_path: str) -> bytes:
+    # Выполняется в процессе пула: верстка fpdf целиком на CPU и не должна занимать цикл событий.
+    # Аргументы — простые типы (дни как кортежи), чтобы дешево передаваться через pickle
+    from fpdf import FPDF
+
+    days = [PlanDay(*day) for day in days]
+    pdf = FPDF()
+    pdf.set_auto_page_break(True, margin=15)
+    # Кириллице нужен Unicode-шрифт; по умолчанию DejaVu из системного пакета fonts-dejavu
+    pdf.add_font("DejaVu", "", font_path, uni=True)
+    pdf.add_font("DejaVu", "B", bold_font_path if os.path.exists(bold_font_path) else font_path, uni=True)
+    pdf.add_page()
+
+    def write(text: str, size: int = 11, bold: bool = False, height: float = 6):
+        pdf.set_font("DejaVu", "B" if bold else "", size)
+        pdf.multi_cell(0, height, pdf_safe(text))
+
+    write(f"Контент-план v{version}", 18, bold=True, height=10)
+    for day in days:
+        pdf.ln(4)
+        write(day.day_title, 14, bold=True, height=8)
+        if day.topic_title:
+            write(day.topic_title, bold=True)
+        for field, label in DAY_LABELS:
+            value = getattr(day, field)
+            if value:
+                pdf.ln(1)
+                write(label, bold=True)
+                write(value)
+
+    if posts:
+        titles = {day.day_number: day.day_title for day in days}
+        pdf.add_page()
+        write("Посты", 18, bold=True, height=10)
+        for day_number, text in posts.items():
+            pdf.ln(4)
+            write(titles.get(day_number, f"День {day_number}"), 14, bold=True, height=8)
+            # Разметка модели (**, _, #) снимается тем же разбором, что и для сообщений
+            write(render_markdown(text).text)
+
+    return pdf.output(dest="S").encode("latin-1")
+
+
+def export_key(fmt: str, version: int, days: list[PlanDay], posts: dict[int, str]) -> str:
+    payload = json.dumps([fmt, version, days, sorted(posts.items())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _start_method() -> str:
+    # forkserver порождает воркеры форком чистого процесса-сервера, а не бота с его потоками (логирование)
+    # и открытыми соединениями. На Windows его нет — там spawn
+    return "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    # Пул создается при первом экспорте (или при прогреве)
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=EXPORT_WORKERS, mp_context=multiprocessing.get_context(_start_method()))
+    return _pool
+
+
+async def export_plan(fmt: str, version: int, days: list[PlanDay], posts: dict[int, str]) -> bytes:
+    # Файл плана в формате fmt ("pdf" или "md"). Одинаковые одновременные экспорты
+    # объединяются, готовый результат берется из кэша по хэшу содержимого
+    key = export_key(fmt, version, days, posts)
+    data = _cache.get(key)
+    if data is not None:
+        return data
+
+    async def render() -> bytes:
+        with metrics.stage(f"export_{fmt}"):
+            if fmt == "md":
+                result = plan_to_markdown(version, days, posts).encode("utf-8")
+            else:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    _get_pool(), render_pdf, version, [tuple(day) for day in days], posts,
+                    EXPORT_FONT_PATH, EXPORT_BOLD_FONT_PATH,
+                )
+        _cache.set(key, result)
+        return result
+
+    return await _in_flight.do(key, render)
+
+
+async def warm_up_export_pool():
+    # Запуск рабочих процессов (и forkserver) занимает около 0.1 с цикла событий — делаем это при старте,
+    # а не на первом экспорте пользователя
+    pool = _get_pool()
+    await asyncio.gather(*(asyncio.get_running_loop().run_in_executor(pool, os.getpid) for _ in range(EXPORT_WORKERS)))
+
+
+def close_export_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
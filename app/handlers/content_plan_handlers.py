@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import logging
 import os
 import asyncio
@@ -6,19 +8,31 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from app.utils.markdown_utils import escape_markdown_v2 as escape_markdown
-from app.utils.message_utils import split_text
+from app.utils.markdown_utils import render_markdown, FormattedText
+from app.utils.message_utils import split_formatted, ThrottledEditor
+from app.utils.sender import chat_lock
 
 # Импорты из других модулей
-from app.utils.prompt_templates import CONTENT_PLAN_PROMPT, POST_GENERATION_PROMPT
-from app.database.requests import save_content_plan_answers
+from app.utils.prompt_templates import (CONTENT_PLAN_SYSTEM_PROMPT, POST_SYSTEM_PROMPT, POST_MAX_WORDS, PLAN_DAYS,
+                                        content_plan_user_template, post_user_template)
+from app.database.requests import (save_content_plan_answers, save_content_plan, get_content_plan_day,
+                                   get_content_plan_days, save_content_posts, get_content_plan_answers,
+                                   get_plan_history, get_plan_version, save_user_preference)
 # from app.handlers.general_handlers import router as general_router # Обычно не нужен прямой импорт роутера в том же приложении
-from app.keyboards.main_kb import get_content_plan_actions_keyboard # Возвращена к простой клавиатуре
-from app.ai_generate import generate
-from app.utils.post_utils import parse_formatted_plan_for_post # Только парсинг первого дня
+from app.keyboards.main_kb import get_content_plan_actions_keyboard, get_reuse_plan_keyboard # Возвращена к простой клавиатуре
+from app.ai_generate import complete, stream_generate, stream_plan_days, generation_error_message, TruncatedResponse
+from app.routing import route_for
+from app.utils.plan_utils import PlanDay, render_plan_day
+from app.scheduler import scheduler, QUEUED, DUPLICATE, REJECTED
+from app.speculation import speculative_posts
+from app.brief_index import brief_index, brief_text, stale_days
+from app.metrics import metrics
+from app.utils.log_utils import Truncated, log_body
+from config import POST_BATCH_CONCURRENCY, BRIEF_REUSE_SHARED
 
 
 router = Router()
+logger = logging.getLogger(__name__)
 
 # FSM для создания контент-плана
 class FSMContentPlan(StatesGroup):
@@ -63,6 +77,12 @@ QUESTIONS = [
     "✅ Анонс мероприятий и конференций, связанных с ИТС, в которых участвуют преподаватели и студенты."
 ]
 
+async def save_answer(message: Message, state: FSMContext, field: str) -> dict:
+    # Ответ идет в данные FSM и в историю ответов UserPreference1 (она пишется пачками через буфер записи)
+    if message.text:
+        await save_user_preference(message.from_user.id, field, message.text)
+    return await state.update_data({field: message.text})
+
 @router.message(Command("content_plan"))
 async def cmd_content_plan(message: Message, state: FSMContext):
     await state.set_state(FSMContentPlan.topic_audience)
@@ -71,88 +91,208 @@ async def cmd_content_plan(message: Message, state: FSMContext):
 # === Последовательная обработка состояний ===
 @router.message(FSMContentPlan.topic_audience)
 async def ask_goal(message: Message, state: FSMContext):
-    await state.update_data(topic_audience=message.text)
+    await save_answer(message, state, "topic_audience")
     await state.set_state(FSMContentPlan.goal)
     await message.answer(QUESTIONS[1])
 
 @router.message(FSMContentPlan.goal)
 async def ask_frequency_format(message: Message, state: FSMContext):
-    await state.update_data(goal=message.text)
+    await save_answer(message, state, "goal")
     await state.set_state(FSMContentPlan.frequency_format)
     await message.answer(QUESTIONS[2])
 
 @router.message(FSMContentPlan.frequency_format)
 async def ask_usp(message: Message, state: FSMContext):
-    await state.update_data(frequency_format=message.text)
+    await save_answer(message, state, "frequency_format")
     await state.set_state(FSMContentPlan.usp)
     await message.answer(QUESTIONS[3])
 
 @router.message(FSMContentPlan.usp)
 async def ask_main_rubrics_topics(message: Message, state: FSMContext):
-    await state.update_data(usp=message.text)
+    await save_answer(message, state, "usp")
     await state.set_state(FSMContentPlan.main_rubrics_topics)
     await message.answer(QUESTIONS[4])
 
 @router.message(FSMContentPlan.main_rubrics_topics)
 async def ask_content_style(message: Message, state: FSMContext):
-    await state.update_data(main_rubrics_topics=message.text)
+    await save_answer(message, state, "main_rubrics_topics")
     await state.set_state(FSMContentPlan.content_style)
     await message.answer(QUESTIONS[5])
 
 @router.message(FSMContentPlan.content_style)
 async def ask_specific_topics(message: Message, state: FSMContext):
-    await state.update_data(content_style=message.text)
+    await save_answer(message, state, "content_style")
     await state.set_state(FSMContentPlan.specific_topics)
     await message.answer(QUESTIONS[6])
 
+async def send_markdown_parts(message: Message, text: str, label: str, first_message: Message | None = None) -> bool:
+    # Переводит разметку модели в сущности Telegram и отправляет текст частями
+    with metrics.stage("render_markdown"):
+        formatted = render_markdown(text)
+    return await send_formatted_parts(message, formatted, label, first_message)
+
+async def send_formatted_parts(message: Message, formatted: FormattedText, label: str, first_message: Message | None = None) -> bool:
+    # Отправляет текст с сущностями частями; первую часть можно поместить в уже существующее сообщение (first_message)
+    # Части уходят по порядку и подряд; паузы по лимитам Telegram и повторы после
+    # flood control выполняет rate_limiter в сессии бота
+    with metrics.stage("split"):
+        parts = split_formatted(formatted, 4096)
+
+    async with chat_lock(message.chat.id):
+        for i, part in enumerate(parts):
+            try:
+                logger.info("Attempting to send %s part %s/%s (length: %s chars, %s entities).",
+                            label, i + 1, len(parts), len(part.text), len(part.entities))
+                log_body(logger, "Part content:\n---\n%s\n---", part.text)
+
+                with metrics.stage("telegram_send"):
+                    if i == 0 and first_message is not None:
+                        await first_message.edit_text(part.text, entities=part.entities)
+                    else:
+                        await message.answer(part.text, entities=part.entities)
+            except Exception as e:
+                metrics.error("telegram_send", e)
+                logger.error("Telegram API Error sending %s part %s: %s", label, i + 1, e, exc_info=True)
+                logger.error("Problematic %s part content:\n---\n%s\n---", label, Truncated(part.text))
+                return False
+    return True
+
+def queue_position_text(position: int) -> str:
+    return f"⏳ Вы #{position} в очереди на генерацию. Сообщение обновится, когда очередь дойдет до вас."
+
+async def submit_generation(tg_id: int, kind: str, run, progress: ThrottledEditor) -> bool:
+    # Ставит генерацию в общую очередь; обработчик апдейта сразу освобождается
+    async def on_position(position: int):
+        await progress.update(queue_position_text(position))
+
+    result, position = scheduler.submit(tg_id, kind, run, on_position=on_position)
+    if result == DUPLICATE:
+        await progress.update("⏳ Генерация уже идет — дождитесь результата.", force=True)
+        return False
+    if result == REJECTED:
+        await progress.update("Сейчас слишком много запросов. Пожалуйста, попробуйте через несколько минут.", force=True)
+        return False
+    if result == QUEUED:
+        await progress.update(queue_position_text(position), force=True)
+    return True
+
 @router.message(FSMContentPlan.specific_topics)
 async def finish_content_plan(message: Message, state: FSMContext):
-    data = await state.update_data(specific_topics=message.text)
+    data = await save_answer(message, state, "specific_topics")
     data["tg_id"] = message.from_user.id
+    speculative_posts.discard(message.from_user.id)  # Пост к предыдущему плану больше не нужен
 
+    # Прошлая анкета нужна, чтобы понять, какие дни ее плана затронула новая
+    previous = await get_content_plan_answers(message.from_user.id) if brief_index.enabled else None
     await save_content_plan_answers(data)
-    
-    await message.answer("⏳ Ожидайте ваш план генерируется...")
-
-    from jinja2 import Template
-    template = Template(CONTENT_PLAN_PROMPT)
-    prompt = template.render(
-        topic_audience=data['topic_audience'],
-        goal=data['goal'],
-        frequency_format=data['frequency_format'],
-        usp=data['usp'],
-        main_rubrics_topics=data['main_rubrics_topics'],
-        content_style=data['content_style'],
-        specific_topics=data['specific_topics']
-    )
+    if brief_index.enabled and await offer_similar_plan(message, state, data, previous):
+        return
 
-    generated_plan_text = await generate(prompt)
+    status_message = await message.answer("⏳ Ожидайте ваш план генерируется...")
+    progress = ThrottledEditor(status_message)
 
-    # Сохраняем весь сгенерированный текст плана в FSMContext
-    await state.update_data(last_generated_plan_text=generated_plan_text)
-    await state.update_data(original_plan_data=data) # Сохраняем исходные данные пользователя для генерации поста
+    await submit_generation(
+        message.from_user.id, "plan",
+        lambda: generate_content_plan(message, state, data, progress),
+        progress
+    )
+
+async def offer_similar_plan(message: Message, state: FSMContext, data: dict, previous) -> bool:
+    # Похожая анкета с готовым планом: вместо генерации всей недели предлагаем взять план за основу.
+    # Выбор обрабатывается в edit_plan_handler (reuse_plan:*)
+    tg_id = message.from_user.id
+    for source_id, similarity in await brief_index.remember(tg_id, data):
+        if source_id != tg_id and not BRIEF_REUSE_SHARED:
+            continue
+        latest = await get_plan_history(source_id, None, 1)
+        plan = await get_plan_version(source_id, latest[0].version) if latest else None
+        if plan is None:
+            continue
+
+        source = previous if source_id == tg_id else await get_content_plan_answers(source_id)
+        stale = stale_days(plan[1], brief_text(source._asdict()), brief_text(data)) if source else []
+        if len(stale) == len(plan[1]):
+            stale = []  # Затронута вся неделя — выгоднее новый план
+        await state.update_data(reuse_source=source_id, reuse_version=latest[0].version, reuse_stale=stale)
+
+        if source_id == tg_id:
+            text = f"🔁 Анкета почти совпадает с вашей прошлой ({similarity:.0%}) — по ней уже есть план v{latest[0].version}."
+        else:
+            text = f"🔁 Похожая анкета ({similarity:.0%}) уже есть у другого канала, и по ней готов контент-план."
+        text += " Его можно взять за основу и не ждать генерацию всей недели."
+        if stale:
+            text += f"\n\nОтличия анкеты затрагивают дни: {', '.join(map(str, stale))} — их можно переписать отдельно."
+        await message.answer(text, reply_markup=get_reuse_plan_keyboard(stale))
+        return True
+    return False
+
+async def generate_content_plan(message: Message, state: FSMContext, data: dict, progress: ThrottledEditor):
+    await progress.update("⏳ Ожидайте ваш план генерируется...", force=True)
+
+    with metrics.stage("prompt_render"):
+        prompt = content_plan_user_template.render(
+            topic_audience=data['topic_audience'],
+            goal=data['goal'],
+            frequency_format=data['frequency_format'],
+            usp=data['usp'],
+            main_rubrics_topics=data['main_rubrics_topics'],
+            content_style=data['content_style'],
+            specific_topics=data['specific_topics']
+        )
+
+    # Каждый день отправляется отдельным сообщением, как только модель закрыла его JSON-объект
+    plan_days = []
+    truncated = False
+    try:
+        async for day in stream_plan_days(prompt, CONTENT_PLAN_SYSTEM_PROMPT):
+            plan_days.append(day)
+            with metrics.stage("render_plan_day"):
+                formatted_day = render_plan_day(day)
+            if not await send_formatted_parts(message, formatted_day, "content plan"):
+                await message.answer("Произошла ошибка при отправке части контент-плана. Сообщите разработчику и попробуйте позже.")
+                await state.clear()
+                return
+            await progress.update(f"⏳ План генерируется... Готово дней: {len(plan_days)}")
+    except TruncatedResponse as e:
+        # Отправленные дни остаются и сохраняются; пользователь узнает, что план неполный
+        logger.warning("Контент-план оборвался после %s дней: %s", len(plan_days), e)
+        truncated = True
+        if not plan_days:
+            await progress.update(generation_error_message(e), force=True)
+            await state.clear()
+            return
+    except Exception as e:
+        logger.error("Ошибка при потоковой генерации контент-плана: %s", e, exc_info=True)
+        await message.answer(generation_error_message(e))
+        await state.clear()
+        return
 
-    parts = split_text(generated_plan_text, 4096)
+    if not plan_days:
+        await progress.update("Модель не вернула содержание. Попробуйте еще раз.", force=True)
+        await state.clear()
+        return
 
-    for i, part in enumerate(parts):
-        try:
-            # Повторно применяем escape_markdown к каждой части
-            final_part_to_send = escape_markdown(part) 
-            
-            logging.info(f"Attempting to send part {i+1}/{len(parts)} (length: {len(final_part_to_send)} bytes).")
-            logging.debug(f"Part content:\n---\n{final_part_to_send}\n---") 
+    # План сохраняется в БД очередной версией, в FSMContext — только id плана.
+    # Ответы анкеты уже лежат в данных состояния — отдельная копия для генерации поста не нужна
+    saved = await save_content_plan(data["tg_id"], plan_days)
+    if saved is None:
+        await progress.update("✅ Контент-план сгенерирован, но сохранить его не удалось — пример поста создать не получится.", force=True)
+        await state.clear()
+        return
+    plan_id, version = saved
+    await state.update_data(plan_id=plan_id)
+    # Пока пользователь читает план, в фоне готовим пример поста для первого дня (если включено)
+    speculative_posts.start(data["tg_id"], plan_id, build_post_prompt(data, plan_days[0]), POST_SYSTEM_PROMPT)
 
-            await message.answer(final_part_to_send, parse_mode="MarkdownV2")
-        except Exception as e:
-            logging.error(f"Telegram API Error sending part {i+1}: {e}", exc_info=True)
-            logging.error(f"Problematic part content (full):\n---\n{final_part_to_send}\n---") 
-            await message.answer("Произошла ошибка при отправке части контент-плана. Сообщите разработчику и попробуйте позже.")
-            await state.clear() 
-            return 
+    if truncated:
+        await progress.update(f"⚠️ Ответ модели оборвался: готово дней — {len(plan_days)} из {PLAN_DAYS}. "
+                              f"Недостающие дни можно получить, создав план заново: /content_plan", force=True)
+    else:
+        await progress.update("✅ Контент-план сгенерирован", force=True)
 
     await message.answer(
         "Контент-план готов! Хотите создать пример поста? 💻",
-        reply_markup=get_content_plan_actions_keyboard() # Возвращена старая клавиатура
+        reply_markup=get_content_plan_actions_keyboard(version) # Возвращена старая клавиатура
     )
     # НЕ ОЧИЩАЕМ state, пока пользователь не выберет действие (например, сгенерировать пост)
     # await state.clear()
@@ -163,52 +303,153 @@ async def handle_generate_example_post_callback(callback: CallbackQuery, state:
     await callback.answer("Генерирую пример поста...", show_alert=False) # Уведомление для пользователя
     
     user_data = await state.get_data()
-    generated_plan_text = user_data.get("last_generated_plan_text")
-    original_plan_data = user_data.get("original_plan_data")
+    plan_id = user_data.get("plan_id")
 
-    if not generated_plan_text or not original_plan_data:
+    if not plan_id or not user_data.get("topic_audience"):
         await callback.message.answer("Не могу найти сгенерированный контент-план или исходные данные. Пожалуйста, создайте его сначала.")
         await state.clear()
         return
 
-    # Извлекаем данные для первого дня из сгенерированного плана
-    day_1_data = parse_formatted_plan_for_post(generated_plan_text)
+    # Первый день плана — из сохраненной версии по первичному ключу
+    day_1 = await get_content_plan_day(plan_id, 1)
 
-    if not day_1_data:
-        await callback.message.answer("Не удалось извлечь данные для первого дня из контент-плана. Возможно, формат изменился.")
-        await state.clear() # Очищаем состояние при ошибке парсинга
+    if not day_1:
+        await callback.message.answer("Не удалось найти первый день контент-плана. Пожалуйста, создайте план заново.")
+        await state.clear()
         return
 
-    # Формируем промт для генерации поста
-    from jinja2 import Template
-    post_template = Template(POST_GENERATION_PROMPT)
-    
-    # Объединяем данные для поста (day_data) и исходные данные канала (original_plan_data)
-    post_prompt_data = {
-        **original_plan_data, # Все исходные данные канала
-        "day_data": day_1_data # Детали конкретного дня
-    }
-    post_prompt = post_template.render(**post_prompt_data)
-
-    await callback.message.answer("⏳ Генерирую пост...")
-
-    # Генерируем пост (повторно используем функцию generate)
-    generated_post_text = await generate(post_prompt)
-
-    # Делим пост на части, если он слишком длинный
-    post_parts = split_text(generated_post_text, 4096)
-
-    for i, part in enumerate(post_parts):
-        try:
-            final_post_part_to_send = escape_markdown(part) 
-            logging.info(f"Attempting to send post part {i+1}/{len(post_parts)} (length: {len(final_post_part_to_send)} bytes).")
-            logging.debug(f"Post part content:\n---\n{final_post_part_to_send}\n---") 
-            await callback.message.answer(final_post_part_to_send, parse_mode="MarkdownV2")
-        except Exception as e:
-            logging.error(f"Telegram API Error sending post part {i+1}: {e}", exc_info=True)
-            logging.error(f"Problematic post part content (full):\n---\n{final_post_part_to_send}\n---")
-            await callback.message.answer("Произошла ошибка при отправке части поста. Сообщите разработчику и попробуйте позже.")
-            await state.clear() # Очищаем состояние при ошибке
-            return
+    post_prompt = build_post_prompt(user_data, day_1)
+
+    status_message = await callback.message.answer("⏳ Генерирую пост...")
+
+    # Пост мог быть сгенерирован заранее — тогда отвечаем сразу, без очереди
+    ready_post = speculative_posts.take(callback.from_user.id, plan_id)
+    if ready_post:
+        await deliver_post(callback.message, state, plan_id, ready_post.strip(), status_message)
+        return
+
+    progress = ThrottledEditor(status_message)
+
+    await submit_generation(
+        callback.from_user.id, "post",
+        lambda: generate_example_post(callback.message, state, plan_id, post_prompt, progress),
+        progress
+    )
 
+def build_post_prompt(user_data: dict, day: PlanDay) -> str:
+    # Объединяем данные для поста (day_data) и исходные данные канала (ответы анкеты из состояния);
+    # к ним добавляется общий системный промт POST_SYSTEM_PROMPT
+    with metrics.stage("prompt_render"):
+        return post_user_template.render(**{
+            **user_data, # Все исходные данные канала
+            "day_data": day._asdict() # Детали конкретного дня
+        })
+
+async def generate_example_post(message: Message, state: FSMContext, plan_id: int, post_prompt: str, live_preview: ThrottledEditor):
+    await live_preview.update("⏳ Генерирую пост...", force=True)
+    status_message = live_preview.message
+
+    # Черновик поста показываем прямо в сообщении-статусе, редактируя его по мере генерации
+    raw_post = ""
+    try:
+        async for delta in stream_generate(post_prompt, POST_SYSTEM_PROMPT, route=route_for("post", POST_MAX_WORDS)):
+            raw_post += delta
+            preview = raw_post.replace("**", "").strip()
+            if preview:
+                await live_preview.update(preview[:4000] + " ▌")
+    except Exception as e:
+        logger.error("Ошибка при потоковой генерации поста: %s", e, exc_info=True)
+        await status_message.edit_text(generation_error_message(e))
+        await state.clear()
+        return
+
+    generated_post_text = raw_post.strip()
+    if not generated_post_text:
+        await status_message.edit_text("Модель не вернула содержание. Попробуйте еще раз.")
+        await state.clear()
+        return
+
+    await deliver_post(message, state, plan_id, generated_post_text, status_message)
+
+async def deliver_post(message: Message, state: FSMContext, plan_id: int, post_text: str, status_message: Message):
+    # Итоговый пост заменяет черновик; если он слишком длинный, остальные части идут отдельными сообщениями
+    if not await send_markdown_parts(message, post_text, "post", first_message=status_message):
+        await message.answer("Произошла ошибка при отправке части поста. Сообщите разработчику и попробуйте позже.")
+        await state.clear() # Очищаем состояние при ошибке
+        return
+
+    await save_content_posts(plan_id, {1: post_text})
     await state.clear() # Очищаем состояние после успешной генерации поста
+
+# Хэндлер для кнопки "Создать посты на всю неделю"
+@router.callback_query(F.data == "generate_all_posts")
+async def handle_generate_all_posts_callback(callback: CallbackQuery, state: FSMContext):
+    await callback.answer("Генерирую посты на неделю...", show_alert=False)
+
+    user_data = await state.get_data()
+    plan_id = user_data.get("plan_id")
+
+    if not plan_id or not user_data.get("topic_audience"):
+        await callback.message.answer("Не могу найти сгенерированный контент-план или исходные данные. Пожалуйста, создайте его сначала.")
+        await state.clear()
+        return
+
+    # Заранее сгенерированный пост первого дня не генерируется заново; если он еще в работе,
+    # запрос дня 1 присоединится к нему через кэш ответов
+    ready_post = (speculative_posts.take(callback.from_user.id, plan_id) or "").strip()
+
+    days = await get_content_plan_days(plan_id)
+    if not days:
+        await callback.message.answer("Не удалось найти дни контент-плана. Пожалуйста, создайте план заново.")
+        await state.clear()
+        return
+
+    status_message = await callback.message.answer(f"⏳ Генерирую посты: 0 из {len(days)}...")
+    progress = ThrottledEditor(status_message)
+
+    await submit_generation(
+        callback.from_user.id, "all_posts",
+        lambda: generate_all_posts(callback.message, state, plan_id, user_data, days, progress,
+                                   {1: ready_post} if ready_post else {}),
+        progress
+    )
+
+async def generate_all_posts(message: Message, state: FSMContext, plan_id: int, user_data: dict,
+                             days: list[PlanDay], progress: ThrottledEditor, ready: dict[int, str]):
+    # Промты всех дней отправляются параллельно (не больше POST_BATCH_CONCURRENCY сразу); каждый запрос
+    # сверх первого занимает свое место общего лимита генераций (scheduler.slot), так что пакет не обходит
+    # GENERATION_CONCURRENCY. Каждый пост уходит в чат, как только готов, — порядок дней может не сохраняться
+    await progress.update(f"⏳ Генерирую посты: 0 из {len(days)}...", force=True)
+    semaphore = asyncio.Semaphore(POST_BATCH_CONCURRENCY)
+
+    async def generate_day_post(day: PlanDay) -> tuple[PlanDay, str | None]:
+        if day.day_number in ready:
+            return day, ready[day.day_number]
+        async with semaphore, scheduler.slot():
+            try:
+                return day, await complete(build_post_prompt(user_data, day), POST_SYSTEM_PROMPT,
+                                           route=route_for("post", POST_MAX_WORDS))
+            except Exception as e:
+                logger.error("Ошибка при генерации поста для дня %s: %s", day.day_number, e, exc_info=True)
+                return day, None
+
+    posts = {}
+    failed = []
+    for finished in asyncio.as_completed([generate_day_post(day) for day in days]):
+        day, post_text = await finished
+        post_text = (post_text or "").strip()
+        if not post_text:
+            failed.append(day.day_title)
+            continue
+        posts[day.day_number] = post_text
+        if not await send_markdown_parts(message, f"**{day.day_title}**\n{post_text}", "post"):
+            failed.append(day.day_title)
+        await progress.update(f"⏳ Генерирую посты: {len(posts)} из {len(days)}...")
+
+    await save_content_posts(plan_id, posts)
+
+    if failed:
+        await progress.update(f"Готово постов: {len(posts)} из {len(days)}. Не получилось: {', '.join(failed)}. Попробуйте еще раз позже.", force=True)
+    else:
+        await progress.update(f"✅ Все посты готовы: {len(posts)}", force=True)
+    await state.clear()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import StatesGroup, State
+
+from app.ai_generate import regenerate_plan_day, generation_error_message
+from app.database.requests import (get_plan_history, get_plan_version, get_latest_posts, get_content_plan_answers,
+                                   save_content_plan, save_content_posts)
+from app.handlers.content_plan_handlers import send_formatted_parts, submit_generation, generate_content_plan
+from app.keyboards.main_kb import (get_edit_days_keyboard, get_edit_fields_keyboard, get_export_keyboard,
+                                   get_content_plan_actions_keyboard)
+from app.utils.message_utils import ThrottledEditor
+from app.utils.plan_utils import PlanDay, EDITABLE_FIELDS, render_plan_day
+from app.utils.prompt_templates import EDIT_DAY_SYSTEM_PROMPT, edit_day_user_template
+from app.metrics import metrics
+from app.scheduler import scheduler
+
+# Правка сохраненного плана: перегенерируется только выбранный день или одно его поле.
+# Результат сохраняется новой версией плана (история не меняется), в чат уходит только измененный день.
+# Здесь же — план по похожей анкете (reuse_plan:*): копия готового плана или правка отличающихся дней
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# Ответ «-» — без пожеланий
+SKIP_WISHES = "-"
+
+
+class FSMEditPlan(StatesGroup):
+    wishes = State()
+
+
+async def send_days_keyboard(message: Message, tg_id: int, version: int | None):
+    if version is None:
+        latest = await get_plan_history(tg_id, None, 1)
+        if not latest:
+            await message.answer("У вас пока нет сохраненных контент-планов. Создать план: /content_plan")
+            return
+        version = latest[0].version
+    plan = await get_plan_version(tg_id, version)
+    if plan is None:
+        await message.answer(f"План v{version} не найден. Список планов: /history")
+        return
+    await message.answer(f"✏️ Какой день плана v{version} изменить?", reply_markup=get_edit_days_keyboard(version, plan[1]))
+
+
+@router.message(Command('edit'))
+async def cmd_edit(message: Message, command: CommandObject):
+    # /edit [версия]; по умолчанию — последний план
+    arg = (command.args or "").strip().lstrip("v")
+    if arg and not arg.isdigit():
+        await message.answer("Использование: /edit [номер версии из /history]")
+        return
+    await send_days_keyboard(message, message.from_user.id, int(arg) if arg else None)
+
+
+@router.callback_query(F.data.startswith("edit_plan:"))
+async def handle_edit_plan(callback: CallbackQuery):
+    await callback.answer()
+    await send_days_keyboard(callback.message, callback.from_user.id, int(callback.data.split(":", 1)[1]))
+
+
+@router.callback_query(F.data.startswith("edit_days:"))
+async def handle_edit_days(callback: CallbackQuery):
+    # «Другой день» — список дней в том же сообщении
+    version = int(callback.data.split(":", 1)[1])
+    plan = await get_plan_version(callback.from_user.id, version)
+    await callback.answer()
+    if plan is not None:
+        await callback.message.edit_text(f"✏️ Какой день плана v{version} изменить?",
+                                         reply_markup=get_edit_days_keyboard(version, plan[1]))
+
+
+@router.callback_query(F.data.startswith("edit_day:"))
+async def handle_edit_day(callback: CallbackQuery):
+    _, version, day_number = callback.data.split(":")
+    await callback.answer()
+    await callback.message.edit_text(f"✏️ День {day_number} плана v{version}: что переписать?",
+                                     reply_markup=get_edit_fields_keyboard(int(version), int(day_number)))
+
+
+@router.callback_query(F.data.startswith("edit_field:"))
+async def handle_edit_field(callback: CallbackQuery, state: FSMContext):
+    _, version, day_number, field = callback.data.split(":")
+    field = None if field == "all" else field
+    if field is not None and field not in EDITABLE_FIELDS:
+        await callback.answer()
+        return
+    await callback.answer()
+    # Данные анкеты и plan_id в состоянии сохраняются — кнопки постов продолжают работать
+    await state.update_data(edit_version=int(version), edit_day=int(day_number), edit_field=field)
+    await state.set_state(FSMEditPlan.wishes)
+    await callback.message.edit_text(
+        f"✏️ День {day_number} плана v{version}. Напишите, что изменить (например: «тема про стажировки», "
+        f"«короче и с вопросом к подписчикам»), или отправьте «{SKIP_WISHES}», чтобы просто получить новый вариант."
+    )
+
+
+@router.message(FSMEditPlan.wishes)
+async def finish_edit(message: Message, state: FSMContext):
+    data = await state.get_data()
+    await state.set_state(None)
+    wishes = (message.text or "").strip()
+    if wishes == SKIP_WISHES:
+        wishes = ""
+
+    status_message = await message.answer("⏳ Переписываю день...")
+    progress = ThrottledEditor(status_message)
+
+    await submit_generation(
+        message.from_user.id, "edit",
+        lambda: edit_plan_day(message, state, data["edit_version"], data["edit_day"], data["edit_field"], wishes, progress),
+        progress
+    )
+
+
+def build_edit_prompt(answers, days: list[PlanDay], day: PlanDay, field: str | None, wishes: str) -> str:
+    # Только текущий день целиком; от остальных — заголовки тем, чтобы не повторяться
+    with metrics.stage("prompt_render"):
+        return edit_day_user_template.render(
+            answers=answers,
+            other_days=[other for other in days if other.day_number != day.day_number],
+            day_json=json.dumps({name: getattr(day, name) for name in EDITABLE_FIELDS}, ensure_ascii=False),
+            field=field,
+            wishes=wishes,
+        )
+
+
+async def edit_plan_day(message: Message, state: FSMContext, version: int, day_number: int, field: str | None,
+                        wishes: str, progress: ThrottledEditor):
+    tg_id = message.from_user.id
+    await progress.update(f"⏳ Переписываю день {day_number}...", force=True)
+
+    plan_id, days = await get_plan_version(tg_id, version) or (None, [])
+    day = next((d for d in days if d.day_number == day_number), None)
+    if day is None:
+        await progress.update(f"День {day_number} плана v{version} не найден. Список планов: /history", force=True)
+        return
+
+    prompt = build_edit_prompt(await get_content_plan_answers(tg_id), days, day, field, wishes)
+    try:
+        edited = await regenerate_plan_day(prompt, EDIT_DAY_SYSTEM_PROMPT, day, field)
+    except Exception as e:
+        logger.error("Ошибка при правке дня %s плана v%s: %s", day_number, version, e, exc_info=True)
+        await progress.update(generation_error_message(e), force=True)
+        return
+    if edited is None:
+        await progress.update("Модель не вернула подходящий вариант. Попробуйте еще раз.", force=True)
+        return
+
+    saved = await save_content_plan(tg_id, [edited if d.day_number == day_number else d for d in days])
+    if saved is None:
+        await progress.update("День переписан, но сохранить план не удалось. Попробуйте позже.", force=True)
+        return
+    new_plan_id, new_version = saved
+
+    # Посты остальных дней переходят в новую версию без генерации; пост измененного дня устарел
+    posts = await get_latest_posts(plan_id)
+    posts.pop(day_number, None)
+    await save_content_posts(new_plan_id, posts)
+    # Кнопки постов под только что созданным планом теперь работают с исправленной версией
+    if (await state.get_data()).get("plan_id") == plan_id:
+        await state.update_data(plan_id=new_plan_id)
+
+    if not await send_formatted_parts(message, render_plan_day(edited), "content plan"):
+        await progress.update("Произошла ошибка при отправке дня. Полный план: /history", force=True)
+        return
+    await progress.update(f"✅ {edited.day_title} обновлен — план v{new_version}", force=True,
+                          reply_markup=get_export_keyboard(new_version))
+
+
+@router.callback_query(F.data.startswith("reuse_plan:"))
+async def handle_reuse_plan(callback: CallbackQuery, state: FSMContext):
+    action = callback.data.split(":", 1)[1]
+    data = await state.get_data()
+    if "reuse_source" not in data or not data.get("topic_audience"):
+        await callback.answer("Анкета не найдена. Начните заново: /content_plan", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.edit_reply_markup(reply_markup=None)  # Выбор делается один раз
+
+    tg_id = callback.from_user.id
+    message = callback.message
+    status_message = await message.answer("⏳ Готовлю контент-план...")
+    progress = ThrottledEditor(status_message)
+
+    if action == "new":
+        data["tg_id"] = tg_id
+        await submit_generation(tg_id, "plan", lambda: generate_content_plan(message, state, data, progress), progress)
+        return
+
+    plan = await get_plan_version(data["reuse_source"], data["reuse_version"])
+    if plan is None:
+        await progress.update("Похожий план больше не найден. Создайте новый: /content_plan", force=True)
+        return
+    if action == "copy":
+        # Копия готового плана — модель не вызывается, очередь генераций не нужна
+        await reuse_plan(message, state, tg_id, plan[1], [], progress)
+        return
+    await submit_generation(
+        tg_id, "plan",
+        lambda: reuse_plan(message, state, tg_id, plan[1], data["reuse_stale"], progress),
+        progress
+    )
+
+
+async def reuse_plan(message: Message, state: FSMContext, tg_id: int, days: list[PlanDay], stale: list[int],
+                     progress: ThrottledEditor):
+    # План похожей анкеты становится новой версией плана пользователя; дни из stale
+    # переписываются под его анкету тем же коротким запросом, что и правка одного дня
+    refreshed = {}
+    if stale:
+        await progress.update(f"⏳ Переписываю дни: {', '.join(map(str, stale))}...", force=True)
+        answers = await get_content_plan_answers(tg_id)
+        wishes = "Анкета канала изменилась — перепишите день под новые параметры канала."
+        if answers is not None and (answers.examples or answers.specific_topics):
+            wishes += f" Рубрики: {answers.examples or '-'}. Обязательные идеи: {answers.specific_topics or '-'}."
+
+        async def refresh(day: PlanDay) -> PlanDay | None:
+            # Дни обновляются параллельно, но каждый запрос занимает место общего лимита генераций
+            try:
+                async with scheduler.slot():
+                    return await regenerate_plan_day(build_edit_prompt(answers, days, day, None, wishes),
+                                                     EDIT_DAY_SYSTEM_PROMPT, day)
+            except Exception as e:
+                logger.error("Ошибка при обновлении дня %s похожего плана: %s", day.day_number, e, exc_info=True)
+                return None
+
+        results = await asyncio.gather(*(refresh(day) for day in days if day.day_number in stale))
+        refreshed = {day.day_number: day for day in results if day is not None}
+        days = [refreshed.get(day.day_number, day) for day in days]
+
+    saved = await save_content_plan(tg_id, days)
+    if saved is None:
+        await progress.update("Не удалось сохранить контент-план. Попробуйте позже.", force=True)
+        return
+    plan_id, version = saved
+    await state.update_data(plan_id=plan_id)
+
+    for day in days:
+        if not await send_formatted_parts(message, render_plan_day(day), "content plan"):
+            await progress.update("Произошла ошибка при отправке контент-плана. Попробуйте позже.", force=True)
+            return
+    note = f", обновлено дней: {len(refreshed)} из {len(stale)}" if stale else ""
+    await progress.update(f"✅ Контент-план v{version} готов{note}", force=True)
+    await message.answer(
+        "Контент-план готов! Хотите создать пример поста? 💻",
+        reply_markup=get_content_plan_actions_keyboard(version)
+    )
@@ -20,6 +20,9 @@ async def cmd_help(message: Message):
     await message.answer(
         text="‼️ Здесь хранится информация по использованию бота:\n\n"
              "Создать план: /content_plan\n"
+             "Мои планы: /history\n"
+             "Изменить день плана: /edit\n"
+             "Скачать план файлом: /export [pdf|md]\n"
              "Как устроен бот: /structure\n")
 
 
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import logging
+
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery, BufferedInputFile
+from aiogram.filters import Command, CommandObject
+
+from app.database.requests import get_plan_history, get_plan_version, get_latest_posts
+from app.handlers.content_plan_handlers import send_formatted_parts, send_markdown_parts
+from app.export import EXPORT_FORMATS, export_plan
+from app.keyboards.main_kb import get_history_keyboard, get_export_keyboard
+from app.utils.plan_utils import render_plan_day
+from config import HISTORY_PAGE_SIZE
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+async def history_page(tg_id: int, before_version: int | None):
+    # На страницу берем на одну запись больше: так без COUNT(*) видно, есть ли следующая
+    items = await get_plan_history(tg_id, before_version, HISTORY_PAGE_SIZE + 1)
+    next_before = items[HISTORY_PAGE_SIZE - 1].version if len(items) > HISTORY_PAGE_SIZE else None
+    return items[:HISTORY_PAGE_SIZE], next_before
+
+
+@router.message(Command('history'))
+async def cmd_history(message: Message):
+    items, next_before = await history_page(message.from_user.id, None)
+    if not items:
+        await message.answer("У вас пока нет сохраненных контент-планов. Создать план: /content_plan")
+        return
+    await message.answer(
+        "🗂 Ваши контент-планы (новые сверху). Выберите план, чтобы получить его еще раз:",
+        reply_markup=get_history_keyboard(items, next_before, first_page=True),
+    )
+
+
+@router.callback_query(F.data.startswith("history_page:"))
+async def handle_history_page(callback: CallbackQuery):
+    value = callback.data.split(":", 1)[1]
+    before_version = int(value) if value else None
+    items, next_before = await history_page(callback.from_user.id, before_version)
+    await callback.answer()
+    if items:
+        await callback.message.edit_reply_markup(
+            reply_markup=get_history_keyboard(items, next_before, first_page=before_version is None)
+        )
+
+
+@router.callback_query(F.data.startswith("history_plan:"))
+async def handle_history_plan(callback: CallbackQuery):
+    version = int(callback.data.split(":", 1)[1])
+    plan = await get_plan_version(callback.from_user.id, version)
+    if plan is None:
+        await callback.answer("План не найден", show_alert=True)
+        return
+    await callback.answer(f"Отправляю план v{version}")
+
+    # План и посты берутся из БД — модель не вызывается
+    plan_id, days = plan
+    posts = await get_latest_posts(plan_id)
+    message = callback.message
+    await message.answer(f"📋 Контент-план v{version}:", reply_markup=get_export_keyboard(version))
+    for day in days:
+        if not await send_formatted_parts(message, render_plan_day(day), "content plan"):
+            await message.answer("Произошла ошибка при отправке контент-плана. Попробуйте позже.")
+            return
+    titles = {day.day_number: day.day_title for day in days}
+    for day_number, post_text in posts.items():
+        await send_markdown_parts(message, f"**{titles.get(day_number, f'День {day_number}')}**\n{post_text}", "post")
+
+
+async def send_export(message: Message, tg_id: int, fmt: str, version: int | None):
+    # Весь план (и последние посты) одним документом; модель не вызывается
+    if version is None:
+        latest = await get_plan_history(tg_id, None, 1)
+        if not latest:
+            await message.answer("У вас пока нет сохраненных контент-планов. Создать план: /content_plan")
+            return
+        version = latest[0].version
+    plan = await get_plan_version(tg_id, version)
+    if plan is None:
+        await message.answer(f"План v{version} не найден. Список планов: /history")
+        return
+
+    plan_id, days = plan
+    posts = await get_latest_posts(plan_id)
+    try:
+        data = await export_plan(fmt, version, days, posts)
+    except Exception as e:
+        logger.error("Ошибка при экспорте плана v%s в %s: %s", version, fmt, e, exc_info=True)
+        await message.answer("Не удалось подготовить файл. Попробуйте другой формат или позже.")
+        return
+    await message.answer_document(BufferedInputFile(data, filename=f"content_plan_v{version}.{fmt}"))
+
+
+@router.message(Command('export'))
+async def cmd_export(message: Message, command: CommandObject):
+    # /export [pdf|md] [версия]; по умолчанию — последний план в PDF
+    fmt, version = "pdf", None
+    for arg in (command.args or "").split():
+        if arg.lower() in EXPORT_FORMATS:
+            fmt = arg.lower()
+        elif arg.lstrip("v").isdigit():
+            version = int(arg.lstrip("v"))
+        else:
+            await message.answer("Использование: /export [pdf|md] [номер версии из /history]")
+            return
+    await send_export(message, message.from_user.id, fmt, version)
+
+
+@router.callback_query(F.data.startswith("export:"))
+async def handle_export(callback: CallbackQuery):
+    _, fmt, version = callback.data.split(":")
+    if fmt not in EXPORT_FORMATS:
+        await callback.answer()
+        return
+    await callback.answer("Готовлю файл...")
+    await send_export(callback.message, callback.from_user.id, fmt, int(version))
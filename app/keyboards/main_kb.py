@@ -1,10 +1,88 @@
+from __future__ import annotations
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-def get_content_plan_actions_keyboard() -> InlineKeyboardMarkup:
+def get_content_plan_actions_keyboard(version: int) -> InlineKeyboardMarkup:
     buttons = [
         [
             InlineKeyboardButton(text="Создать пример поста 💻", callback_data="generate_example_post")
+        ],
+        [
+            InlineKeyboardButton(text="Создать посты на всю неделю 🗓", callback_data="generate_all_posts")
+        ],
+        [
+            InlineKeyboardButton(text="Изменить день ✏️", callback_data=f"edit_plan:{version}")
+        ]
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def get_history_keyboard(items, next_before: int | None, first_page: bool) -> InlineKeyboardMarkup:
+    # items — PlanHistoryItem; версия в callback_data, план ищется по (tg_id, version)
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"v{item.version} · {item.created_at:%d.%m.%Y} · {item.title[:40]}",
+            callback_data=f"history_plan:{item.version}",
+        )]
+        for item in items
+    ]
+    navigation = []
+    if not first_page:
+        navigation.append(InlineKeyboardButton(text="⏮ К новым", callback_data="history_page:"))
+    if next_before is not None:
+        navigation.append(InlineKeyboardButton(text="Старше ➡️", callback_data=f"history_page:{next_before}"))
+    if navigation:
+        buttons.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def get_export_keyboard(version: int) -> InlineKeyboardMarkup:
+    buttons = [
+        [
+            InlineKeyboardButton(text="Скачать PDF 📄", callback_data=f"export:pdf:{version}"),
+            InlineKeyboardButton(text="Скачать .md 📝", callback_data=f"export:md:{version}"),
+        ],
+        [
+            InlineKeyboardButton(text="Изменить день ✏️", callback_data=f"edit_plan:{version}"),
         ]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
+# Поля дня, которые можно переписать по отдельности; None — весь день
+EDIT_FIELD_BUTTONS = (
+    (None, "Весь день 🔄"),
+    ("topic_title", "Тема"),
+    ("description", "Описание"),
+    ("cta", "Призыв к действию"),
+    ("hashtags", "Хэштеги"),
+    ("visuals", "Визуал"),
+)
+
+def get_edit_days_keyboard(version: int, days) -> InlineKeyboardMarkup:
+    # days — PlanDay сохраненной версии плана
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"{day.day_title} · {day.topic_title}"[:60],
+            callback_data=f"edit_day:{version}:{day.day_number}",
+        )]
+        for day in days
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def get_edit_fields_keyboard(version: int, day_number: int) -> InlineKeyboardMarkup:
+    buttons = [
+        InlineKeyboardButton(text=text, callback_data=f"edit_field:{version}:{day_number}:{field or 'all'}")
+        for field, text in EDIT_FIELD_BUTTONS
+    ]
+    rows = [buttons[:1]] + [buttons[i:i + 2] for i in range(1, len(buttons), 2)]
+    rows.append([InlineKeyboardButton(text="⬅️ Другой день", callback_data=f"edit_days:{version}")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def get_reuse_plan_keyboard(stale_days: list[int]) -> InlineKeyboardMarkup:
+    # Похожая анкета уже есть: взять ее план, переписать только затронутые дни или создать новый
+    buttons = [[InlineKeyboardButton(text="Взять план за основу 📋", callback_data="reuse_plan:copy")]]
+    if stale_days:
+        buttons.append([InlineKeyboardButton(
+            text=f"Обновить дни {', '.join(map(str, stale_days))} ✏️", callback_data="reuse_plan:diff"
+        )])
+    buttons.append([InlineKeyboardButton(text="Новый план с нуля 🆕", callback_data="reuse_plan:new")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+
+import httpx
+from openai import (AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, AuthenticationError,
+                    NotFoundError, PermissionDeniedError, RateLimitError, InternalServerError)
+
+from app.metrics import metrics
+from config import (AI_TOKEN, LLM_PROVIDERS, LLM_MAX_CONNECTIONS, LLM_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY,
+                    LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY, LLM_HEDGE,
+                    LLM_HEDGE_DELAY, LLM_HEDGE_MIN_SAMPLES, LLM_WARM_CONNECTIONS)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROVIDERS = [
+    {"name": "openrouter", "base_url": "https://openrouter.ai/api/v1", "model": "google/gemini-2.5-flash-preview-05-20"},
+]
+
+# Ошибки, после которых тот же запрос имеет смысл повторить: 429, 5xx, обрыв соединения, таймаут
+RETRYABLE_ERRORS = (RateLimitError, InternalServerError, APIConnectionError, APITimeoutError)
+# Ошибки конкретного провайдера (ключ, доступ, модель) — повтор не поможет, но следующий провайдер может ответить
+PROVIDER_ERRORS = (AuthenticationError, PermissionDeniedError, NotFoundError)
+
+
+class LatencyWindow:
+    # Последние замеры задержки провайдера; p95 служит порогом для дублирующего запроса
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> float | None:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Provider:
+    # Один OpenAI-совместимый endpoint со своим пулом соединений
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        )
+        # Повторы делает LLMClient (с джиттером и переключением провайдеров), встроенные отключены
+        self.client = AsyncOpenAI(base_url=base_url, api_key=api_key, http_client=self.http, max_retries=0)
+        self.latency = LatencyWindow()  # Полный ответ
+        self.first_token_latency = LatencyWindow()  # Первый фрагмент потока
+
+    def __repr__(self) -> str:
+        return f"Provider({self.name}, {self.model})"
+
+
+def load_providers() -> list[Provider]:
+    # LLM_PROVIDERS — JSON-список {"name", "base_url", "model", "api_key" или "api_key_env"} в порядке приоритета
+    configs = json.loads(LLM_PROVIDERS) if LLM_PROVIDERS else DEFAULT_PROVIDERS
+    providers = []
+    for i, cfg in enumerate(configs):
+        api_key = cfg.get("api_key") or (os.getenv(cfg["api_key_env"]) if cfg.get("api_key_env") else AI_TOKEN)
+        providers.append(Provider(cfg.get("name", f"provider{i}"), cfg["base_url"], api_key, cfg["model"]))
+    return providers
+
+
+def retry_delay(attempt: int, error: Exception | None = None) -> float:
+    # Экспоненциальная пауза с полным джиттером; Retry-After от провайдера имеет приоритет
+    if isinstance(error, APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), LLM_RETRY_MAX_DELAY)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+class LLMClient:
+    # Запросы к списку провайдеров: повторы на 429/5xx с джиттером, переход к следующему
+    # провайдеру, когда повторы исчерпаны, и (по желанию) дублирующий запрос,
+    # если ответ задерживается дольше p95 обычной задержки.
+
+    def __init__(self, providers: list[Provider], hedge: bool = False):
+        if not providers:
+            raise ValueError("Не задан ни один провайдер LLM")
+        self.providers = providers
+        self.hedge = hedge
+        self.stats = {"requests": 0, "retries": 0, "failovers": 0, "hedged": 0, "hedge_wins": 0}
+
+    @property
+    def model(self) -> str:
+        return self.providers[0].model
+
+    async def warm_up(self):
+        # Заранее открываем TCP/TLS-соединения, чтобы первый запрос пользователя их не ждал
+        async def touch(provider: Provider):
+            try:
+                await provider.http.head(provider.base_url.rstrip("/") + "/models")
+            except httpx.HTTPError as e:
+                logger.warning("Не удалось прогреть соединение с %s: %s", provider.name, e)
+
+        await asyncio.gather(*(touch(p) for p in self.providers for _ in range(LLM_WARM_CONNECTIONS)))
+        logger.info("Соединения с провайдерами LLM прогреты: %s", ", ".join(p.name for p in self.providers))
+
+    async def close(self):
+        for provider in self.providers:
+            await provider.http.aclose()
+
+    async def create(self, messages: list[dict], models: dict | None = None, **params):
+        # Полный ответ (chat.completions.create без stream). models — модели по имени провайдера
+        # вместо заданных в LLM_PROVIDERS (маршрут задачи, app/routing.py)
+        async def attempt(provider: Provider):
+            started = time.monotonic()
+            completion = await provider.client.chat.completions.create(
+                model=(models or {}).get(provider.name, provider.model), messages=messages, **params
+            )
+            provider.latency.add(time.monotonic() - started)
+            return completion
+
+        return await self._call(attempt, lambda p: p.latency)
+
+    async def stream(self, messages: list[dict], models: dict | None = None, **params):
+        # Поток фрагментов. Повторы и дублирование касаются только ожидания первого фрагмента:
+        # после того как текст пошел пользователю, запрос уже не переключается.
+        async def attempt(provider: Provider):
+            started = time.monotonic()
+            stream = await provider.client.chat.completions.create(
+                model=(models or {}).get(provider.name, provider.model), messages=messages, stream=True, **params
+            )
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await stream.close()
+                raise
+            provider.first_token_latency.add(time.monotonic() - started)
+            return stream, first
+
+        stream, first = await self._call(attempt, lambda p: p.first_token_latency, on_discard=_close_stream)
+        try:
+            if first is not None:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.close()
+
+    async def _call(self, attempt, window, on_discard=None):
+        self.stats["requests"] += 1
+        last_error = None
+        for index, provider in enumerate(self.providers):
+            if index:
+                self.stats["failovers"] += 1
+                logger.warning("Переключаемся на провайдера %s после ошибки: %s", provider.name, last_error)
+            backup = self.providers[index + 1] if index + 1 < len(self.providers) else provider
+            for retry in range(LLM_MAX_RETRIES + 1):
+                if retry:
+                    self.stats["retries"] += 1
+                    delay = retry_delay(retry - 1, last_error)
+                    logger.warning("Повтор запроса к %s через %.1f с (попытка %s): %s", provider.name, delay, retry + 1, last_error)
+                    await asyncio.sleep(delay)
+                try:
+                    if self.hedge:
+                        return await self._hedged(attempt, provider, backup, window(provider), on_discard)
+                    return await attempt(provider)
+                except RETRYABLE_ERRORS as e:
+                    metrics.error(f"llm_attempt:{provider.name}", e)
+                    last_error = e
+                except PROVIDER_ERRORS as e:
+                    metrics.error(f"llm_attempt:{provider.name}", e)
+                    last_error = e
+                    break
+        raise last_error
+
+    async def _hedged(self, attempt, primary: Provider, backup: Provider, window: LatencyWindow, on_discard):
+        # Если основной запрос не ответил за p95, параллельно отправляется запасной; побеждает первый успешный
+        if len(window) >= LLM_HEDGE_MIN_SAMPLES:
+            delay = window.percentile(0.95)
+        else:
+            delay = LLM_HEDGE_DELAY
+
+        main = asyncio.ensure_future(attempt(primary))
+        done, _ = await asyncio.wait({main}, timeout=delay)
+        if done:
+            return main.result()
+
+        self.stats["hedged"] += 1
+        logger.info("%s не ответил за %.1f с — дублируем запрос в %s", primary.name, delay, backup.name)
+        hedge = asyncio.ensure_future(attempt(backup))
+        pending = {main, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.stats["hedge_wins"] += 1
+                        for other in done - {task}:
+                            if other.exception() is None and on_discard is not None:
+                                await on_discard(other.result())
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+async def _close_stream(result):
+    stream, _ = result
+    await stream.close()
+
+
+llm = LLMClient(load_providers(), hedge=LLM_HEDGE)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import bisect
+import logging
+import time
+from contextlib import nullcontext
+
+from aiohttp import web
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (сек.): от быстрых шагов обработки текста до минутных генераций
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names + extra[:1], values + extra[1:])]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, *labels):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # labels -> [счетчики корзин..., больше всех границ, sum, count]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 3)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, ('le', '+Inf'))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {self.value}"]
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Metrics:
+    # Метрики процесса в формате Prometheus. Когда сбор выключен, все методы
+    # сразу возвращаются (stage() отдает общий пустой контекст), так что хуки в коде почти бесплатны.
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.update_seconds = Histogram("bot_update_seconds", "Обработка апдейта целиком", ("update_type",))
+        self.handler_seconds = Histogram("bot_handler_seconds", "Время работы хэндлера", ("handler",))
+        self.stage_seconds = Histogram("bot_stage_seconds", "Этапы генерации и отправки", ("stage",))
+        self.errors = Counter("bot_errors_total", "Ошибки по месту и типу", ("where", "type"))
+        self.tokens = Counter("bot_llm_tokens_total", "Токены LLM по видам", ("kind",))
+        self.route_seconds = Histogram("bot_llm_route_seconds", "Ответ модели по задачам (app/routing.py)", ("route",))
+        self.route_tokens = Counter("bot_llm_route_tokens_total", "Токены LLM по задачам", ("route", "kind"))
+        self.route_truncated = Counter("bot_llm_route_truncated_total", "Ответы, обрезанные по max_tokens", ("route",))
+        self.speculative_posts = Counter("bot_speculative_posts_total",
+                                         "Предварительные посты: started, skipped_busy, hits, pending_hits, discarded",
+                                         ("event",))
+        self.speculative_wasted_tokens = Counter("bot_speculative_wasted_tokens_total",
+                                                 "Completion-токены отброшенных предварительных постов")
+        self.speculative_hit_rate = Gauge("bot_speculative_hit_rate",
+                                          "Доля предварительных постов, дождавшихся нажатия кнопки")
+        self._null = nullcontext()
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return self._null
+        return _StageTimer(self.stage_seconds, (name,))
+
+    def observe_stage(self, name: str, seconds: float):
+        if self.enabled:
+            self.stage_seconds.observe(seconds, name)
+
+    def error(self, where: str, error: BaseException):
+        if self.enabled:
+            self.errors.inc(1, where, type(error).__name__)
+
+    def add_tokens(self, prompt: int, cached: int, completion: int):
+        if self.enabled:
+            self.tokens.inc(prompt, "prompt")
+            self.tokens.inc(cached, "cached")
+            self.tokens.inc(completion, "completion")
+
+    def observe_route(self, route: str, seconds: float, prompt: int, completion: int, truncated: bool):
+        if self.enabled:
+            self.route_seconds.observe(seconds, route)
+            self.route_tokens.inc(prompt, route, "prompt")
+            self.route_tokens.inc(completion, route, "completion")
+            if truncated:
+                self.route_truncated.inc(1, route)
+
+    def observe_speculation(self, stat: str, amount: int, hit_rate: float):
+        # stat — ключ SpeculativePosts.stats
+        if self.enabled:
+            if stat == "wasted_tokens":
+                self.speculative_wasted_tokens.inc(amount)
+            else:
+                self.speculative_posts.inc(amount, stat)
+            self.speculative_hit_rate.set(hit_rate)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.update_seconds, self.handler_seconds, self.stage_seconds, self.errors, self.tokens,
+                       self.route_seconds, self.route_tokens, self.route_truncated,
+                       self.speculative_posts, self.speculative_wasted_tokens, self.speculative_hit_rate):
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start_server(self, host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner | None:
+        # Отдельный локальный порт с GET /metrics; без METRICS_ENABLED ничего не запускается
+        if not self.enabled:
+            return None
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info("Метрики доступны на http://%s:%s/metrics", host, port)
+        return runner
+
+
+metrics = Metrics(METRICS_ENABLED)
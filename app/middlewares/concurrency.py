@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    # Ограничивает число одновременно обрабатываемых апдейтов и позволяет
+    # при остановке дождаться тех, что уже в работе (например, идущих генераций)
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        # Semaphore и Event создаются уже в работающем цикле событий: в Python 3.9 они привязываются
+        # к циклу при создании, а middleware создается при импорте run.py, до asyncio.run()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = 0
+        self._idle: Optional[asyncio.Event] = None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        self._in_flight += 1
+        try:
+            if self.limit <= 0:
+                return await handler(event, data)
+            if self._semaphore is None:
+                self._semaphore = asyncio.Semaphore(self.limit)
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight and self._idle is not None:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        if not self._in_flight:
+            return True
+        if self._idle is None or self._idle.is_set():
+            self._idle = asyncio.Event()
+        logger.info("Ожидание завершения %s апдейтов (до %s с)...", self._in_flight, timeout)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались %s апдейтов за %s с", self._in_flight, timeout)
+            return False
+        return True
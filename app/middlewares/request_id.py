@@ -0,0 +1,24 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from app.utils.log_utils import request_id_var
+
+
+class RequestIdMiddleware(BaseMiddleware):
+    # Внешний middleware: каждая запись лога, сделанная при обработке апдейта
+    # (и в задачах генерации, запущенных из него), получает request_id = номер апдейта
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        request_id = str(event.update_id) if isinstance(event, Update) else "-"
+        token = request_id_var.set(request_id)
+        try:
+            return await handler(event, data)
+        finally:
+            request_id_var.reset(token)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import logging
+import math
+from typing import NamedTuple
+
+from app.llm import llm, LatencyWindow
+from app.metrics import metrics
+from config import LLM_ROUTES, LLM_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# Таблица маршрутов по типу задачи. Бюджет ответа считается от запрошенного размера:
+# (base + per_unit × размер) × TOKEN_MARGIN, где размер — дни плана или слова поста.
+# model — модель основного провайдера для этой задачи (строка) или {имя провайдера: модель};
+# без model задача идет в модели из LLM_PROVIDERS. LLM_ROUTES (JSON) переопределяет поля по задачам:
+#   LLM_ROUTES={"post": {"model": "google/gemini-2.0-flash-001", "timeout": 60}}
+DEFAULT_ROUTES = {
+    "plan": {"base": 150, "per_unit": 400, "timeout": 180},  # Размер — число дней; день в JSON по-русски ≈ 200–400 токенов
+    "post": {"base": 100, "per_unit": 3, "timeout": 90},  # Размер — максимум слов; слово по-русски ≈ 2–3 токена
+    "edit": {"base": 100, "per_unit": 220, "timeout": 45},  # Один день плана
+    "edit_field": {"base": 120, "per_unit": 0, "timeout": 30},  # Одно поле дня
+}
+# Запас на многословные ответы: недельный план получает ≈ 4400 токенов — не меньше прежних 4000
+TOKEN_MARGIN = 1.5
+MAX_TOKENS_LIMIT = 8000
+
+
+class Route(NamedTuple):
+    task: str
+    models: dict  # Имя провайдера -> модель; провайдеры без записи отвечают своей моделью
+    max_tokens: int
+    timeout: float
+
+    def cache_params(self) -> dict:
+        # В ключ кэша ответа: бюджет и, если задача идет не в модель по умолчанию, ее модели
+        params = {"max_tokens": self.max_tokens}
+        if self.models:
+            params["models"] = self.models
+        return params
+
+    def widened(self) -> "Route":
+        # Маршрут для повтора обрезанного ответа: бюджет вдвое больше, в пределах MAX_TOKENS_LIMIT
+        return self._replace(max_tokens=min(self.max_tokens * 2, MAX_TOKENS_LIMIT))
+
+
+def load_routes() -> dict[str, dict]:
+    routes = {task: dict(params) for task, params in DEFAULT_ROUTES.items()}
+    for task, params in (json.loads(LLM_ROUTES) if LLM_ROUTES else {}).items():
+        routes.setdefault(task, {"base": 0, "per_unit": 0, "timeout": LLM_TIMEOUT}).update(params)
+    for params in routes.values():
+        model = params.pop("model", None)
+        # Строка — модель основного провайдера: резервные провайдеры отвечают своими, заведомо доступными моделями
+        params["models"] = {llm.providers[0].name: model} if isinstance(model, str) else dict(model or {})
+    return routes
+
+
+_routes = load_routes()
+
+
+def route_for(task: str, size: int = 1) -> Route:
+    params = _routes[task]
+    max_tokens = math.ceil((params["base"] + params["per_unit"] * size) * TOKEN_MARGIN)
+    return Route(task, params["models"], min(max_tokens, MAX_TOKENS_LIMIT), params["timeout"])
+
+
+class RouteStats:
+    # Задержка и токены ответов одной задачи: по ним видно, какие задачи можно отдать
+    # быстрой модели и не занижен ли бюджет (обрезанные по max_tokens ответы)
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.truncated = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_completion_tokens = 0
+        self.latency = LatencyWindow()
+
+    def summary(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "truncated": self.truncated,
+            "p50": self.latency.percentile(0.5),
+            "p95": self.latency.percentile(0.95),
+            "avg_prompt_tokens": self.prompt_tokens / self.requests if self.requests else 0,
+            "avg_completion_tokens": self.completion_tokens / self.requests if self.requests else 0,
+            "max_completion_tokens": self.max_completion_tokens,
+        }
+
+
+route_stats: dict[str, RouteStats] = {}
+
+
+def record_route(route: Route, seconds: float, usage=None, finish_reason: str | None = None):
+    stats = route_stats.setdefault(route.task, RouteStats())
+    stats.requests += 1
+    stats.latency.add(seconds)
+    prompt = (usage.prompt_tokens or 0) if usage is not None else 0
+    completion = (usage.completion_tokens or 0) if usage is not None else 0
+    stats.prompt_tokens += prompt
+    stats.completion_tokens += completion
+    stats.max_completion_tokens = max(stats.max_completion_tokens, completion)
+    truncated = finish_reason == "length"
+    if truncated:
+        stats.truncated += 1
+        logger.warning("Ответ задачи %s обрезан на max_tokens=%s — бюджет маршрута занижен", route.task, route.max_tokens)
+    metrics.observe_route(route.task, seconds, prompt, completion, truncated)
+
+
+def record_route_error(route: Route, error: Exception):
+    route_stats.setdefault(route.task, RouteStats()).errors += 1
+    metrics.error(f"llm_route:{route.task}", error)
+
+
+def route_report() -> dict[str, dict]:
+    return {task: stats.summary() for task, stats in route_stats.items()}
@@ -0,0 +1,238 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+from config import GENERATION_CONCURRENCY, GENERATION_QUEUE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Результаты submit()
+STARTED = "started"
+QUEUED = "queued"
+DUPLICATE = "duplicate"
+REJECTED = "rejected"
+
+# Чье место занимает запрос в slot()
+OWN_SLOT = "own"
+BORROWED_SLOT = "borrowed"
+
+
+class GenerationJob:
+    def __init__(self, tg_id: int, kind: str, run: Callable[[], Awaitable], on_position: Callable[[int], Awaitable] | None):
+        self.tg_id = tg_id
+        self.kind = kind
+        self.run = run
+        self.on_position = on_position
+        self.position = 0  # Сколько задач впереди; 0 — задача уже выполняется
+        # Контекст апдейта, поставившего задачу (request_id в логах), — задача стартует в нем,
+        # даже если ее запускает завершение чужой задачи
+        self.context = contextvars.copy_context()
+        self.slot_in_use = False  # Свое место задачи занято одним из ее запросов (см. slot())
+        self.slot_waiters: deque[asyncio.Future] = deque()
+
+
+# Задача, внутри которой выполняется код (в том числе в дочерних задачах asyncio)
+_current_job: contextvars.ContextVar[GenerationJob | None] = contextvars.ContextVar("generation_job", default=None)
+
+
+def detach_from_job():
+    # Для фоновой работы, которую задача запускает и не дожидается (предварительный пост): ее запросы
+    # берут в slot() дополнительное место, а не место задачи, которая может завершиться раньше них
+    _current_job.set(None)
+
+
+class GenerationScheduler:
+    # Очередь генераций с общим лимитом параллельных запросов к модели.
+    # У каждого пользователя одновременно выполняется не больше одной задачи,
+    # повторные нажатия (тот же tg_id и тот же тип задачи) объединяются,
+    # а пользователи обслуживаются по кругу, чтобы один не занимал всю очередь.
+
+    def __init__(self, concurrency: int = 5, max_queue: int = 100):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._pending: dict[int, deque] = {}  # tg_id -> ожидающие задачи пользователя
+        self._ring: deque = deque()  # Пользователи с ожидающими задачами, которые могут стартовать
+        self._running: dict[int, GenerationJob] = {}
+        self._borrowed = 0  # Дополнительные места, занятые через slot()
+        self._slot_waiters: deque[asyncio.Future] = deque()
+        self._tasks: set[asyncio.Task] = set()
+        self._queued = 0
+        # Создается в drain(): в Python 3.9 Event привязывается к циклу событий при создании,
+        # а планировщик создается при импорте, до asyncio.run()
+        self._idle: asyncio.Event | None = None
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    @property
+    def free_slots(self) -> int:
+        return self.concurrency - len(self._running) - self._borrowed
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        # Место под общим лимитом для одного запроса к модели. Запрос задачи занимает ее собственное место,
+        # если оно свободно; параллельные запросы той же задачи (пакет постов) и запросы вне задач берут
+        # дополнительные места, причем ожидающие задачи пользователей получают свободное место раньше них.
+        # Освободившееся место задачи сразу переходит к ее ожидающему запросу — задача не ждет сама себя
+        job = _current_job.get()
+        if job is not None and self._running.get(job.tg_id) is not job:
+            job = None  # Задача уже завершилась, ее место отдано другой — запрос идет как сторонний
+        if job is not None and not job.slot_in_use:
+            job.slot_in_use = True
+            kind = OWN_SLOT
+        elif self.free_slots > 0 and not self._ring and not self._slot_waiters:
+            self._borrowed += 1
+            kind = BORROWED_SLOT
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._slot_waiters.append(waiter)
+            if job is not None:
+                job.slot_waiters.append(waiter)
+            try:
+                kind = await waiter  # Место передается уже занятым: см. _release_slot и _dispatch
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_slot(job, waiter.result())
+                else:
+                    with contextlib.suppress(ValueError):
+                        self._slot_waiters.remove(waiter)
+                    if job is not None:
+                        with contextlib.suppress(ValueError):
+                            job.slot_waiters.remove(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self._release_slot(job, kind)
+
+    def _release_slot(self, job: GenerationJob | None, kind: str):
+        if kind == OWN_SLOT and self._running.get(job.tg_id) is not job:
+            kind = BORROWED_SLOT  # Задача завершилась раньше запроса — ее место было переведено в дополнительные
+        if kind == OWN_SLOT:
+            while job.slot_waiters:
+                waiter = job.slot_waiters.popleft()
+                if not waiter.done():
+                    waiter.set_result(OWN_SLOT)
+                    return
+            job.slot_in_use = False
+            return
+        self._borrowed -= 1
+        self._dispatch()
+
+    def _has_job(self, tg_id: int, kind: str) -> bool:
+        running = self._running.get(tg_id)
+        if running is not None and running.kind == kind:
+            return True
+        return any(job.kind == kind for job in self._pending.get(tg_id, ()))
+
+    def submit(self, tg_id: int, kind: str, run: Callable[[], Awaitable],
+               on_position: Callable[[int], Awaitable] | None = None) -> tuple[str, int]:
+        # Возвращает (результат, позиция в очереди). Задача выполняется в фоне —
+        # обработчик апдейта может сразу вернуть управление.
+        if self._has_job(tg_id, kind):
+            return DUPLICATE, 0
+        if self._queued >= self.max_queue:
+            return REJECTED, 0
+
+        job = GenerationJob(tg_id, kind, run, on_position)
+        user_jobs = self._pending.setdefault(tg_id, deque())
+        user_jobs.append(job)
+        self._queued += 1
+        if len(user_jobs) == 1 and tg_id not in self._running:
+            self._ring.append(tg_id)
+
+        self._dispatch()
+        if job.position == 0:
+            return STARTED, 0
+        return QUEUED, job.position
+
+    def _dispatch(self):
+        while self._ring and self.free_slots > 0:
+            tg_id = self._ring.popleft()
+            job = self._pending[tg_id].popleft()
+            if not self._pending[tg_id]:
+                del self._pending[tg_id]
+            self._queued -= 1
+            job.position = 0
+            self._running[tg_id] = job
+            self._spawn(self._run(job), job.context)
+        # Свободные места после задач из очереди — запросам, ждущим в slot(); занятые иначе ожидания пропускаются
+        while self._slot_waiters and not self._ring and self.free_slots > 0:
+            waiter = self._slot_waiters.popleft()
+            if not waiter.done():
+                self._borrowed += 1
+                waiter.set_result(BORROWED_SLOT)
+        self._update_positions()
+
+    def _update_positions(self):
+        # Позиции считаются в порядке, в котором задачи будут запущены: по кругу между пользователями
+        queues = [list(self._pending[tg_id]) for tg_id in self._ring]
+        queues += [list(jobs) for tg_id, jobs in self._pending.items() if tg_id not in self._ring]
+        position = 0
+        round_index = 0
+        while True:
+            advanced = False
+            for jobs in queues:
+                if round_index < len(jobs):
+                    position += 1
+                    advanced = True
+                    job = jobs[round_index]
+                    if job.position != position:
+                        job.position = position
+                        if job.on_position is not None:
+                            self._spawn(job.on_position(position), job.context)
+            if not advanced:
+                break
+            round_index += 1
+
+    def _spawn(self, coro: Awaitable, context: contextvars.Context | None = None):
+        # Задача копирует контекст, в котором создана: create_task(context=...) есть только с Python 3.11
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(coro) if context is None else context.run(loop.create_task, coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: GenerationJob):
+        _current_job.set(job)
+        try:
+            await job.run()
+        except Exception as e:
+            logger.error("Ошибка в задаче генерации %s пользователя %s: %s", job.kind, job.tg_id, e, exc_info=True)
+        finally:
+            del self._running[job.tg_id]
+            if job.slot_in_use:
+                # Запрос, переживший задачу, продолжает занимать место: теперь это дополнительное место,
+                # иначе его сразу получила бы следующая задача и лимит был бы превышен
+                self._borrowed += 1
+            if job.tg_id in self._pending:
+                self._ring.append(job.tg_id)
+            self._dispatch()
+            if self._idle is not None and not self._running and not self._queued:
+                self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        # Ждет, пока выполнятся все запущенные и ожидающие задачи
+        if not self._running and not self._queued:
+            return True
+        if self._idle is None or self._idle.is_set():
+            self._idle = asyncio.Event()
+        logger.info("Ожидание завершения генераций: выполняется %s, в очереди %s...", self.running, self.queued)
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не дождались генераций за %s с: выполняется %s, в очереди %s", timeout, self.running, self.queued)
+            return False
+        return True
+
+
+scheduler = GenerationScheduler(GENERATION_CONCURRENCY, GENERATION_QUEUE_SIZE)
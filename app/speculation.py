@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from app.ai_generate import complete
+from app.routing import route_for
+from app.metrics import metrics
+from app.scheduler import scheduler, detach_from_job
+from app.utils.prompt_templates import POST_MAX_WORDS
+from config import SPECULATIVE_POSTS, SPECULATIVE_POST_TTL
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculativeJob:
+    def __init__(self, plan_id: int):
+        self.plan_id = plan_id
+        self.task: asyncio.Task | None = None
+        self.expire: asyncio.TimerHandle | None = None
+        self.completion_tokens = 0
+        self.requested = False  # Получено место в общем лимите, запрос к модели отправлен
+        self.discarded = False
+
+
+class SpeculativePosts:
+    # Пример поста для первого дня начинает генерироваться сразу после отправки плана,
+    # пока пользователь читает план. Результат привязан к (tg_id, plan_id): новый план
+    # или истечение срока отбрасывают задачу. Если пользователь нажал кнопку, пока задача
+    # еще идет, обычная генерация присоединяется к тому же запросу через кэш/SingleFlight.
+    # Запрос занимает место общего лимита генераций (scheduler.slot) и уступает его задачам из очереди.
+
+    def __init__(self, enabled: bool = False, ttl: float = 600):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._jobs: dict[int, SpeculativeJob] = {}
+        self.stats = {
+            "started": 0,
+            "skipped_busy": 0,  # Не запускали: очередь генераций занята
+            "hits": 0,  # Пост был готов к нажатию кнопки
+            "pending_hits": 0,  # Пост еще генерировался — дождались того же запроса
+            "discarded": 0,
+            "wasted_tokens": 0,  # completion-токены отброшенных постов, включая отброшенные во время запроса
+        }
+
+    def start(self, tg_id: int, plan_id: int, prompt: str, system: str | None = None) -> bool:
+        self.discard(tg_id)
+        if not self.enabled:
+            return False
+        # Догадка не должна отнимать место у настоящих запросов пользователей
+        if scheduler.queued or scheduler.free_slots <= 0:
+            self._count("skipped_busy")
+            return False
+
+        loop = asyncio.get_running_loop()
+        job = SpeculativeJob(plan_id)
+        job.task = loop.create_task(self._run(tg_id, job, prompt, system))
+        job.expire = loop.call_later(self.ttl, self._expire, tg_id, plan_id)
+        self._jobs[tg_id] = job
+        self._count("started")
+        return True
+
+    async def _run(self, tg_id: int, job: SpeculativeJob, prompt: str, system: str | None) -> str | None:
+        def on_usage(usage):
+            job.completion_tokens = usage.completion_tokens or 0
+            if job.discarded:
+                self._count("wasted_tokens", job.completion_tokens)
+
+        # Задача создается из задачи генерации плана и унаследовала ее контекст; план завершится раньше
+        detach_from_job()
+        try:
+            async with scheduler.slot():
+                job.requested = True
+                # Тот же маршрут, что у обычной генерации поста: иначе догадка не попадет в ее кэш
+                return await complete(prompt, system, on_usage=on_usage, route=route_for("post", POST_MAX_WORDS))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Предварительная генерация поста для %s не удалась: %s", tg_id, e)
+            return None
+
+    def take(self, tg_id: int, plan_id: int) -> str | None:
+        # Вызывается при нажатии кнопки. Возвращает готовый пост или None; задача,
+        # которая еще выполняется, не отменяется — ее результат подхватит обычная генерация
+        job = self._jobs.get(tg_id)
+        if job is None or job.plan_id != plan_id:
+            return None
+        del self._jobs[tg_id]
+        job.expire.cancel()
+
+        if not job.task.done():
+            self._count("pending_hits")
+            return None
+        result = None if job.task.cancelled() else job.task.result()
+        if result:
+            self._count("hits")
+        return result
+
+    def discard(self, tg_id: int):
+        job = self._jobs.pop(tg_id, None)
+        if job is None:
+            return
+        job.expire.cancel()
+        job.discarded = True
+        self._count("discarded")
+        if job.task.done():
+            self._count("wasted_tokens", job.completion_tokens)
+        elif not job.requested:
+            job.task.cancel()  # Запрос еще не отправлен — токены не потрачены
+        # Отправленный запрос не отменяется: токены уже оплачены, отмена их не вернет. Он дорабатывает,
+        # его usage попадает в wasted_tokens (on_usage), а ответ остается в кэше
+        logger.info("Предварительный пост пользователя %s отброшен. Статистика: %s", tg_id, self.stats)
+
+    def _expire(self, tg_id: int, plan_id: int):
+        job = self._jobs.get(tg_id)
+        if job is not None and job.plan_id == plan_id:
+            self.discard(tg_id)
+
+    def _count(self, stat: str, amount: int = 1):
+        self.stats[stat] += amount
+        metrics.observe_speculation(stat, amount, self.hit_rate)
+
+    @property
+    def hit_rate(self) -> float:
+        started = self.stats["started"]
+        return (self.stats["hits"] + self.stats["pending_hits"]) / started if started else 0.0
+
+
+speculative_posts = SpeculativePosts(SPECULATIVE_POSTS, SPECULATIVE_POST_TTL)
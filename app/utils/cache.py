@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # LRU-кэш в памяти с ограничением по размеру и времени жизни записей
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    # Объединяет одновременные одинаковые запросы: выполняется только первый,
+    # остальные ждут его результат.
+
+    def __init__(self):
+        self._calls: dict = {}
+
+    def pending(self, key) -> asyncio.Future | None:
+        return self._calls.get(key)
+
+    def begin(self, key) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        # Исключение мог никто не дождаться — не засоряем лог предупреждениями
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        return future
+
+    def end(self, key, result=None, error: BaseException | None = None) -> None:
+        future = self._calls.pop(key, None)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, Exception):
+            future.set_exception(error)
+        else:
+            # Отмена/закрытие ведущего запроса не должны отменять ожидающих
+            future.set_exception(RuntimeError("Запрос был прерван до получения ответа"))
+
+    async def do(self, key, func):
+        future = self.pending(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        self.begin(key)
+        try:
+            result = await func()
+        except BaseException as e:
+            self.end(key, error=e)
+            raise
+        self.end(key, result)
+        return result
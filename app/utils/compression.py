@@ -0,0 +1,42 @@
+import logging
+import zlib
+
+from config import HISTORY_CODEC
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # zstd необязателен: без пакета zstandard история сжимается zlib
+    zstandard = None
+
+# Уровни подобраны под тексты в несколько килобайт: почти максимальное сжатие за доли миллисекунды
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+if HISTORY_CODEC == "zstd" and zstandard is None:
+    logger.warning("HISTORY_CODEC=zstd, но пакет zstandard не установлен — история сжимается zlib")
+_codec = "zstd" if HISTORY_CODEC == "zstd" and zstandard is not None else "zlib"
+_zstd_compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL) if zstandard is not None else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+
+def compress_text(text: str) -> tuple[str, bytes]:
+    # Возвращает (кодек, данные); кодек хранится рядом с телом, так что смена HISTORY_CODEC
+    # не ломает чтение уже сохраненных записей
+    data = text.encode("utf-8")
+    if _codec == "zstd":
+        return "zstd", _zstd_compressor.compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_text(codec: str, data: bytes) -> str:
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    if codec == "zstd":
+        if _zstd_decompressor is None:
+            raise RuntimeError("Запись сжата zstd, но пакет zstandard не установлен")
+        return _zstd_decompressor.decompress(data).decode("utf-8")
+    if codec == "raw":
+        return data.decode("utf-8")
+    raise ValueError(f"Неизвестный кодек: {codec}")
@@ -0,0 +1,50 @@
+import base64
+import json
+import logging
+import zlib
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STORAGE, REDIS_URL, FSM_STATE_TTL, FSM_DATA_TTL, FSM_COMPRESS_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+# Признак сжатого значения: обычный JSON всегда начинается с "{"
+_COMPRESSED_PREFIX = "z:"
+
+
+def pack_data(data: dict) -> str:
+    # Компактный JSON; крупные данные (тексты планов) хранятся сжатыми zlib в base85
+    raw = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    if len(raw) < FSM_COMPRESS_THRESHOLD:
+        return raw
+    compressed = zlib.compress(raw.encode("utf-8"), 6)
+    return _COMPRESSED_PREFIX + base64.b85encode(compressed).decode("ascii")
+
+
+def unpack_data(value: str) -> dict:
+    if value.startswith(_COMPRESSED_PREFIX):
+        value = zlib.decompress(base64.b85decode(value[len(_COMPRESSED_PREFIX):])).decode("utf-8")
+    return json.loads(value)
+
+
+def create_storage(redis=None) -> BaseStorage:
+    # redis можно передать готовым клиентом (например, fakeredis.aioredis.FakeRedis в тестах)
+    if FSM_STORAGE != "redis" and redis is None:
+        return MemoryStorage()
+
+    from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+    from redis.asyncio import Redis
+
+    if redis is None:
+        redis = Redis.from_url(REDIS_URL)
+    logger.info("FSM хранится в Redis (TTL состояния %s с, данных %s с)", FSM_STATE_TTL, FSM_DATA_TTL)
+    return RedisStorage(
+        redis,
+        key_builder=DefaultKeyBuilder(prefix="content_bot"),
+        state_ttl=FSM_STATE_TTL or None,
+        data_ttl=FSM_DATA_TTL or None,
+        json_dumps=pack_data,
+        json_loads=unpack_data,
+    )
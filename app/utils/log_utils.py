@@ -0,0 +1,95 @@
+import json
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from config import LOG_LEVEL, LOG_FORMAT, LOG_BODY_LIMIT, LOG_BODY_SAMPLE_RATE
+
+# Идентификатор апдейта, в рамках которого пишется запись. Задачи генерации, созданные
+# из хэндлера, наследуют контекст и продолжают писать с тем же идентификатором
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class Truncated:
+    # Обрезает длинный текст только при форматировании записи: если уровень выключен, строка не строится
+    __slots__ = ("text", "limit")
+
+    def __init__(self, text, limit: int = LOG_BODY_LIMIT):
+        self.text = text
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = self.text if isinstance(self.text, str) else str(self.text)
+        if self.limit <= 0 or len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}… [+{len(text) - self.limit} симв.]"
+
+
+class LazyJson(Truncated):
+    # Сериализация pydantic-объекта (например, ответа OpenAI) откладывается до вывода записи
+
+    def __str__(self) -> str:
+        return str(Truncated(self.text.model_dump_json() if self.text is not None else None, self.limit))
+
+
+def log_body(logger: logging.Logger, message: str, *args):
+    # DEBUG-запись с большим телом (ответ модели, часть сообщения). Пишется только у доли вызовов
+    # (LOG_BODY_SAMPLE_RATE) и в обрезанном виде; при выключенном DEBUG не стоит ничего
+    if logger.isEnabledFor(logging.DEBUG) and (LOG_BODY_SAMPLE_RATE >= 1 or random.random() < LOG_BODY_SAMPLE_RATE):
+        logger.debug(message, *(Truncated(arg) if isinstance(arg, str) else arg for arg in args))
+
+
+class RequestIdFilter(logging.Filter):
+    # Вешается на QueueHandler: идентификатор берется в потоке цикла событий, пока контекст еще доступен
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class LocalQueueHandler(QueueHandler):
+    # Запись кладется в очередь как есть: форматирование (getMessage, трассировки, JSON)
+    # выполняет поток QueueListener, а не цикл событий. Очередь в памяти процесса, pickle не нужен
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging() -> QueueListener:
+    # Все обработчики корневого логгера заменяются одним неблокирующим; вывод в stderr
+    # делает отдельный поток. Возвращает запущенный listener — при остановке его нужно остановить (stop)
+    if LOG_FORMAT == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    handler = LocalQueueHandler(records)
+    handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    listener = QueueListener(records, output)
+    listener.start()
+    return listener
@@ -1,48 +1,157 @@
 import re
 import logging
+from typing import NamedTuple
+
+from aiogram.types import MessageEntity
 
 logger = logging.getLogger(__name__)
 
-def escape_markdown_v2(text: str) -> str:
+SEPARATOR = "— — —"
 
-    processed_chunks = []
-    open_tags_stack = []
+# Все, что нужно обработать внутри строки, находится одним регулярным выражением за один проход
+_TOKEN_RE = re.compile(
+    r'(?P<bold>\*\*|__)'
+    r'|(?P<italic>_)'
+    r'|(?P<tag>(?<![^\W_])#[^\W_]+(?:_[^\W_]+)*)'
+    r'|(?P<colon>::+)'
+    r'|(?P<slash>\\+)'
+    r'|(?P<space>\s{2,}|[^\S ])'  # Одиночные пробелы не трогаем — их большинство
+)
+# Строка-разделитель ("— — —", "---", "———") или одинокое тире
+_SEPARATOR_LINE_RE = re.compile(r'(?:[—–-]\s*){3,}|—')
+_ASTRAL_RE = re.compile('[\U00010000-\U0010FFFF]')
 
-    i = 0
-    while i < len(text):
-        if text[i:i+2] == '**':
-            if not open_tags_stack or open_tags_stack[-1][0] != '**':
-                open_tags_stack.append(('**', len(processed_chunks)))
-                processed_chunks.append('**')
-            else:
-                open_tags_stack.pop()
-                processed_chunks.append('**')
-            i += 2
-        elif text[i] == '_':
-            is_word_char_before = (i > 0 and text[i-1].isalnum())
-            is_word_char_after = (i < len(text) - 1 and text[i+1].isalnum())
-
-            if is_word_char_before or is_word_char_after:
-                processed_chunks.append('\\_')
-            elif not open_tags_stack or open_tags_stack[-1][0] != '_':
-                open_tags_stack.append(('_', len(processed_chunks)))
-                processed_chunks.append('_')
+
+class FormattedText(NamedTuple):
+    text: str
+    entities: list[MessageEntity]
+
+
+def utf16_len(text: str) -> int:
+    # Telegram считает смещения сущностей в кодовых единицах UTF-16
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _pair_markers(line: str, tokens: list) -> dict:
+    # Находит парные ** и _; непарные маркеры и пересекающиеся пары в разметку не попадают
+    pairs = {}
+    stack = []  # (kind, token_index)
+
+    for i, m in enumerate(tokens):
+        kind = m.lastgroup
+        if kind == 'bold':
+            if any(k == 'bold' for k, _ in stack):
+                while stack[-1][0] != 'bold':
+                    stack.pop()
+                pairs[stack.pop()[1]] = i
             else:
-                open_tags_stack.pop()
-                processed_chunks.append('_')
-            i += 1
-        elif text[i] in r'\[]()~`>#+-=|{}.!':
-            processed_chunks.append('\\' + text[i])
-            i += 1
-        else:
-            processed_chunks.append(text[i])
-            i += 1
-    
-    for tag_type, chunk_index in open_tags_stack:
-        logger.warning(f"Found unclosed tag '{tag_type}'. Escaping it at processed_chunks index {chunk_index}.")
-        if tag_type == '**':
-            processed_chunks[chunk_index] = '\\*\\*'
-        elif tag_type == '_':
-            processed_chunks[chunk_index] = '\\_'
-
-    return "".join(processed_chunks)
+                stack.append(('bold', i))
+        elif kind == 'italic':
+            prev_char = line[m.start() - 1] if m.start() > 0 else ' '
+            next_char = line[m.end()] if m.end() < len(line) else ' '
+            if prev_char.isalnum() and next_char.isalnum():
+                continue  # Подчеркивание внутри слова (snake_case) — обычный символ
+            if stack and stack[-1][0] == 'italic' and not prev_char.isspace() and not next_char.isalnum():
+                pairs[stack.pop()[1]] = i
+            elif not prev_char.isalnum() and not next_char.isspace():
+                stack.append(('italic', i))
+
+    return pairs
+
+
+def render_markdown(text: str) -> FormattedText:
+    # Нормализует ответ модели и превращает **жирный**, _курсив_ и #хэштеги
+    # в текст без разметки и список MessageEntity — за один линейный проход.
+    # Каждая непустая строка становится абзацем, разделители дней приводятся к SEPARATOR.
+    count_units = utf16_len if _ASTRAL_RE.search(text) else len
+
+    out = []
+    entities = []
+    offset = 0
+    pending_separator = False
+
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        if not line:
+            continue
+        if _SEPARATOR_LINE_RE.fullmatch(line):
+            pending_separator = bool(out)
+            continue
+
+        tokens = list(_TOKEN_RE.finditer(line))
+        pairs = _pair_markers(line, tokens)
+        closing = set(pairs.values())
+
+        line_out = []
+        line_offset = offset + (2 if out else 0) + (len(SEPARATOR) + 2 if pending_separator else 0)
+        cursor = line_offset
+        first_entity = len(entities)
+        open_entities = []  # (kind, offset, index в line_out)
+        italic_depth = 0
+        position = 0
+        skip_until = 0  # Конец повторного заголовка секции ("**Хэштеги:** Хэштеги: ...")
+
+        for i, m in enumerate(tokens):
+            if m.start() < skip_until:
+                continue
+            if m.start() > position:
+                chunk = line[max(position, skip_until):m.start()]
+                line_out.append(chunk)
+                cursor += count_units(chunk)
+            position = m.end()
+
+            kind = m.lastgroup
+            if kind in ('bold', 'italic'):
+                if i in pairs:
+                    open_entities.append((kind, cursor, len(line_out)))
+                    italic_depth += kind == 'italic'
+                elif i in closing:
+                    entity_kind, start, out_index = open_entities.pop()
+                    italic_depth -= entity_kind == 'italic'
+                    if cursor > start:
+                        entities.append(MessageEntity(type=entity_kind, offset=start, length=cursor - start))
+                    label = "".join(line_out[out_index:]).strip()
+                    if entity_kind == 'bold' and label.endswith(':'):
+                        rest_start = m.end() + (len(line) > m.end() and line[m.end()] == ' ')
+                        if line[rest_start:rest_start + len(label)].lower() == label.lower():
+                            skip_until = rest_start + len(label)
+                            position = skip_until
+                elif kind == 'italic':
+                    line_out.append('_')
+                    cursor += 1
+                # Непарные ** просто отбрасываются
+            elif kind == 'tag':
+                tag = m.group()
+                length = count_units(tag)
+                entities.append(MessageEntity(type='hashtag', offset=cursor, length=length))
+                if not italic_depth:
+                    entities.append(MessageEntity(type='italic', offset=cursor, length=length))
+                line_out.append(tag)
+                cursor += length
+            elif kind == 'colon':
+                line_out.append(':')
+                cursor += 1
+            elif kind == 'space' and cursor > line_offset:
+                line_out.append(' ')
+                cursor += 1
+            # kind == 'slash': лишние бэкслеши удаляются
+
+        if position < len(line):
+            line_out.append(line[max(position, skip_until):])
+
+        line_text = "".join(line_out)
+        if not line_text.strip():
+            # Строка состояла из одной разметки
+            del entities[first_entity:]
+            continue
+
+        if out:
+            out.append("\n\n")
+            if pending_separator:
+                out.append(SEPARATOR + "\n\n")
+        pending_separator = False
+        out.append(line_text)
+        offset = line_offset + count_units(line_text)
+
+    entities.sort(key=lambda e: (e.offset, -e.length))
+    return FormattedText("".join(out), entities)
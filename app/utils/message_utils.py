@@ -1,56 +1,190 @@
+from __future__ import annotations
+
 import re
+import time
+from bisect import bisect_left
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message
+
+from app.utils.markdown_utils import SEPARATOR, FormattedText, utf16_len
+from app.utils.sender import rate_limiter
+from config import STREAM_EDIT_INTERVAL
+
+# Места, где можно разрезать текст, в порядке предпочтения:
+# разделитель дней, пустая строка, перенос строки, пробел
+_BREAKS = ("\n\n" + SEPARATOR + "\n\n", "\n\n", "\n", " ")
+_ASTRAL_RE = re.compile('[\U00010000-\U0010FFFF]')
+
+
+class _Utf16Index:
+    # Перевод индексов строки Python в кодовые единицы UTF-16: символы вне BMP занимают две единицы
+
+    def __init__(self, text: str):
+        self.astral = [m.start() for m in _ASTRAL_RE.finditer(text)]
+
+    def units(self, index: int) -> int:
+        if not self.astral:
+            return index
+        return index + bisect_left(self.astral, index)
+
+    def index_within(self, start: int, limit_units: int) -> int:
+        # Наибольший индекс >= start, конец которого укладывается в limit_units
+        index = start + (limit_units - self.units(start))
+        while self.units(index) > limit_units:
+            index -= 1
+        return index
+
+
+def _split_bounds(text: str, entities: list, max_length: int) -> list[tuple[int, int]]:
+    # Идем по тексту вперед окнами по max_length (в единицах UTF-16, как считает Telegram).
+    # В каждом окне ищем место разреза с конца: сначала разделитель дней, потом пустую строку,
+    # перенос и пробел во второй половине окна, затем самое позднее из них во всем окне.
+    # Разрезы внутри сущностей пропускаются. Каждый символ просматривается O(1) раз.
+    index = _Utf16Index(text)
+
+    # covered_until[i] — самый дальний конец среди сущностей entities[:i + 1]
+    entity_starts = [entity.offset for entity in entities]
+    covered_until = []
+    furthest = 0
+    for entity in entities:
+        furthest = max(furthest, entity.offset + entity.length)
+        covered_until.append(furthest)
+
+    def inside_entity(position: int) -> int | None:
+        # Начало (в единицах) сущности, внутри которой оказался разрез, иначе None
+        units = index.units(position)
+        i = bisect_left(entity_starts, units)
+        if i and covered_until[i - 1] > units:
+            while i and covered_until[i - 1] > units:
+                i -= 1
+            return entity_starts[i]
+        return None
+
+    def rfind_break(separator: str, low: int, high: int, start: int) -> int:
+        # Последнее вхождение separator, которое заканчивает часть не позже high и не режет сущность
+        position = text.rfind(separator, low, high + len(separator))
+        while position > start:
+            entity_start = inside_entity(position)
+            if entity_start is None:
+                return position
+            # Сущность могла начаться до текущей части: тогда index_within уходит левее start,
+            # а отрицательный конец в rfind считался бы от конца строки
+            high = min(position, index.index_within(start, entity_start)) - 1
+            if high < max(low, start):
+                return -1
+            position = text.rfind(separator, low, high + len(separator))
+        return -1
+
+    bounds = []
+    start = 0
+    while index.units(len(text)) - index.units(start) > max_length:
+        start_units = index.units(start)
+        limit = index.index_within(start, start_units + max_length)
+        floor = index.index_within(start, start_units + max_length // 2)
+
+        cut = None
+        for separator in _BREAKS:
+            position = rfind_break(separator, floor, limit, start)
+            if position != -1:
+                cut = (position, position + len(separator))
+                break
+        else:
+            latest = max(((rfind_break(separator, start + 1, floor, start), separator) for separator in _BREAKS))
+            if latest[0] != -1:
+                cut = (latest[0], latest[0] + len(latest[1]))
+
+        if cut is None:
+            # Подходящего места нет (очень длинное слово) — режем ровно по лимиту
+            cut = (limit, limit)
+
+        bounds.append((start, cut[0]))
+        start = cut[1]
+
+    bounds.append((start, len(text)))
+    return bounds
+
 
 def split_text(text: str, max_length: int = 4096) -> list[str]:
-   
     if not text:
         return []
-    
-    parts = []
-    current_start = 0
-
-    while current_start < len(text):
-        chunk_to_process = text[current_start:]
-
-        if len(chunk_to_process) <= max_length:
-            parts.append(chunk_to_process)
-            break
-
-        ideal_split_search_start = max(0, max_length - 500) 
-        
-        split_point_in_chunk = -1
-
-        for m in re.finditer(r'\n\n', chunk_to_process[:max_length]):
-            if m.start() >= ideal_split_search_start:
-                if not re.match(r'[\*_\[\]\(\)~`>#+\-|=\{\}\.!]', chunk_to_process[m.end():].strip()):
-                    split_point_in_chunk = m.end() 
-                    break 
-
-        if split_point_in_chunk == -1:
-            for m in re.finditer(r'\n', chunk_to_process[:max_length]):
-                if m.start() >= ideal_split_search_start:
-                    if not re.match(r'[\*_\[\]\(\)~`>#+\-|=\{\}\.!]', chunk_to_process[m.end():].strip()): # Corrected typo: chunk_to_to_process -> chunk_to_process
-                        split_point_in_chunk = m.end()
-                        break
-
-        if split_point_in_chunk == -1:
-            for m in re.finditer(r'\s', chunk_to_process[:max_length]):
-                if m.start() >= ideal_split_search_start:
-                    if not re.match(r'[\*_\[\]\(\)~`>#+\-|=\{\}\.!]', chunk_to_process[m.end():].strip()):
-                        split_point_in_chunk = m.end() 
-                        break
-        
-        if split_point_in_chunk == -1:
-            last_newline = chunk_to_process.rfind('\n', 0, max_length)
-            last_space = chunk_to_process.rfind(' ', 0, max_length)
-
-            if last_newline != -1:
-                split_point_in_chunk = last_newline + 1
-            elif last_space != -1:
-                split_point_in_chunk = last_space + 1
+    parts = (text[start:end].strip() for start, end in _split_bounds(text, [], max_length))
+    return [part for part in parts if part]
+
+
+def split_formatted(formatted: FormattedText, max_length: int = 4096) -> list[FormattedText]:
+    # Делит текст, не разрывая сущности (если это возможно), и раздает каждой части
+    # ее сущности со смещениями от начала части
+    text, entities = formatted
+    if not text:
+        return []
+    if utf16_len(text) <= max_length and text == text.strip():
+        return [formatted]
+
+    index = _Utf16Index(text)
+    result = []
+    first_open = 0  # Первая сущность, которая может попасть в следующие части
+
+    for start, end in _split_bounds(text, entities, max_length):
+        part = text[start:end]
+        stripped = part.strip()
+        if not stripped:
+            continue
+        start += len(part) - len(part.lstrip())
+        part_start = index.units(start)
+        part_end = part_start + utf16_len(stripped)
+
+        part_entities = []
+        next_open = None
+        for i in range(first_open, len(entities)):
+            entity = entities[i]
+            if entity.offset >= part_end:
+                break
+            entity_end = entity.offset + entity.length
+            if entity_end > part_end and next_open is None:
+                next_open = i
+            clipped_start = max(entity.offset, part_start)
+            clipped_end = min(entity_end, part_end)
+            if clipped_start >= clipped_end:
+                continue
+            if part_start == 0 and clipped_end - clipped_start == entity.length:
+                part_entities.append(entity)  # Сущность не сдвигается и не обрезается — новый объект не нужен
             else:
-                split_point_in_chunk = max_length 
+                # model_copy заметно дешевле повторной валидации нового MessageEntity
+                part_entities.append(entity.model_copy(update={'offset': clipped_start - part_start, 'length': clipped_end - clipped_start}))
+        else:
+            i = len(entities)
+        first_open = next_open if next_open is not None else i
+
+        result.append(FormattedText(stripped, part_entities))
+
+    return result
+
+
+class ThrottledEditor:
+    # Редактирует одно сообщение не чаще, чем раз в min_interval секунд,
+    # чтобы не упираться в лимиты Telegram при стриминге.
+
+    def __init__(self, message: Message, min_interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.min_interval = min_interval
+        self._last_edit = 0.0
+        self._last_text = message.text
 
-        parts.append(chunk_to_process[:split_point_in_chunk])
-        current_start += split_point_in_chunk
+    async def update(self, text: str, force: bool = False, **kwargs) -> bool:
+        now = time.monotonic()
+        if text == self._last_text:
+            return False
+        if not force and now - self._last_edit < self.min_interval:
+            return False
+        if not force and rate_limiter.is_busy(self.message.chat.id):
+            return False  # Промежуточную правку можно пропустить, чтобы не ждать лимитов Telegram
 
-    return parts
+        try:
+            await self.message.edit_text(text, **kwargs)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+        self._last_edit = time.monotonic()
+        self._last_text = text
+        return True
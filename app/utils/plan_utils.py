@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import json
+import logging
+import re
+from typing import NamedTuple
+
+from aiogram.types import MessageEntity
+
+from app.utils.log_utils import Truncated
+from app.utils.markdown_utils import FormattedText, utf16_len
+
+logger = logging.getLogger(__name__)
+
+# Поля одного дня плана — модель заполняет их по JSON-схеме, а не разметкой в тексте
+DAY_FIELDS = ("day_title", "topic_title", "description", "cta", "hashtags", "visuals")
+
+DAY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "day_title": {"type": "string", "description": "Например: День 1: Понедельник"},
+        "topic_title": {"type": "string", "description": "Тема поста"},
+        "description": {"type": "string", "description": "Краткое описание поста"},
+        "cta": {"type": "string", "description": "Призыв к действию"},
+        "hashtags": {"type": "array", "items": {"type": "string"}},
+        "visuals": {"type": "string", "description": "Визуальные материалы"},
+    },
+    "required": list(DAY_FIELDS),
+    "additionalProperties": False,
+}
+
+CONTENT_PLAN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "days": {"type": "array", "items": DAY_SCHEMA},
+    },
+    "required": ["days"],
+    "additionalProperties": False,
+}
+
+CONTENT_PLAN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "content_plan", "strict": True, "schema": CONTENT_PLAN_SCHEMA},
+}
+
+# Правка одного дня: модель возвращает только этот день или только одно его поле ({"value": ...})
+EDITABLE_FIELDS = ("topic_title", "description", "cta", "hashtags", "visuals")
+
+PLAN_DAY_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "plan_day", "strict": True, "schema": DAY_SCHEMA},
+}
+
+FIELD_RESPONSE_FORMATS = {
+    field: {
+        "type": "json_schema",
+        "json_schema": {"name": f"plan_day_{field}", "strict": True, "schema": {
+            "type": "object",
+            "properties": {"value": DAY_SCHEMA["properties"][field]},
+            "required": ["value"],
+            "additionalProperties": False,
+        }},
+    }
+    for field in EDITABLE_FIELDS
+}
+
+_HASHTAG_JUNK_RE = re.compile(r'[^\w]+')
+
+
+class PlanDay(NamedTuple):
+    day_number: int
+    day_title: str
+    topic_title: str
+    description: str
+    cta: str
+    hashtags: str  # "#Тег1 #Тег2" — в таком виде день подставляется в промт поста
+    visuals: str
+
+
+def normalize_hashtags(hashtags) -> str:
+    # Модель может вернуть список или строку, с решеткой и без, с пробелами внутри тега
+    if isinstance(hashtags, str):
+        hashtags = hashtags.split()
+    tags = []
+    for tag in hashtags or ():
+        tag = _HASHTAG_JUNK_RE.sub('', str(tag)).strip('_')
+        if tag:
+            tags.append('#' + tag)
+    return " ".join(tags)
+
+
+def plan_day_from_json(day_number: int, data: dict) -> PlanDay:
+    def text(field: str) -> str:
+        value = data.get(field)
+        return str(value).strip() if value is not None else ""
+
+    return PlanDay(
+        day_number=day_number,
+        day_title=text("day_title") or f"День {day_number}",
+        topic_title=text("topic_title"),
+        description=text("description"),
+        cta=text("cta"),
+        hashtags=normalize_hashtags(data.get("hashtags")),
+        visuals=text("visuals"),
+    )
+
+
+def apply_day_edit(day: PlanDay, field: str | None, content: str) -> PlanDay | None:
+    # Ответ модели на правку дня (field=None) или одного поля; None — ответ не подошел.
+    # Заголовок дня (номер и день недели) при правке не меняется
+    try:
+        data = json.loads(content)
+    except ValueError:
+        logger.warning("Ответ на правку дня — не JSON: %.200s", content)
+        return None
+    if not isinstance(data, dict):
+        return None
+    if field is None:
+        edited = plan_day_from_json(day.day_number, data)
+        return edited._replace(day_title=day.day_title) if edited.topic_title else None
+    value = data.get("value")
+    if field == "hashtags":
+        value = normalize_hashtags(value)
+    else:
+        value = str(value).strip() if value is not None else ""
+    return day._replace(**{field: value}) if value else None
+
+
+class PlanDaysParser:
+    # Потоковый разбор ответа вида {"days": [{...}, {...}]}: feed() принимает
+    # очередной фрагмент и возвращает дни, объекты которых уже закрылись.
+    # Каждый символ просматривается один раз, весь ответ заново не разбирается.
+
+    def __init__(self):
+        self.buffer = ""
+        self.days_found = 0
+        self._position = 0
+        self._in_array = False
+        self._depth = 0  # Вложенность внутри массива days
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+        self._done = False
+
+    def feed(self, delta: str) -> list[PlanDay]:
+        self.buffer += delta
+        days = []
+
+        if self._done:
+            return days
+        if not self._in_array:
+            key = self.buffer.find('"days"', self._position)
+            if key == -1:
+                self._position = max(0, len(self.buffer) - 5)  # Ключ мог прийти не целиком
+                return days
+            bracket = self.buffer.find('[', key)
+            if bracket == -1:
+                self._position = key
+                return days
+            self._in_array = True
+            self._position = bracket + 1
+
+        buffer = self.buffer
+        for i in range(self._position, len(buffer)):
+            char = buffer[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                if self._depth == 0:
+                    self._object_start = i
+                self._depth += 1
+            elif char in '}]':
+                if self._depth == 0:
+                    self._done = True  # Массив days закончился
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    day = self._parse_day(buffer[self._object_start:i + 1])
+                    self._object_start = None
+                    if day is not None:
+                        days.append(day)
+        self._position = len(buffer)
+        return days
+
+    def _parse_day(self, raw: str) -> PlanDay | None:
+        try:
+            data = json.loads(raw)
+        except json.JSONDecodeError as e:
+            logger.warning("Не удалось разобрать день контент-плана: %s. Фрагмент: %s", e, Truncated(raw, 200))
+            return None
+        if not isinstance(data, dict):
+            return None
+        self.days_found += 1
+        return plan_day_from_json(self.days_found, data)
+
+
+def parse_plan_days(content: str) -> list[PlanDay]:
+    # Полный ответ модели (не потоковый) разбирается тем же парсером
+    return PlanDaysParser().feed(content)
+
+
+def render_plan_day(day: PlanDay) -> FormattedText:
+    # Текст дня и сущности Telegram собираются напрямую из полей — без разбора разметки
+    out = []
+    entities = []
+    offset = 0
+
+    def add(text: str, entity_type: str | None = None):
+        nonlocal offset
+        if entity_type is not None and text:
+            entities.append(MessageEntity(type=entity_type, offset=offset, length=utf16_len(text)))
+        out.append(text)
+        offset += utf16_len(text)
+
+    def paragraph(label: str, value: str):
+        if value:
+            add("\n\n")
+            add(label, "bold")
+            add(" ")
+            add(value)
+
+    add(day.day_title, "bold")
+    if day.topic_title:
+        add("\n\n")
+        add(day.topic_title, "bold")
+    paragraph("Краткое описание:", day.description)
+    paragraph("Призыв к действию (СТА):", day.cta)
+    if day.hashtags:
+        add("\n\n")
+        add("Хэштеги:", "bold")
+        for tag in day.hashtags.split():
+            add(" ")
+            entities.append(MessageEntity(type="hashtag", offset=offset, length=utf16_len(tag)))
+            add(tag, "italic")
+    paragraph("Визуальные материалы:", day.visuals)
+
+    return FormattedText("".join(out), entities)
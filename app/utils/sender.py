@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+import weakref
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods.base import Response, TelegramMethod, TelegramType
+
+from config import TG_GLOBAL_RATE, TG_CHAT_RATE, TG_GROUP_RATE, TG_CHAT_BURST, TG_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # После RetryAfter Telegram запрещает запросы до этого момента
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        # Сколько секунд ждать до следующего разрешенного запроса
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    async def acquire(self):
+        while (wait := self.delay()) > 0:
+            await asyncio.sleep(wait)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.capacity
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    # Все исходящие запросы бота проходят через общий и поканальный token bucket
+    # (лимиты Telegram: ~30 сообщений в секунду всего, ~1 в секунду в личный чат, 20 в минуту в группу).
+    # На TelegramRetryAfter запрос повторяется после указанной паузы, а не теряется.
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, group_rate: float = 20 / 60,
+                 chat_burst: float = 3, max_retries: int = 5):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._chat_buckets: dict = {}
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) > 10000:
+                # Забываем чаты, которые давно ничего не отправляли
+                self._chat_buckets = {key: b for key, b in self._chat_buckets.items() if not b.is_idle()}
+            # Отрицательный chat_id (или @username) — группа или канал
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def is_busy(self, chat_id) -> bool:
+        # True, если запрос в этот чат сейчас пришлось бы ждать — необязательные правки можно пропустить
+        return self.chat_bucket(chat_id).delay() > 0 or self.global_bucket.delay() > 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        chat_bucket = self.chat_bucket(chat_id) if chat_id is not None else None
+
+        attempt = 0
+        while True:
+            if chat_bucket is not None:
+                await chat_bucket.acquire()
+                await self.global_bucket.acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning("Flood control в чате %s: повтор %s через %s с (попытка %s)",
+                               chat_id, type(method).__name__, e.retry_after, attempt)
+                if chat_bucket is not None:
+                    chat_bucket.block(e.retry_after)
+                else:
+                    await asyncio.sleep(e.retry_after)
+
+
+rate_limiter = RateLimitMiddleware(TG_GLOBAL_RATE, TG_CHAT_RATE, TG_GROUP_RATE, TG_CHAT_BURST, TG_MAX_RETRIES)
+
+# Блокировки по чатам: многочастное сообщение уходит целиком, не перемешиваясь с другими
+_chat_locks: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+
+
+def chat_lock(chat_id) -> asyncio.Lock:
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[chat_id] = lock
+    return lock
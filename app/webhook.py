@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT
+
+logger = logging.getLogger(__name__)
+
+
+async def _set_webhook(bot: Bot, dispatcher: Dispatcher):
+    # Очередь апдейтов не сбрасываем: накопившееся за время деплоя будет обработано
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET or None,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+    logger.info("Вебхук установлен: %s%s", WEBHOOK_BASE_URL, WEBHOOK_PATH)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    if not WEBHOOK_BASE_URL:
+        raise RuntimeError("Для режима webhook нужно задать WEBHOOK_BASE_URL")
+
+    dp.startup.register(_set_webhook)
+
+    app = web.Application()
+    # setup_application регистрируется первым: при остановке сначала отрабатывают
+    # обработчики dp.shutdown (дожидаемся генераций), и только потом закрывается сессия бота
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
+    await site.start()
+    logger.info("Сервер вебхука слушает %s:%s", WEBAPP_HOST, WEBAPP_PORT)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
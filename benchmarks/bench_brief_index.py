@@ -0,0 +1,81 @@
+# Поиск похожих анкет: построение индекса и время поиска на большом числе анкет (без БД).
+# Отдельно меряются подпись анкеты (считается один раз при сохранении) и поиск по готовой подписи.
+#
+#   python -m benchmarks.bench_brief_index [--briefs 100000] [--queries 2000] [--memory]
+import argparse
+import random
+import statistics
+import time
+import tracemalloc
+
+from app.brief_index import BriefIndex, brief_signature, brief_text
+from benchmarks.samples import brief, vocabulary
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    ordered = sorted(values)
+    return tuple(ordered[min(len(ordered) - 1, int(len(ordered) * q))] for q in (0.5, 0.95, 0.99))
+
+
+def near_duplicate(answers: dict, words: list[str], rng: random.Random) -> dict:
+    # Та же анкета с парой замененных слов — так пользователь правит свою прошлую анкету
+    changed = dict(answers)
+    for field in rng.sample(sorted(changed), 2):
+        field_words = changed[field].split()
+        field_words[rng.randrange(len(field_words))] = rng.choice(words)
+        changed[field] = " ".join(field_words)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--briefs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--memory", action="store_true", help="замерить память индекса (tracemalloc замедляет построение)")
+    args = parser.parse_args()
+
+    words = vocabulary()
+    index = BriefIndex(threshold=0.7)
+    if args.memory:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    texts = []
+    for tg_id in range(args.briefs):
+        answers = brief(words, seed=tg_id)
+        if tg_id < args.queries:
+            texts.append(answers)
+        index.add(tg_id, brief_signature(brief_text(answers), index.size))
+    build = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0] / 2 ** 20 if args.memory else None
+    tracemalloc.stop()
+    print(f"Анкет в индексе: {len(index)}, построение: {build:.2f} с"
+          + (f", память индекса: {memory:.0f} МБ" if memory is not None else ""))
+
+    rng = random.Random(1)
+    queries = [("похожие", near_duplicate(answers, words, rng), tg_id) for tg_id, answers in enumerate(texts)]
+    queries += [("новые", brief(words, seed=args.briefs + i), None) for i in range(args.queries)]
+
+    timings = {"подпись": [], "поиск: похожие": [], "поиск: новые": []}
+    found = 0
+    for kind, answers, source in queries:
+        started = time.perf_counter()
+        signature = brief_signature(brief_text(answers), index.size)
+        timings["подпись"].append(time.perf_counter() - started)
+        started = time.perf_counter()
+        matches = index.query(signature)
+        timings[f"поиск: {kind}"].append(time.perf_counter() - started)
+        if source is not None and any(tg_id == source for tg_id, _ in matches):
+            found += 1
+
+    print(f"{'операция':>16} {'n':>6} {'p50, мкс':>10} {'p95, мкс':>10} {'p99, мкс':>10} {'ср., мкс':>10}")
+    for name, values in timings.items():
+        p50, p95, p99 = percentiles(values)
+        print(f"{name:>16} {len(values):>6} {p50 * 1e6:>10.1f} {p95 * 1e6:>10.1f} {p99 * 1e6:>10.1f} "
+              f"{statistics.mean(values) * 1e6:>10.1f}")
+    print(f"Найдено исходных анкет для похожих: {found} из {args.queries}; "
+          f"кандидатов на поиск в среднем: {index.stats['candidates'] / index.stats['lookups']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
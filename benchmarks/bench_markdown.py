@@ -0,0 +1,53 @@
+# Сравнение старого конвейера (re.sub-цепочка + MarkdownV2 + повторное экранирование)
+# с однопроходным render_markdown + split_formatted.
+#
+#   python -m benchmarks.bench_markdown [--plans 200] [--repeat 5]
+import argparse
+import logging
+import statistics
+import time
+
+from app.utils.markdown_utils import render_markdown
+from app.utils.message_utils import split_formatted
+from benchmarks.legacy_pipeline import legacy_pipeline
+from benchmarks.samples import content_plan
+
+
+def new_pipeline(raw: str):
+    return split_formatted(render_markdown(raw), 4096)
+
+
+def measure(func, plans: list[str], repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for plan in plans:
+            func(plan)
+        timings.append((time.perf_counter() - started) / len(plans))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plans", type=int, default=200, help="сколько разных 7-дневных планов обработать")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Старый экранировщик пишет предупреждение на каждый незакрытый тег
+    logging.disable(logging.WARNING)
+
+    plans = [content_plan(7, seed) for seed in range(args.plans)]
+    avg_size = statistics.mean(len(plan.encode("utf-8")) for plan in plans)
+    print(f"{len(plans)} планов по 7 дней, в среднем {avg_size / 1024:.1f} КБ")
+
+    results = {}
+    for name, func in (("legacy", legacy_pipeline), ("render_markdown", new_pipeline)):
+        timings = measure(func, plans, args.repeat)
+        results[name] = min(timings)
+        print(f"{name:>16}: {min(timings) * 1e6:8.1f} мкс/план (медиана {statistics.median(timings) * 1e6:.1f})")
+
+    print(f"ускорение: x{results['legacy'] / results['render_markdown']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Деление длинных (многонедельных) планов на сообщения: старый split_text
+# против однопроходного split_text / split_formatted.
+#
+#   python -m benchmarks.bench_split [--sizes 50 100 200] [--repeat 5]
+import argparse
+import logging
+import time
+
+from app.utils.markdown_utils import render_markdown
+from app.utils.message_utils import split_formatted, split_text
+from benchmarks.legacy_pipeline import escape_markdown_v2, split_text as legacy_split_text
+from benchmarks.samples import plan_of_size
+
+
+def legacy_split_and_escape(text: str) -> list[str]:
+    # Так части готовились к отправке раньше: деление + экранирование MarkdownV2 каждой части
+    return [escape_markdown_v2(part) for part in legacy_split_text(text)]
+
+
+def best_of(func, arg, repeat: int) -> tuple[float, int]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        parts = func(arg)
+        timings.append(time.perf_counter() - started)
+    return min(timings), len(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 200], help="размеры входа в КБ")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    for size_kb in args.sizes:
+        # Эмодзи в тексте проверяют подсчет длины в единицах UTF-16
+        raw = plan_of_size(size_kb * 1024, seed=size_kb).replace("ИИ", "ИИ 🤖")
+        formatted = render_markdown(raw)
+        print(f"--- {size_kb} КБ ({len(formatted.text)} символов, {len(formatted.entities)} сущностей)")
+
+        for name, func, arg in (
+            ("legacy split_text", legacy_split_text, formatted.text),
+            ("legacy + escape", legacy_split_and_escape, formatted.text),
+            ("split_text", split_text, formatted.text),
+            ("split_formatted", split_formatted, formatted),
+        ):
+            elapsed, parts = best_of(func, arg, args.repeat)
+            print(f"{name:>18}: {elapsed * 1000:8.2f} мс, частей: {parts}")
+
+
+if __name__ == "__main__":
+    main()
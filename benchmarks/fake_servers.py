@@ -0,0 +1,141 @@
+# Поддельные OpenAI-совместимый API и Telegram Bot API для нагрузочного теста.
+# Запускаются в отдельном процессе, чтобы их CPU и память не попадали в замеры бота.
+#
+#   python -m benchmarks.fake_servers [--openai-port 8701] [--telegram-port 8702] [--first-token 0.5] [--chunk-delay 0.02]
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+from benchmarks.samples import json_plan, json_day_edit, post
+
+
+def _sse(data: dict) -> bytes:
+    return ("data: " + json.dumps(data, ensure_ascii=False) + "\n\n").encode("utf-8")
+
+
+def response_text(response_format: dict | None, seed: int) -> str:
+    if not response_format:
+        return post(seed=seed)
+    name = response_format.get("json_schema", {}).get("name", "")
+    if name == "plan_day":
+        return json_day_edit(seed=seed)
+    if name.startswith("plan_day_"):
+        return json_day_edit(name[len("plan_day_"):], seed=seed)
+    return json_plan(seed=seed)
+
+
+def create_openai_app(first_token: float, chunk_delay: float, chunk_size: int = 24, jitter: float = 0.2) -> web.Application:
+    # Ответ похож на настоящий: задержка до первого фрагмента, затем поток кусками по chunk_size символов.
+    # С response_format отдается JSON по схеме (план или правка дня), без него — текст поста.
+    counter = itertools.count()
+
+    async def completions(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        seed = next(counter)
+        text = response_text(body.get("response_format"), seed)
+        # Токен считается за 3 символа; ответ длиннее max_tokens обрезается, как у настоящей модели
+        finish_reason = "stop"
+        if body.get("max_tokens") and len(text) // 3 > body["max_tokens"]:
+            text, finish_reason = text[:body["max_tokens"] * 3], "length"
+        usage = {"prompt_tokens": 900, "completion_tokens": len(text) // 3, "total_tokens": 900 + len(text) // 3,
+                 "prompt_tokens_details": {"cached_tokens": 768}}
+        await asyncio.sleep(first_token * random.uniform(1 - jitter, 1 + jitter))
+
+        if not body.get("stream"):
+            await asyncio.sleep(chunk_delay * len(text) / chunk_size)
+            return web.json_response({
+                "id": f"fake-{seed}", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunk = {"id": f"fake-{seed}", "object": "chat.completion.chunk", "created": int(time.time()), "model": body["model"]}
+        for start in range(0, len(text), chunk_size):
+            await response.write(_sse({**chunk, "choices": [
+                {"index": 0, "delta": {"content": text[start:start + chunk_size]}, "finish_reason": None}
+            ]}))
+            await asyncio.sleep(chunk_delay)
+        await response.write(_sse({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]}))
+        await response.write(_sse({**chunk, "choices": [], "usage": usage}))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def models(request: web.Request) -> web.Response:
+        return web.json_response({"object": "list", "data": []})
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_route("*", "/v1/models", models)
+    return app
+
+
+def create_telegram_app(latency: float = 0.0) -> web.Application:
+    # Bot API, который на все отвечает успехом; sendMessage/editMessageText возвращают сообщение
+    message_ids = itertools.count(1000)
+
+    async def method(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        name = request.match_info["method"].lower()
+        params = dict(await request.post())
+        if name in ("sendmessage", "editmessagetext"):
+            chat_id = int(params.get("chat_id", 0))
+            message_id = int(params["message_id"]) if name == "editmessagetext" else next(message_ids)
+            result = {
+                "message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", method)
+    return app
+
+
+async def serve(openai_port: int, telegram_port: int, first_token: float, chunk_delay: float, telegram_latency: float):
+    runners = []
+    for app, port in ((create_openai_app(first_token, chunk_delay), openai_port),
+                      (create_telegram_app(telegram_latency), telegram_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        runners.append(runner)
+    print(f"Поддельный OpenAI: http://127.0.0.1:{openai_port}/v1, Bot API: http://127.0.0.1:{telegram_port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def run(openai_port: int, telegram_port: int, first_token: float, chunk_delay: float, telegram_latency: float = 0.0):
+    asyncio.run(serve(openai_port, telegram_port, first_token, chunk_delay, telegram_latency))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--openai-port", type=int, default=8701)
+    parser.add_argument("--telegram-port", type=int, default=8702)
+    parser.add_argument("--first-token", type=float, default=0.5, help="задержка до первого фрагмента, с")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="пауза между фрагментами, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        run(args.openai_port, args.telegram_port, args.first_token, args.chunk_delay, args.telegram_latency)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
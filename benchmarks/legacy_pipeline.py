@@ -0,0 +1,162 @@
+# Замороженная копия старого конвейера обработки текста (re.sub-цепочка + MarkdownV2).
+# Нужна только бенчмаркам для сравнения с app.utils.markdown_utils / app.utils.message_utils.
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def clean_content(content: str) -> str:
+
+    content = re.sub(r'\\+', '', content) # Удалить все последовательности бэкслешей
+
+    content = re.sub(r'(\n\n|^)(—{3,}|-{3,})(\n\n|$)', '\n\n', content)
+
+    content = re.sub(r'(?<!\S)—{1}(?!\S)', '', content) 
+
+    # Удаляем двойные двоеточия (::)
+    content = re.sub(r'::+', ':', content)
+
+    # Удаляем удвоенные заголовки секций (например, "Заголовок: Заголовок:")
+    content = re.sub(r'(\b\w+\s*:\s*)\1', r'\1', content, flags=re.IGNORECASE)
+    # Также убираем " (ста):" если оно идет после "Призыв к действию"
+    content = re.sub(r'Призыв к действию \(СТА\)\s*\(\w+\):\s*', r'Призыв к действию (СТА): ', content, flags=re.IGNORECASE)
+
+
+    # Нормализация пробелов и переносов строк
+    content = re.sub(r'[ \t]+', ' ', content).strip() 
+    content = re.sub(r'\n{3,}', '\n\n', content) 
+    content = re.sub(r' \n', '\n', content) 
+    content = re.sub(r'\n ', '\n', content) 
+
+    return content.strip()
+
+
+# НОВАЯ/ОБНОВЛЕННАЯ ФУНКЦИЯ ФОРМАТИРОВАНИЯ
+def format_content_minimal(content: str) -> str:
+    content = re.sub(r'(\n\n\s*—{3,}\s*\n\n)|(\n\n\s*-{3,}\s*\n\n)', '\n\n— — —\n\n', content)
+    
+    # Убедимся, что нет более одного разделителя подряд в конце.
+    content = re.sub(r'(\n\n— — —\n\n){2,}$', '\n\n— — —\n\n', content)
+
+    # Нормализация абзацев (для избежания слишком частых \n)
+    # Если строка не заканчивается \n и за ней следует не \n (т.е. одиночный \n), добавляем вторую \n
+    content = re.sub(r'([^\n])\n(?!\n)', r'\1\n\n', content)
+    # Убираем больше двух \n подряд
+    content = re.sub(r'\n{3,}', '\n\n', content) 
+
+    content = re.sub(r'(#\w+):', r'_\1_:', content)
+    content = re.sub(r'(?<![#_])(#\w+)(?![_#])', r'_\1_', content)
+    
+    return content.strip()
+
+
+def escape_markdown_v2(text: str) -> str:
+
+    processed_chunks = []
+    open_tags_stack = []
+
+    i = 0
+    while i < len(text):
+        if text[i:i+2] == '**':
+            if not open_tags_stack or open_tags_stack[-1][0] != '**':
+                open_tags_stack.append(('**', len(processed_chunks)))
+                processed_chunks.append('**')
+            else:
+                open_tags_stack.pop()
+                processed_chunks.append('**')
+            i += 2
+        elif text[i] == '_':
+            is_word_char_before = (i > 0 and text[i-1].isalnum())
+            is_word_char_after = (i < len(text) - 1 and text[i+1].isalnum())
+
+            if is_word_char_before or is_word_char_after:
+                processed_chunks.append('\\_')
+            elif not open_tags_stack or open_tags_stack[-1][0] != '_':
+                open_tags_stack.append(('_', len(processed_chunks)))
+                processed_chunks.append('_')
+            else:
+                open_tags_stack.pop()
+                processed_chunks.append('_')
+            i += 1
+        elif text[i] in r'\[]()~`>#+-=|{}.!':
+            processed_chunks.append('\\' + text[i])
+            i += 1
+        else:
+            processed_chunks.append(text[i])
+            i += 1
+    
+    for tag_type, chunk_index in open_tags_stack:
+        logger.warning(f"Found unclosed tag '{tag_type}'. Escaping it at processed_chunks index {chunk_index}.")
+        if tag_type == '**':
+            processed_chunks[chunk_index] = '\\*\\*'
+        elif tag_type == '_':
+            processed_chunks[chunk_index] = '\\_'
+
+    return "".join(processed_chunks)
+
+
+def split_text(text: str, max_length: int = 4096) -> list[str]:
+   
+    if not text:
+        return []
+    
+    parts = []
+    current_start = 0
+
+    while current_start < len(text):
+        chunk_to_process = text[current_start:]
+
+        if len(chunk_to_process) <= max_length:
+            parts.append(chunk_to_process)
+            break
+
+        ideal_split_search_start = max(0, max_length - 500) 
+        
+        split_point_in_chunk = -1
+
+        for m in re.finditer(r'\n\n', chunk_to_process[:max_length]):
+            if m.start() >= ideal_split_search_start:
+                if not re.match(r'[\*_\[\]\(\)~`>#+\-|=\{\}\.!]', chunk_to_process[m.end():].strip()):
+                    split_point_in_chunk = m.end() 
+                    break 
+
+        if split_point_in_chunk == -1:
+            for m in re.finditer(r'\n', chunk_to_process[:max_length]):
+                if m.start() >= ideal_split_search_start:
+                    if not re.match(r'[\*_\[\]\(\)~`>#+\-|=\{\}\.!]', chunk_to_process[m.end():].strip()): # Corrected typo: chunk_to_to_process -> chunk_to_process
+                        split_point_in_chunk = m.end()
+                        break
+
+        if split_point_in_chunk == -1:
+            for m in re.finditer(r'\s', chunk_to_process[:max_length]):
+                if m.start() >= ideal_split_search_start:
+                    if not re.match(r'[\*_\[\]\(\)~`>#+\-|=\{\}\.!]', chunk_to_process[m.end():].strip()):
+                        split_point_in_chunk = m.end() 
+                        break
+        
+        if split_point_in_chunk == -1:
+            last_newline = chunk_to_process.rfind('\n', 0, max_length)
+            last_space = chunk_to_process.rfind(' ', 0, max_length)
+
+            if last_newline != -1:
+                split_point_in_chunk = last_newline + 1
+            elif last_space != -1:
+                split_point_in_chunk = last_space + 1
+            else:
+                split_point_in_chunk = max_length 
+
+        parts.append(chunk_to_process[:split_point_in_chunk])
+        current_start += split_point_in_chunk
+
+    return parts
+
+
+
+def legacy_pipeline(raw: str, max_length: int = 4096) -> list[str]:
+    # Как было в ai_generate.generate() + content_plan_handlers: очистка, экранирование,
+    # деление на части и повторное экранирование каждой части
+    content = clean_content(raw)
+    content = format_content_minimal(content)
+    content = escape_markdown_v2(content).strip()
+    return [escape_markdown_v2(part) for part in split_text(content, max_length)]
@@ -0,0 +1,301 @@
+# Сквозной нагрузочный тест без настоящих токенов и лимитов Telegram: N пользователей проходят
+# /content_plan → 7 ответов → план → пример поста через те же роутеры, middleware и очередь, что и бот.
+# Модель и Bot API подменяются локальными серверами (benchmarks/fake_servers.py) в отдельном процессе.
+#
+#   python -m benchmarks.loadtest [--users 50] [--ramp 5] [--first-token 0.5] [--chunk-delay 0.02]
+#                                 [--scenarios requests.jsonl] [--db-url ...] [--real-limits] [--speculative]
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ramp", type=float, default=5.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--first-token", type=float, default=0.5, help="задержка поддельной модели до первого фрагмента, с")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="пауза между фрагментами потока, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка ответа поддельного Bot API, с")
+    parser.add_argument("--concurrency", type=int, default=20, help="GENERATION_CONCURRENCY бота")
+    parser.add_argument("--timeout", type=float, default=120.0, help="предел ожидания одного этапа, с")
+    parser.add_argument("--scenarios", default=str(Path(__file__).resolve().parent.parent / "requests.jsonl"),
+                        help="JSONL с полями title/body — из них собираются ответы анкеты")
+    parser.add_argument("--db-url", default="", help="БД бота; по умолчанию временный файл SQLite")
+    parser.add_argument("--real-limits", action="store_true", help="оставить настоящие лимиты Telegram в rate_limiter")
+    parser.add_argument("--speculative", action="store_true", help="включить SPECULATIVE_POSTS")
+    parser.add_argument("--openai-port", type=int, default=8701)
+    parser.add_argument("--telegram-port", type=int, default=8702)
+    return parser.parse_args()
+
+
+ARGS = parse_args() if __name__ == "__main__" else None
+if ARGS is not None:
+    # Конфиг читается при импорте модулей бота, поэтому окружение готовится до импорта
+    os.environ.update({
+        "BOT_TOKEN": "42:loadtest",
+        "AI_TOKEN": "loadtest",
+        "DB_URL": ARGS.db_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='loadtest-')}/loadtest.sqlite3",
+        "FSM_STORAGE": "memory",
+        "LLM_PROVIDERS": json.dumps([{"name": "fake", "base_url": f"http://127.0.0.1:{ARGS.openai_port}/v1",
+                                      "model": "fake-model"}]),
+        "GENERATION_CONCURRENCY": str(ARGS.concurrency),
+        "GENERATION_QUEUE_SIZE": str(max(100, ARGS.users * 2)),
+        "GENERATION_CACHE_PERSISTENT": "0",
+        "SPECULATIVE_POSTS": "1" if ARGS.speculative else "0",
+    })
+    if not ARGS.real_limits:
+        os.environ.update({"TG_GLOBAL_RATE": "100000", "TG_CHAT_RATE": "100000", "TG_CHAT_BURST": "100000"})
+
+import asyncio  # noqa: E402
+import logging  # noqa: E402
+import resource  # noqa: E402
+import statistics  # noqa: E402
+import time  # noqa: E402
+from collections import defaultdict  # noqa: E402
+
+import aiohttp  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.methods import EditMessageText, SendMessage  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from app.database.models import engine, init_db  # noqa: E402
+from app.database.requests import flush_user_preferences  # noqa: E402
+from app.handlers.content_plan_handlers import router as create_plan_router  # noqa: E402
+from app.handlers.general_handlers import router as general_router  # noqa: E402
+from app.llm import llm  # noqa: E402
+from app.middlewares.concurrency import ConcurrencyLimitMiddleware  # noqa: E402
+from app.middlewares.request_id import RequestIdMiddleware  # noqa: E402
+from app.routing import route_report  # noqa: E402
+from app.scheduler import scheduler  # noqa: E402
+from app.utils.fsm_storage import create_storage  # noqa: E402
+from app.utils.sender import rate_limiter  # noqa: E402
+from benchmarks import fake_servers  # noqa: E402
+
+FIRST_TG_ID = 7_000_000_000
+FAILURE_PREFIXES = ("Произошла ошибка", "Модель не вернула", "Сейчас слишком много", "Не удалось", "Не могу")
+
+
+class ChatRecorder(BaseRequestMiddleware):
+    # Смотрит на исходящие запросы бота и будит того, кто ждет нужное сообщение в чате
+
+    def __init__(self):
+        self._waiters = defaultdict(list)  # chat_id -> [(predicate, future)]
+
+    def wait_for(self, chat_id: int, predicate) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            for predicate, future in list(waiters):
+                if future.done():
+                    waiters.remove((predicate, future))
+                elif predicate(method):
+                    future.set_result(result)
+                    waiters.remove((predicate, future))
+        return result
+
+
+def is_failure(method) -> bool:
+    return isinstance(method, (SendMessage, EditMessageText)) and method.text.startswith(FAILURE_PREFIXES)
+
+
+def is_first_day(method) -> bool:
+    return isinstance(method, SendMessage) and method.text.startswith("День 1")
+
+
+def is_plan_done(method) -> bool:
+    return isinstance(method, SendMessage) and method.reply_markup is not None
+
+
+def is_post_done(method) -> bool:
+    # Черновик обновляется без сущностей, итоговый пост — с сущностями
+    return isinstance(method, EditMessageText) and method.entities is not None
+
+
+def load_scenarios(path: str) -> list[list[str]]:
+    # Каждая строка JSONL превращается в 7 ответов анкеты; без файла — один встроенный сценарий
+    scenarios = []
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    item = json.loads(line)
+                    title, body = item.get("title", ""), item.get("body", "")
+                    scenarios.append([
+                        f"Канал для разработчиков: {title}", body[:300], "3 поста в неделю: статьи и разборы",
+                        "Разборы реальных задач из практики", "Производительность, надежность, инструменты",
+                        "Технический, но доступный", title,
+                    ])
+    return scenarios or [[
+        "Канал о студенческой жизни кафедры ИТС", "Информировать о событиях и возможностях",
+        "3 раза в неделю: статьи, обзоры", "Материалы от преподавателей и студентов",
+        "Новости кафедры, советы, кейсы", "Дружелюбный", "Один день из жизни IT-разработчика",
+    ]]
+
+
+class LoadTest:
+    def __init__(self, args, scenarios: list[list[str]]):
+        self.args = args
+        self.scenarios = scenarios
+        self.timings = defaultdict(list)
+        self.completed = 0
+        self.failed = defaultdict(int)
+        self.recorder = ChatRecorder()
+        session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{args.telegram_port}"))
+        self.bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+        self.bot.session.middleware(rate_limiter)
+        self.bot.session.middleware(self.recorder)
+        self.dp = Dispatcher(storage=create_storage())
+        self.dp.update.outer_middleware(RequestIdMiddleware())
+        self.dp.update.outer_middleware(ConcurrencyLimitMiddleware(50))
+        self.dp.include_router(general_router)
+        self.dp.include_router(create_plan_router)
+        self._update_ids = iter(range(1, 10 ** 9))
+
+    def _user(self, tg_id: int) -> dict:
+        return {"id": tg_id, "is_bot": False, "first_name": f"User{tg_id}"}
+
+    async def _feed(self, payload: dict):
+        update = Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+        await self.dp.feed_update(self.bot, update)
+
+    async def send_text(self, tg_id: int, text: str):
+        await self._feed({"message": {
+            "message_id": 1, "date": int(time.time()), "text": text,
+            "chat": {"id": tg_id, "type": "private"}, "from": self._user(tg_id),
+            **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text)}]} if text.startswith("/") else {}),
+        }})
+
+    async def press(self, tg_id: int, message_id: int, data: str):
+        await self._feed({"callback_query": {
+            "id": str(next(self._update_ids)), "from": self._user(tg_id), "chat_instance": "loadtest", "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "text": "…",
+                        "chat": {"id": tg_id, "type": "private"}},
+        }})
+
+    async def _await_stage(self, tg_id: int, stage: str, future: asyncio.Future, failure: asyncio.Future, started: float):
+        done, _ = await asyncio.wait({future, failure}, timeout=self.args.timeout, return_when=asyncio.FIRST_COMPLETED)
+        if future not in done:
+            raise RuntimeError(f"{stage}: {'ошибка бота' if failure in done else 'таймаут'}")
+        self.timings[stage].append(time.perf_counter() - started)
+        return future.result()
+
+    async def user_flow(self, index: int):
+        tg_id = FIRST_TG_ID + index
+        answers = self.scenarios[index % len(self.scenarios)]
+        await asyncio.sleep(self.args.ramp * index / max(1, self.args.users))
+        flow_started = time.perf_counter()
+        failure = self.recorder.wait_for(tg_id, is_failure)
+        stage = "fsm_step"
+        try:
+            for text in ["/content_plan", *answers[:-1]]:
+                started = time.perf_counter()
+                await self.send_text(tg_id, text)
+                self.timings["fsm_step"].append(time.perf_counter() - started)
+
+            first_day = self.recorder.wait_for(tg_id, is_first_day)
+            plan_done = self.recorder.wait_for(tg_id, is_plan_done)
+            started = time.perf_counter()
+            await self.send_text(tg_id, answers[-1])
+            stage = "plan_first_day"
+            await self._await_stage(tg_id, stage, first_day, failure, started)
+            stage = "plan_total"
+            keyboard_message = await self._await_stage(tg_id, stage, plan_done, failure, started)
+
+            post_done = self.recorder.wait_for(tg_id, is_post_done)
+            started = time.perf_counter()
+            await self.press(tg_id, keyboard_message.message_id, "generate_example_post")
+            stage = "post_total"
+            await self._await_stage(tg_id, stage, post_done, failure, started)
+        except Exception as e:
+            self.failed[stage] += 1
+            logging.getLogger(__name__).warning(f"Пользователь {tg_id}: {e}")
+            return
+        finally:
+            failure.cancel()
+
+        self.timings["flow_total"].append(time.perf_counter() - flow_started)
+        self.completed += 1
+
+    async def run(self) -> float:
+        await init_db()
+        await llm.warm_up()
+        started = time.perf_counter()
+        await asyncio.gather(*(self.user_flow(i) for i in range(self.args.users)))
+        elapsed = time.perf_counter() - started
+        await scheduler.drain(self.args.timeout)
+        await flush_user_preferences()
+        await llm.close()
+        await self.bot.session.close()
+        await engine.dispose()
+        return elapsed
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    if len(values) == 1:
+        return values[0], values[0], values[0]
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[94], cuts[98]
+
+
+def report(test: LoadTest, elapsed: float):
+    args = test.args
+    print(f"Пользователей: {args.users}, завершили: {test.completed}, с ошибкой: {sum(test.failed.values())} {dict(test.failed) or ''}")
+    print(f"Время: {elapsed:.1f} с, пропускная способность: {test.completed / elapsed:.2f} сценариев/с")
+    print(f"{'этап':>16} {'n':>6} {'p50, с':>9} {'p95, с':>9} {'p99, с':>9}")
+    for stage in ("fsm_step", "plan_first_day", "plan_total", "post_total", "flow_total"):
+        values = test.timings.get(stage)
+        if values:
+            p50, p95, p99 = percentiles(values)
+            print(f"{stage:>16} {len(values):>6} {p50:>9.3f} {p95:>9.3f} {p99:>9.3f}")
+    print(f"{'задача LLM':>16} {'n':>6} {'p50, с':>9} {'p95, с':>9} {'ср. ответ':>10} {'обрезано':>9}")
+    for task, stats in route_report().items():
+        print(f"{task:>16} {stats['requests']:>6} {stats['p50']:>9.3f} {stats['p95']:>9.3f} "
+              f"{stats['avg_completion_tokens']:>10.0f} {stats['truncated']:>9}")
+    # ru_maxrss в Linux — килобайты; поддельные серверы в отдельном процессе в замер не входят
+    print(f"Пиковый RSS процесса бота: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+
+
+async def wait_for_fakes(args, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"http://127.0.0.1:{args.openai_port}/v1/models"):
+                    return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("Поддельные серверы не запустились")
+                await asyncio.sleep(0.1)
+
+
+async def main(args):
+    logging.basicConfig(level=logging.WARNING)
+    test = LoadTest(args, load_scenarios(args.scenarios))
+    await wait_for_fakes(args)
+    elapsed = await test.run()
+    report(test, elapsed)
+
+
+if __name__ == "__main__":
+    fakes = multiprocessing.Process(
+        target=fake_servers.run,
+        args=(ARGS.openai_port, ARGS.telegram_port, ARGS.first_token, ARGS.chunk_delay, ARGS.telegram_latency),
+        daemon=True,
+    )
+    fakes.start()
+    try:
+        asyncio.run(main(ARGS))
+    finally:
+        fakes.terminate()
@@ -0,0 +1,125 @@
+# Тексты в форме ответа модели для бенчмарков: контент-планы на 7 дней и многонедельные планы
+from __future__ import annotations
+
+import random
+
+WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+TOPICS = [
+    "Мифы и реальность: как ИИ помогает студентам ИТС",
+    "Карьерные перспективы: как ИИ меняет ИТ-профессии",
+    "Этика в ИИ: что нужно знать студентам ИТС",
+    "Один день из жизни IT-разработчика 💻",
+    "Разбор проекта по автоматизации процессов на базе ИИ",
+    "Советы от старшекурсников: как выбрать специализацию",
+    "Анонс конференции (секция «Интеллектуальные системы»)",
+]
+
+DESCRIPTIONS = [
+    "Разбираем популярные заблуждения об искусственном интеллекте и показываем, как ИИ реально облегчает учебу и повседневную жизнь студентов кафедры ИТС.",
+    "Обсуждаем, какие профессии будут востребованы в ближайшие годы, какие новые специальности появляются благодаря развитию ИИ и как подготовиться к этим изменениям.",
+    "Обсуждаем важные этические вопросы, с которыми сталкиваются разработчики ИИ, и даём три простых правила для ответственного создания и использования ИИ-систем.",
+    "Проводим вас по офису партнёрской компании: стендап в 10:00, код-ревью, обед с командой и вечерний релиз. Делимся впечатлениями стажёров!",
+]
+
+CTAS = [
+    "Расскажите в комментариях, с каким мифом об ИИ сталкивались вы во время учебы?",
+    "Скачайте чек-лист с топ-5 профессий будущего для выпускников ИТС!",
+    "Пройдите квиз: готовы ли вы создавать этичный ИИ?",
+]
+
+HASHTAGS = ["#ИИ", "#СтудентыИТС", "#КарьерныйРост", "#ИТБудущее", "#ЭтикаИИ", "#Кафедра_ИТС"]
+
+
+def plan_day(number: int, rng: random.Random) -> str:
+    # Дни немного "шумные", как реальные ответы модели: повторные заголовки, _#теги_, лишние бэкслеши
+    tags = " ".join(
+        f"_{tag}_" if rng.random() < 0.5 else tag for tag in rng.sample(HASHTAGS, 3)
+    )
+    description = rng.choice(DESCRIPTIONS)
+    if rng.random() < 0.3:
+        description = "Краткое описание: " + description
+    return (
+        f"**День {number}: {WEEKDAYS[(number - 1) % 7]}**\n"
+        f"**{rng.choice(TOPICS)}**\n"
+        f"**Краткое описание:** {description}\n"
+        f"**Призыв к действию (СТА):** {rng.choice(CTAS)}\n"
+        f"**Хэштеги:** {tags}\n"
+        f"**Визуальные материалы:** Инфографика \\(карточки 1080×1350\\) и _короткое видео_ со студентами."
+    )
+
+
+def content_plan(days: int = 7, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    body = "\n\n— — —\n\n".join(plan_day(number, rng) for number in range(1, days + 1))
+    return "Конечно! Вот ваш контент-план:\n\n" + body
+
+
+def plan_of_size(size_bytes: int, seed: int = 0) -> str:
+    # Многонедельный план не меньше заданного размера в байтах UTF-8
+    rng = random.Random(seed)
+    days = []
+    total = 0
+    number = 1
+    while total < size_bytes:
+        day = plan_day(number, rng)
+        days.append(day)
+        total += len(day.encode("utf-8")) + 12
+        number += 1
+    return "\n\n— — —\n\n".join(days)
+
+
+def json_plan(days: int = 7, seed: int = 0) -> str:
+    # План в форме структурированного ответа (response_format с JSON-схемой)
+    import json
+
+    rng = random.Random(seed)
+    return json.dumps({"days": [
+        {
+            "day_title": f"День {number}: {WEEKDAYS[(number - 1) % 7]}",
+            "topic_title": rng.choice(TOPICS),
+            "description": rng.choice(DESCRIPTIONS),
+            "cta": rng.choice(CTAS),
+            "hashtags": rng.sample(HASHTAGS, 3),
+            "visuals": "Инфографика (карточки 1080×1350) и короткое видео со студентами.",
+        }
+        for number in range(1, days + 1)
+    ]}, ensure_ascii=False, indent=2)
+
+
+def json_day_edit(field: str | None = None, seed: int = 0) -> str:
+    # Ответ на правку дня: весь день (field=None) или {"value": ...} для одного поля
+    import json
+
+    day = json.loads(json_plan(days=1, seed=seed))["days"][0]
+    if field is None:
+        return json.dumps(day, ensure_ascii=False)
+    return json.dumps({"value": day[field]}, ensure_ascii=False)
+
+
+def post(seed: int = 0) -> str:
+    rng = random.Random(seed)
+    paragraphs = [f"**{rng.choice(TOPICS)}**"]
+    paragraphs += rng.sample(DESCRIPTIONS, 3)
+    paragraphs.append(rng.choice(CTAS))
+    paragraphs.append(" ".join(rng.sample(HASHTAGS, 3)))
+    return "\n\n".join(paragraphs)
+
+
+# Анкеты каналов: слова из сгенерированного словаря слогов, чтобы тексты разных анкет почти не пересекались
+SYLLABLES = ["ка", "ро", "ми", "тек", "ла", "ус", "пре", "ан", "дос", "ви", "ну", "сто", "гра", "фе", "ор", "ли"]
+BRIEF_FIELD_WORDS = {
+    "topic_audience": 12, "goal": 8, "frequency_format": 6, "usp": 10,
+    "main_rubrics_topics": 10, "content_style": 5, "specific_topics": 10,
+}
+
+
+def vocabulary(size: int = 20000, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    return ["".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(size)]
+
+
+def brief(words: list[str], seed: int = 0) -> dict:
+    # Ответы анкеты в виде данных FSM (ключи как в FSMContentPlan)
+    rng = random.Random(seed)
+    return {field: " ".join(rng.choices(words, k=count)) for field, count in BRIEF_FIELD_WORDS.items()}
@@ -1 +1,126 @@
+import os
 
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TG_TOKEN = os.getenv("BOT_TOKEN")
+AI_TOKEN = os.getenv("AI_TOKEN")
+DB_URL = os.getenv("DB_URL", "sqlite+aiosqlite:///db.sqlite3")
+
+# Минимальный интервал между редактированиями одного сообщения при стриминге (сек.)
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+# Кэш ответов ИИ: время жизни (сек.), размер LRU в памяти и хранение в БД
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", "3600"))
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "256"))
+GENERATION_CACHE_PERSISTENT = os.getenv("GENERATION_CACHE_PERSISTENT", "0") == "1"
+GENERATION_CACHE_CLEANUP_INTERVAL = float(os.getenv("GENERATION_CACHE_CLEANUP_INTERVAL", "3600"))  # Как часто удалять из БД устаревшие ответы (сек.)
+
+# Хранилище состояний FSM: "memory" (по умолчанию) или "redis" — для нескольких реплик бота
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))  # 0 — без ограничения
+FSM_DATA_TTL = int(os.getenv("FSM_DATA_TTL", "86400"))
+FSM_COMPRESS_THRESHOLD = int(os.getenv("FSM_COMPRESS_THRESHOLD", "1024"))  # байт JSON, после которых данные сжимаются
+
+# Режим получения апдейтов: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # Публичный https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+# Сколько апдейтов обрабатывается одновременно (0 — без ограничения)
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "50"))
+# Сколько секунд при остановке ждать завершения уже начатых генераций
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "120"))
+
+# Очередь генераций: сколько запросов к модели выполняется одновременно и сколько может ждать
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "5"))
+GENERATION_QUEUE_SIZE = int(os.getenv("GENERATION_QUEUE_SIZE", "100"))
+
+# Лимиты исходящих запросов к Telegram (сообщений в секунду) и число повторов после flood control
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "5"))
+
+# Пул соединений с БД (для SQLite размеры пула не используются)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Кэш подготовленных выражений asyncpg; 0 — выключить (для pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Ответы пользователей пишутся в БД пачками: по N строк или раз в M секунд
+PREFERENCE_FLUSH_ROWS = int(os.getenv("PREFERENCE_FLUSH_ROWS", "100"))
+PREFERENCE_FLUSH_INTERVAL = float(os.getenv("PREFERENCE_FLUSH_INTERVAL", "0.2"))
+
+# Кэш анкет пользователей: размер LRU, время жизни (сек.) и общий уровень в Redis (REDIS_URL)
+ANSWERS_CACHE_SIZE = int(os.getenv("ANSWERS_CACHE_SIZE", "1024"))
+ANSWERS_CACHE_TTL = float(os.getenv("ANSWERS_CACHE_TTL", "600"))
+ANSWERS_CACHE_REDIS = os.getenv("ANSWERS_CACHE_REDIS", "0") == "1"
+
+# Сколько постов недели генерируется одновременно в рамках одной задачи "все посты" (в пределах GENERATION_CONCURRENCY)
+POST_BATCH_CONCURRENCY = int(os.getenv("POST_BATCH_CONCURRENCY", "4"))
+
+# Заранее генерировать пример поста для первого дня сразу после плана (1 — включено)
+SPECULATIVE_POSTS = os.getenv("SPECULATIVE_POSTS", "0") == "1"
+SPECULATIVE_POST_TTL = float(os.getenv("SPECULATIVE_POST_TTL", "600"))  # Через сколько секунд неиспользованный пост отбрасывается
+
+# Провайдеры LLM: JSON-список OpenAI-совместимых endpoint'ов в порядке приоритета, например
+# [{"name": "openrouter", "base_url": "https://openrouter.ai/api/v1", "model": "google/gemini-2.5-flash-preview-05-20"},
+#  {"name": "backup", "base_url": "https://api.example.com/v1", "model": "some-model", "api_key_env": "BACKUP_AI_TOKEN"}]
+# Пусто — только OpenRouter с AI_TOKEN
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_WARM_CONNECTIONS = int(os.getenv("LLM_WARM_CONNECTIONS", "2"))  # Сколько соединений открыть при запуске
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "240"))
+# Маршруты задач (plan, post, edit, edit_field): модель, бюджет токенов и таймаут — см. app/routing.py
+LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+# Повторы на 429/5xx: число попыток на провайдера и границы экспоненциальной паузы (сек.)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "8"))
+# Дублирующий запрос, если ответ задерживается дольше p95 (пока замеров мало — дольше LLM_HEDGE_DELAY сек.)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "20"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+
+# Метрики Prometheus на локальном порту (GET /metrics); выключены по умолчанию
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Логирование: вывод через очередь в отдельном потоке; формат "text" или "json" (с request_id)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_BODY_LIMIT = int(os.getenv("LOG_BODY_LIMIT", "500"))  # Сколько символов большого тела попадает в лог
+LOG_BODY_SAMPLE_RATE = float(os.getenv("LOG_BODY_SAMPLE_RATE", "0.1"))  # Доля DEBUG-записей с телом ответа/сообщения
+
+# История постов: тексты хранятся сжатыми ("zstd" — если установлен пакет zstandard, иначе zlib)
+HISTORY_CODEC = os.getenv("HISTORY_CODEC", "zlib")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "5"))
+
+# Экспорт планов в PDF/Markdown: верстка PDF в пуле процессов, готовые файлы кэшируются
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "2"))
+EXPORT_CACHE_SIZE = int(os.getenv("EXPORT_CACHE_SIZE", "64"))
+EXPORT_FONT_PATH = os.getenv("EXPORT_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")  # TTF с кириллицей
+EXPORT_BOLD_FONT_PATH = os.getenv("EXPORT_BOLD_FONT_PATH", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+
+# run_sharded.py: число процессов-воркеров (0 — по числу ядер, но не больше GENERATION_CONCURRENCY и других делимых лимитов)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+# Адрес Bot API — можно указать свой сервер telegram-bot-api
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+
+# Похожие анкеты (MinHash/LSH в памяти): при сходстве не ниже порога бот предлагает готовый план; 0 — выключено
+BRIEF_SIMILARITY_THRESHOLD = float(os.getenv("BRIEF_SIMILARITY_THRESHOLD", "0.7"))
+BRIEF_MINHASH_SIZE = int(os.getenv("BRIEF_MINHASH_SIZE", "64"))  # Длина подписи (степень двойки)
+BRIEF_LSH_BANDS = int(os.getenv("BRIEF_LSH_BANDS", "16"))  # Полос LSH; BRIEF_MINHASH_SIZE должен на них делиться
+BRIEF_INDEX_REFRESH = float(os.getenv("BRIEF_INDEX_REFRESH", "60"))  # Как часто подтягивать анкеты других процессов, сек.
+BRIEF_REUSE_SHARED = os.getenv("BRIEF_REUSE_SHARED", "0") == "1"  # Предлагать и чужие планы, а не только свои (1 — включить)
@@ -1,40 +1,110 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: записи уходят в очередь, вывод делает отдельный поток
+from app.utils.log_utils import setup_logging
+log_listener = setup_logging()
 
 # Импорт конфигурации
-from config import TG_TOKEN
+from config import TG_TOKEN, BOT_MODE, MAX_CONCURRENT_UPDATES, SHUTDOWN_TIMEOUT, TELEGRAM_API_URL
 
 # Импорт роутеров
 from app.handlers.general_handlers import router as general_router
 from app.handlers.content_plan_handlers import router as create_plan_router
+from app.handlers.history_handlers import router as history_router
 from app.handlers.edit_plan_handler import router as edit_router
 
 # Импорт инициализации БД
 from app.database.models import init_db
+from app.database.requests import flush_user_preferences
+from app.utils.fsm_storage import create_storage
+from app.middlewares.concurrency import ConcurrencyLimitMiddleware
+from app.scheduler import scheduler
+from app.utils.sender import rate_limiter
+from app.llm import llm
+from app.export import close_export_pool, warm_up_export_pool
+from app.brief_index import brief_index
+from app.ai_generate import start_cache_cleanup, stop_cache_cleanup
+from app.metrics import metrics
+from app.middlewares.metrics import UpdateMetricsMiddleware, HandlerMetricsMiddleware
+from app.middlewares.request_id import RequestIdMiddleware
 
-bot = Bot(token=TG_TOKEN)
-dp = Dispatcher()
+bot = Bot(token=TG_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+# Все запросы к Bot API идут через общий ограничитель скорости с повтором после RetryAfter
+bot.session.middleware(rate_limiter)
+dp = Dispatcher(storage=create_storage())
+
+# request_id в логах: первым, чтобы его видели все остальные middleware и хэндлеры
+dp.update.outer_middleware(RequestIdMiddleware())
+
+# Ограничение одновременно обрабатываемых апдейтов; при остановке ждем уже начатые
+concurrency = ConcurrencyLimitMiddleware(MAX_CONCURRENT_UPDATES)
+dp.update.outer_middleware(concurrency)
+
+# Метрики подключаются только при METRICS_ENABLED=1 — иначе лишнего звена в цепочке нет
+if metrics.enabled:
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+# Подключение роутеров
+dp.include_router(general_router)
+dp.include_router(create_plan_router)
+dp.include_router(history_router)
+dp.include_router(edit_router)
+
+@dp.shutdown()
+async def on_shutdown():
+    # Сначала дорабатывают апдейты, которые еще могут поставить задачи, затем сама очередь генераций
+    await concurrency.drain(SHUTDOWN_TIMEOUT)
+    await scheduler.drain(SHUTDOWN_TIMEOUT)
+    # Последними в БД уходят ответы, накопленные в буфере записи
+    await flush_user_preferences()
+    await llm.close()
+    close_export_pool()
+    brief_index.close()
+    stop_cache_cleanup()
+
+async def prepare():
+    # Соединения с провайдерами LLM и пул экспорта открываются заранее, а не на первом запросе пользователя;
+    # индекс похожих анкет загружается из БД, устаревший кэш ответов удаляется. Используется и воркерами run_sharded.py;
+    # возвращает runner метрик (или None)
+    await llm.warm_up()
+    await warm_up_export_pool()
+    await brief_index.start()
+    start_cache_cleanup()
+    return await metrics.start_server()
 
 async def main():
     # Инициализация БД
     logging.info("🔄 Инициализация базы данных...")
     await init_db()
+    await brief_index.backfill()
     logging.info("✅ База данных инициализирована")
 
-    # Подключение роутеров
-    dp.include_router(general_router)
-    dp.include_router(create_plan_router)
-    dp.include_router(edit_router)
+    metrics_runner = await prepare()
 
     print("🤖 Бот запущен...")
-    await dp.start_polling(bot, drop_pending_updates=True)
+    try:
+        if BOT_MODE == "webhook":
+            from app.webhook import run_webhook
+            await run_webhook(bot, dp)
+        else:
+            # Снимаем вебхук, если бот раньше работал в режиме webhook, и сбрасываем старые апдейты
+            await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
+    finally:
+        await dp.storage.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("🛑 Бот остановлен.")
\ No newline at end of file
+        print("🛑 Бот остановлен.")
+    finally:
+        log_listener.stop()
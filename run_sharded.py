@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+# Запуск бота в нескольких процессах. Супервизор один получает апдейты (long polling или вебхук)
+# и раздает их воркерам по id пользователя: все апдейты одного пользователя попадают в один и тот же
+# процесс и обрабатываются в нем по очереди, поэтому порядок шагов анкеты (FSM) сохраняется.
+# Воркер — обычный бот из run.py, только апдейты приходят не из Telegram, а из очереди супервизора.
+#
+# Модули бота импортируются внутри функций: у воркера config должен прочитать окружение
+# уже с его долями общих лимитов (см. shard_environment).
+
+logger = logging.getLogger("run_sharded")
+
+# Типы апдейтов, которые обрабатывают роутеры бота
+ALLOWED_UPDATES = ["message", "callback_query"]
+# Воркер, упавший чаще RESTART_BURST раз за RESTART_WINDOW секунд, перезапускается с паузой
+RESTART_BURST = 5
+RESTART_WINDOW = 60.0
+RESTART_DELAY = 5.0
+
+
+def update_user_id(update: dict) -> int:
+    # id пользователя из любого типа апдейта (message, callback_query, ...); без пользователя — id чата
+    for key, value in update.items():
+        if key != "update_id" and isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+            chat = value.get("chat") or (value.get("message") or {}).get("chat")
+            if chat:
+                return chat["id"]
+    return 0
+
+
+def shard_for(user_id: int, workers: int) -> int:
+    return user_id % workers
+
+
+def shard_limits() -> dict[str, int]:
+    # Лимиты, в которых каждому воркеру нужно хотя бы одно место: воркеров не запускается больше,
+    # чем мест в самом узком из них
+    from config import GENERATION_CONCURRENCY, GENERATION_QUEUE_SIZE, MAX_CONCURRENT_UPDATES, DB_POOL_SIZE
+
+    limits = {
+        "GENERATION_CONCURRENCY": GENERATION_CONCURRENCY,
+        "GENERATION_QUEUE_SIZE": GENERATION_QUEUE_SIZE,
+        "DB_POOL_SIZE": DB_POOL_SIZE,
+    }
+    if MAX_CONCURRENT_UPDATES:
+        limits["MAX_CONCURRENT_UPDATES"] = MAX_CONCURRENT_UPDATES
+    return limits
+
+
+def shard_environment(index: int, workers: int) -> dict:
+    # Общие лимиты (Telegram, модель, БД) делятся между воркерами, чтобы вместе они не превышали настроек:
+    # остаток от деления достается первым воркерам
+    from config import (TG_GLOBAL_RATE, GENERATION_CONCURRENCY, GENERATION_QUEUE_SIZE, MAX_CONCURRENT_UPDATES,
+                        DB_POOL_SIZE, DB_MAX_OVERFLOW, METRICS_PORT)
+
+    def share(value: int) -> str:
+        return str(value // workers + (index < value % workers))
+
+    return {
+        "TG_GLOBAL_RATE": str(TG_GLOBAL_RATE / workers),
+        "GENERATION_CONCURRENCY": share(GENERATION_CONCURRENCY),
+        "GENERATION_QUEUE_SIZE": share(GENERATION_QUEUE_SIZE),
+        "MAX_CONCURRENT_UPDATES": share(MAX_CONCURRENT_UPDATES) if MAX_CONCURRENT_UPDATES else "0",
+        "DB_POOL_SIZE": share(DB_POOL_SIZE),
+        "DB_MAX_OVERFLOW": share(DB_MAX_OVERFLOW),
+        # Метрики каждого воркера — на своем порту: METRICS_PORT + 1 + номер воркера
+        "METRICS_PORT": str(METRICS_PORT + 1 + index),
+    }
+
+
+# ====== Воркер ======
+def worker_main(index: int, environment: dict, updates):
+    # Ctrl+C приходит всей группе процессов — останавливает воркеры только супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ.update(environment)
+    asyncio.run(serve_shard(index, updates))
+    # Поток записи логов не демон — без остановки процесс воркера не завершится
+    import run
+    run.log_listener.stop()
+
+
+async def serve_shard(index: int, updates):
+    import run
+    from run import bot, dp
+    from app.database.models import engine
+
+    metrics_runner = await run.prepare()
+    loop = asyncio.get_running_loop()
+    tails: dict[int, asyncio.Task] = {}  # Последняя задача каждого пользователя
+
+    async def feed(previous: asyncio.Task | None, update: dict):
+        if previous is not None:
+            await asyncio.wait({previous})
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.error("Воркер %s: ошибка при обработке апдейта %s: %s", index, update.get("update_id"), e, exc_info=True)
+
+    def forget(user_id: int, task: asyncio.Task):
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    logger.info("Воркер %s (pid %s) готов", index, os.getpid())
+    try:
+        while True:
+            item = await loop.run_in_executor(None, updates.get)
+            if item is None:
+                break
+            user_id, update = item
+            # Апдейты разных пользователей обрабатываются параллельно, одного — строго по порядку
+            task = loop.create_task(feed(tails.get(user_id), update))
+            tails[user_id] = task
+            task.add_done_callback(lambda t, u=user_id: forget(u, t))
+
+        if tails:
+            await asyncio.wait(set(tails.values()))
+        await dp.emit_shutdown(bot=bot)
+    finally:
+        await dp.storage.close()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        # Соединения aiosqlite держат потоки, которые тоже не дают процессу завершиться
+        await engine.dispose()
+        logger.info("Воркер %s остановлен", index)
+
+
+# ====== Супервизор ======
+class Supervisor:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes: list = [None] * workers
+        self._restarts: list[list[float]] = [[] for _ in range(workers)]
+        self.stopping = False
+
+    def start_worker(self, index: int):
+        process = self._context.Process(
+            target=worker_main,
+            args=(index, shard_environment(index, self.workers), self.queues[index]),
+            # Не daemon: воркеру нужен собственный пул процессов экспорта PDF
+            name=f"bot-shard-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def route(self, update: dict):
+        user_id = update_user_id(update)
+        self.queues[shard_for(user_id, self.workers)].put((user_id, update))
+
+    async def watch(self):
+        # Упавший воркер перезапускается с новой очередью: убитый процесс мог оставить за собой
+        # блокировку чтения старой. Апдейты, которые он уже получил, но не обработал, теряются
+        while not self.stopping:
+            await asyncio.sleep(1)
+            for index, process in enumerate(self.processes):
+                if self.stopping or process.is_alive():
+                    continue
+                now = time.monotonic()
+                restarts = [t for t in self._restarts[index] if now - t < RESTART_WINDOW]
+                self._restarts[index] = restarts + [now]
+                logger.error("Воркер %s завершился с кодом %s — перезапуск", index, process.exitcode)
+                self.queues[index] = self._context.Queue()
+                if len(restarts) >= RESTART_BURST:
+                    await asyncio.sleep(RESTART_DELAY)
+                if not self.stopping:
+                    self.start_worker(index)
+
+    async def stop(self, timeout: float):
+        self.stopping = True
+        for q in self.queues:
+            q.put(None)
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await asyncio.get_running_loop().run_in_executor(None, process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Воркер %s не остановился за %s с — завершаем принудительно", index, timeout)
+                process.terminate()
+
+
+async def poll_updates(session, api: str, supervisor: Supervisor, stop: asyncio.Event):
+    # Один long polling на весь бот; апдейты не разбираются в объекты aiogram — воркеру уходит словарь
+    import aiohttp
+
+    offset = None
+    while not stop.is_set():
+        params = {"timeout": 30, "allowed_updates": json.dumps(ALLOWED_UPDATES)}
+        if offset is not None:
+            params["offset"] = offset
+        try:
+            async with session.get(f"{api}/getUpdates", params=params, timeout=aiohttp.ClientTimeout(total=40)) as response:
+                payload = await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("Ошибка getUpdates: %s", e)
+            await asyncio.sleep(1)
+            continue
+        if not payload.get("ok"):
+            logger.warning("getUpdates вернул ошибку: %s", payload.get("description"))
+            await asyncio.sleep(payload.get("parameters", {}).get("retry_after", 1))
+            continue
+        for update in payload["result"]:
+            offset = update["update_id"] + 1
+            supervisor.route(update)
+
+
+async def serve_webhook(supervisor: Supervisor, stop: asyncio.Event):
+    from aiohttp import web
+    from config import WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT
+
+    async def handle(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        supervisor.route(await request.json())
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    logger.info("Сервер вебхука слушает %s:%s", WEBAPP_HOST, WEBAPP_PORT)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main():
+    import aiohttp
+    from app.brief_index import brief_index
+    from app.database.models import init_db, engine
+    from config import (TG_TOKEN, BOT_MODE, SHARD_WORKERS, SHUTDOWN_TIMEOUT, TELEGRAM_API_URL, WEBHOOK_BASE_URL,
+                        WEBHOOK_PATH, WEBHOOK_SECRET)
+
+    # Таблицы и подписи старых анкет создаются один раз супервизором, а не каждым воркером
+    await init_db()
+    await brief_index.backfill()
+    await engine.dispose()
+
+    workers = SHARD_WORKERS or os.cpu_count() or 1
+    name, limit = min(shard_limits().items(), key=lambda item: item[1])
+    if workers > limit:
+        logger.warning("%s=%s меньше числа воркеров (%s) — запускается воркеров: %s", name, limit, workers, max(1, limit))
+        workers = max(1, limit)
+    supervisor = Supervisor(workers)
+    for index in range(workers):
+        supervisor.start_worker(index)
+    print(f"🤖 Бот запущен: {workers} воркеров, режим {BOT_MODE}...")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    api = f"{TELEGRAM_API_URL.rstrip('/')}/bot{TG_TOKEN}"
+    watcher = asyncio.create_task(supervisor.watch())
+    async with aiohttp.ClientSession() as session:
+        try:
+            if BOT_MODE == "webhook":
+                if not WEBHOOK_BASE_URL:
+                    raise RuntimeError("Для режима webhook нужно задать WEBHOOK_BASE_URL")
+                webhook = {"url": f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}", "allowed_updates": ALLOWED_UPDATES}
+                if WEBHOOK_SECRET:
+                    webhook["secret_token"] = WEBHOOK_SECRET
+                await session.post(f"{api}/setWebhook", json=webhook)
+                await serve_webhook(supervisor, stop)
+            else:
+                # Как и run.py: снимаем вебхук и сбрасываем старые апдейты
+                await session.post(f"{api}/deleteWebhook", json={"drop_pending_updates": True})
+                polling = asyncio.create_task(poll_updates(session, api, supervisor, stop))
+                await stop.wait()
+                polling.cancel()
+        finally:
+            # Воркеры дорабатывают полученные апдейты и генерации (как on_shutdown в run.py)
+            await supervisor.stop(SHUTDOWN_TIMEOUT + 10)
+            watcher.cancel()
+
+
+if __name__ == "__main__":
+    from app.utils.log_utils import setup_logging
+
+    log_listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        print("🛑 Бот остановлен.")
+        log_listener.stop()
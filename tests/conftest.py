@@ -0,0 +1,28 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+
+# Конфиг читается при импорте модулей бота: тесты работают с временной SQLite, а не с базой из .env
+os.environ["DB_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp(prefix='content-bot-tests-')}/test.sqlite3"
+# Клиент LLM создается при импорте app.ai_generate; запросов к провайдеру тесты не делают
+os.environ.setdefault("AI_TOKEN", "test")
+
+
+@pytest.fixture
+def run_db():
+    from app.database.models import engine, init_db
+
+    def run(scenario):
+        async def main():
+            await init_db()
+            try:
+                await scenario()
+            finally:
+                # Соединения aiosqlite привязаны к циклу событий теста; без dispose процесс не завершится
+                await engine.dispose()
+
+        asyncio.run(main())
+
+    return run
@@ -0,0 +1,20 @@
+import asyncio
+import multiprocessing
+
+from app import export
+
+
+def test_export_pool_uses_spawn_without_forkserver(monkeypatch):
+    # Как на Windows: forkserver нет, а пул экспорта прогревается при старте бота
+    monkeypatch.setattr(multiprocessing, "get_all_start_methods", lambda: ["spawn"])
+    monkeypatch.setattr(export, "_pool", None)
+    monkeypatch.setattr(export, "EXPORT_WORKERS", 1)
+
+    async def scenario():
+        await export.warm_up_export_pool()
+        assert export._pool._mp_context.get_start_method() == "spawn"
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        export.close_export_pool()
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from aiogram.fsm.storage.base import StorageKey
+
+from app.utils.fsm_storage import create_storage, pack_data, unpack_data
+from config import FSM_STATE_TTL, FSM_DATA_TTL, FSM_COMPRESS_THRESHOLD
+
+fakeredis = pytest.importorskip("fakeredis")
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+def test_pack_data_compresses_only_large_values():
+    small = {"topic": "кофейня"}
+    assert pack_data(small).startswith("{")
+    assert unpack_data(pack_data(small)) == small
+
+    large = {"content_plan": "День 1: обзор новинок. " * FSM_COMPRESS_THRESHOLD}
+    packed = pack_data(large)
+    assert packed.startswith("z:")
+    assert len(packed) < len(large["content_plan"])
+    assert unpack_data(packed) == large
+
+
+def test_redis_storage_round_trip():
+    async def scenario():
+        server = fakeredis.FakeServer()
+        redis = fakeredis.aioredis.FakeRedis(server=server)
+        storage = create_storage(redis)
+        data = {"topic_audience": "кофейня, студенты", "content_plan": "День 1: обзор новинок. " * 200}
+        await storage.set_state(KEY, "ContentPlanForm:goal")
+        await storage.set_data(KEY, data)
+
+        # Данные лежат в Redis сжатыми и с ограниченным сроком жизни
+        keys = {key.decode(): key for key in await redis.keys("content_bot:*")}
+        state_key = next(key for name, key in keys.items() if name.endswith(":state"))
+        data_key = next(key for name, key in keys.items() if name.endswith(":data"))
+        assert (await redis.get(data_key)).startswith(b"z:")
+        assert 0 < await redis.ttl(state_key) <= FSM_STATE_TTL
+        assert 0 < await redis.ttl(data_key) <= FSM_DATA_TTL
+
+        # Новое хранилище на том же сервере (как после перезапуска бота) видит состояние и данные
+        await storage.close()
+        restored = create_storage(fakeredis.aioredis.FakeRedis(server=server))
+        assert await restored.get_state(KEY) == "ContentPlanForm:goal"
+        assert await restored.get_data(KEY) == data
+
+        await restored.set_state(KEY, None)
+        await restored.set_data(KEY, {})
+        assert await restored.get_state(KEY) is None
+        assert await restored.get_data(KEY) == {}
+        await restored.close()
+
+    asyncio.run(scenario())
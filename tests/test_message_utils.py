@@ -0,0 +1,18 @@
+from app.utils.markdown_utils import render_markdown, utf16_len
+from app.utils.message_utils import split_formatted
+
+
+def test_split_emoji_entity_spanning_several_parts():
+    # Жирная сущность начинается до каждой следующей части, эмодзи сдвигают единицы UTF-16 —
+    # раньше деление зацикливалось или давало часть длиннее лимита
+    formatted = render_markdown("**" + " ".join(["слово 📋"] * 1500) + "**")
+    parts = split_formatted(formatted, 4096)
+    assert len(parts) > 1
+    assert all(utf16_len(part.text) <= 4096 for part in parts)
+    assert "".join(part.text for part in parts).replace(" ", "") == formatted.text.replace(" ", "")
+
+
+def test_split_emoji_entity_small_limit():
+    formatted = render_markdown("**" + " ".join(["слово 📋"] * 40) + "** конец")
+    parts = split_formatted(formatted, 30)
+    assert all(utf16_len(part.text) <= 30 for part in parts)
@@ -0,0 +1,52 @@
+from types import SimpleNamespace
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.database import requests
+from app.database.models import ContentPlanAnswers, async_session
+
+
+async def stored_answers(tg_id: int) -> list[ContentPlanAnswers]:
+    async with async_session() as session:
+        return list(await session.scalars(select(ContentPlanAnswers).where(ContentPlanAnswers.tg_id == tg_id)))
+
+
+def test_sqlite_upsert_updates_answers_in_place(run_db):
+    async def scenario():
+        await requests.save_content_plan_answers({"tg_id": 101, "topic_audience": "кофейня", "goal": "продажи"})
+        await requests.save_content_plan_answers({"tg_id": 101, "goal": "узнаваемость", "usp": None,
+                                                  "content_style": "дружелюбный", "unknown_field": "x"})
+
+        rows = await stored_answers(101)
+        assert len(rows) == 1
+        row = rows[0]
+        assert row.topic_audience == "кофейня"  # Ответы, которых нет во втором сохранении, не затираются
+        assert row.goal == "узнаваемость"
+        assert row.usp is None
+        assert row.content_tone == "дружелюбный"  # Ключ FSM content_style хранится в колонке content_tone
+        assert row.updated_at is not None
+
+        answers = await requests.get_content_plan_answers(101)
+        assert answers.goal == "узнаваемость"
+
+    run_db(scenario)
+
+
+def test_postgresql_upsert_statement(monkeypatch):
+    monkeypatch.setattr(requests, "engine", SimpleNamespace(dialect=SimpleNamespace(name="postgresql")))
+    stmt = requests._upsert_statement({"tg_id": 1, "goal": "продажи"})
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (tg_id) DO UPDATE SET goal = excluded.goal, updated_at = now()" in sql
+
+
+def test_other_dialects_fall_back_to_select_and_update(run_db, monkeypatch):
+    monkeypatch.setattr(requests, "_upsert_statement", lambda values: None)
+
+    async def scenario():
+        await requests.save_content_plan_answers({"tg_id": 102, "topic_audience": "пекарня"})
+        await requests.save_content_plan_answers({"tg_id": 102, "goal": "заказы"})
+        rows = await stored_answers(102)
+        assert [(row.topic_audience, row.goal) for row in rows] == [("пекарня", "заказы")]
+
+    run_db(scenario)
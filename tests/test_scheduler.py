@@ -0,0 +1,197 @@
+import asyncio
+
+from app.scheduler import GenerationScheduler, STARTED, QUEUED, DUPLICATE, REJECTED
+
+
+async def settle():
+    # Даем поработать всем готовым задачам цикла событий
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_users_are_served_round_robin():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=10)
+        order = []
+        positions = {}  # Все сообщенные пользователю позиции задачи
+
+        def job(name):
+            async def run():
+                order.append(name)
+                await asyncio.sleep(0)
+            return run
+
+        def position(name):
+            async def on_position(value):
+                positions.setdefault(name, []).append(value)
+            return on_position
+
+        # Пользователь 1 ставит три задачи подряд, пользователь 2 — две: первый не должен занять всю очередь
+        assert scheduler.submit(1, "plan", job("a1")) == (STARTED, 0)
+        assert scheduler.submit(1, "post", job("a2"), position("a2")) == (QUEUED, 1)
+        assert scheduler.submit(1, "edit", job("a3"), position("a3")) == (QUEUED, 2)
+        assert scheduler.submit(2, "plan", job("b1"), position("b1")) == (QUEUED, 1)
+        assert scheduler.submit(2, "post", job("b2"), position("b2")) == (QUEUED, 3)
+        assert await scheduler.drain(5)
+        await settle()
+        assert order == ["a1", "b1", "a2", "b2", "a3"]
+        assert positions == {"a2": [1, 2, 1], "a3": [2, 3, 4, 3, 2, 1], "b1": [1], "b2": [3, 2, 1]}
+        assert scheduler.running == scheduler.queued == 0
+
+    asyncio.run(scenario())
+
+
+def test_duplicate_jobs_are_merged_until_finished():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=10)
+        release = asyncio.Event()
+        runs = []
+
+        async def run():
+            runs.append(1)
+            await release.wait()
+
+        assert scheduler.submit(1, "plan", run)[0] == STARTED
+        assert scheduler.submit(1, "plan", run) == (DUPLICATE, 0)  # Та же задача уже выполняется
+        assert scheduler.submit(2, "plan", run)[0] == QUEUED
+        assert scheduler.submit(2, "plan", run) == (DUPLICATE, 0)  # ...и уже ждет в очереди
+        assert scheduler.submit(1, "post", run)[0] == QUEUED  # Другой тип задачи — не повтор
+
+        release.set()
+        assert await scheduler.drain(5)
+        assert len(runs) == 3
+        assert scheduler.submit(1, "plan", run)[0] == STARTED  # После завершения задачу можно поставить снова
+        assert await scheduler.drain(5)
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_rejects_new_jobs():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=2)
+        release = asyncio.Event()
+
+        async def run():
+            await release.wait()
+
+        assert scheduler.submit(1, "plan", run)[0] == STARTED  # Выполняемая задача не занимает место в очереди
+        assert scheduler.submit(2, "plan", run) == (QUEUED, 1)
+        assert scheduler.submit(3, "plan", run) == (QUEUED, 2)
+        assert scheduler.submit(4, "plan", run) == (REJECTED, 0)
+        assert scheduler.queued == 2
+
+        release.set()
+        assert await scheduler.drain(5)
+        assert scheduler.submit(4, "plan", run)[0] == STARTED
+
+    asyncio.run(scenario())
+
+
+def test_own_slot_passes_to_waiting_request_of_same_job():
+    async def scenario():
+        # Один слот на всех: пакет запросов задачи идет по очереди через ее собственное место и не ждет
+        # задачу другого пользователя, которая сама ждет освобождения этого места
+        scheduler = GenerationScheduler(concurrency=1, max_queue=10)
+        active = 0
+        peak = 0
+        done = []
+
+        async def request(name):
+            nonlocal active, peak
+            async with scheduler.slot():
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.01)
+                active -= 1
+            done.append(name)
+
+        async def batch():
+            await asyncio.gather(*(request(f"post{i}") for i in range(3)))
+
+        async def other():
+            await request("other")
+
+        scheduler.submit(1, "posts", batch)
+        scheduler.submit(2, "plan", other)
+        assert await asyncio.wait_for(scheduler.drain(5), 5)
+        assert peak == 1
+        assert done == ["post0", "post1", "post2", "other"]
+        assert scheduler.free_slots == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_slot_waiters_do_not_leak_slots():
+    async def scenario():
+        scheduler = GenerationScheduler(concurrency=1, max_queue=10)
+
+        async def waiter():
+            async with scheduler.slot():
+                await asyncio.sleep(10)
+
+        holder = scheduler.slot()
+        await holder.__aenter__()
+
+        # Отмена, пока запрос ждет места: ожидание убирается из очереди
+        cancelled = asyncio.create_task(waiter())
+        await settle()
+        cancelled.cancel()
+        await settle()
+        assert cancelled.cancelled()
+
+        # Отмена сразу после того, как место передано запросу, но до того, как он успел проснуться:
+        # переданное место возвращается
+        granted = asyncio.create_task(waiter())
+        await settle()
+        await holder.__aexit__(None, None, None)
+        assert scheduler.free_slots == 0  # Место уже передано ожидающему запросу
+        granted.cancel()
+        await settle()
+        assert granted.cancelled()
+        assert scheduler.free_slots == 1
+
+        # Лимит по-прежнему работает: задача из очереди получает освободившееся место
+        ran = []
+
+        async def run():
+            async with scheduler.slot():
+                ran.append(1)
+
+        assert scheduler.submit(1, "plan", run)[0] == STARTED
+        assert await scheduler.drain(5)
+        assert ran == [1] and scheduler.free_slots == 1
+
+    asyncio.run(scenario())
+
+
+def test_request_outliving_its_job_stays_under_the_cap():
+    async def scenario():
+        # Задача запускает фоновый запрос и завершается, не дожидаясь его (как план и предварительный пост):
+        # пока запрос идет, следующая задача не должна получить его место
+        scheduler = GenerationScheduler(concurrency=1, max_queue=10)
+        active = 0
+        peak = 0
+        background = []
+
+        async def request():
+            nonlocal active, peak
+            async with scheduler.slot():
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(0.02)
+                active -= 1
+
+        async def plan():
+            async with scheduler.slot():
+                await asyncio.sleep(0)
+            background.append(asyncio.get_running_loop().create_task(request()))
+            await asyncio.sleep(0)
+
+        scheduler.submit(1, "plan", plan)
+        scheduler.submit(2, "plan", request)
+        assert await scheduler.drain(5)
+        await asyncio.gather(*background)
+        assert peak == 1
+        assert scheduler.free_slots == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from app.utils import sender
+from app.utils.sender import RateLimitMiddleware, TokenBucket
+
+
+class FakeClock:
+    # Время для token bucket: sleep не ждет, а сдвигает часы
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sender, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(sender, "asyncio", SimpleNamespace(sleep=clock.sleep, Lock=asyncio.Lock))
+    return clock
+
+
+def flood(method, retry_after: int) -> TelegramRetryAfter:
+    return TelegramRetryAfter(method=method, message="Flood control exceeded", retry_after=retry_after)
+
+
+def test_token_bucket_allows_burst_then_rate(clock):
+    async def scenario():
+        bucket = TokenBucket(rate=2, capacity=3)
+        for _ in range(3):
+            await bucket.acquire()
+        assert clock.sleeps == []
+        await bucket.acquire()
+        assert clock.sleeps == [pytest.approx(0.5)]
+
+        bucket.block(5)
+        assert bucket.delay() == pytest.approx(5)
+        assert not bucket.is_idle()
+        clock.now += 5
+        assert bucket.delay() == 0
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_blocks_chat_and_repeats_request(clock):
+    async def scenario():
+        limiter = RateLimitMiddleware(global_rate=30, chat_rate=1, chat_burst=3, max_retries=2)
+        method = SendMessage(chat_id=5, text="День 1")
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(clock.now)
+            if len(calls) == 1:
+                raise flood(method, 7)
+            return "ok"
+
+        assert await limiter(make_request, None, method) == "ok"
+        # Повтор ушел не раньше, чем разрешил Telegram: пауза легла на token bucket чата
+        assert len(calls) == 2
+        assert calls[1] - calls[0] >= 7
+        assert limiter.chat_bucket(5).blocked_until == calls[0] + 7
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_gives_up_after_max_retries(clock):
+    async def scenario():
+        limiter = RateLimitMiddleware(max_retries=2)
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(method)
+            raise flood(method, 1)
+
+        with pytest.raises(TelegramRetryAfter):
+            await limiter(make_request, None, SendMessage(chat_id=5, text="x"))
+        assert len(calls) == 3
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_without_chat_waits_and_repeats(clock):
+    async def scenario():
+        limiter = RateLimitMiddleware()
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(method)
+            if len(calls) == 1:
+                raise flood(method, 3)
+            return "ok"
+
+        assert await limiter(make_request, None, GetMe()) == "ok"
+        assert clock.sleeps == [3]
+
+    asyncio.run(scenario())
@@ -0,0 +1,63 @@
+import asyncio
+from types import SimpleNamespace
+
+from app import speculation
+from app.metrics import Metrics
+from app.scheduler import GenerationScheduler
+from app.speculation import SpeculativePosts
+
+
+def test_speculative_post_runs_under_the_cap_after_plan_job(monkeypatch):
+    scheduler = GenerationScheduler(concurrency=2, max_queue=10)
+    metrics = Metrics(enabled=True)
+    monkeypatch.setattr(speculation, "scheduler", scheduler)
+    monkeypatch.setattr(speculation, "metrics", metrics)
+    active = 0
+    peak = 0
+
+    async def complete(prompt, system=None, on_usage=None, route=None):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        if on_usage is not None:
+            on_usage(SimpleNamespace(completion_tokens=50))
+        return f"Пост: {prompt}"
+
+    monkeypatch.setattr(speculation, "complete", complete)
+
+    async def scenario():
+        posts = SpeculativePosts(enabled=True, ttl=60)
+
+        async def other_user():
+            async with scheduler.slot():
+                await complete("план другого пользователя")
+
+        async def plan():
+            # Как generate_content_plan: план готов, пост первого дня запускается в фоне, задача завершается
+            async with scheduler.slot():
+                await complete("план")
+            assert posts.start(1, plan_id=10, prompt="день 1")
+            await asyncio.sleep(0)
+            scheduler.submit(2, "plan", other_user)
+            scheduler.submit(3, "plan", other_user)
+
+        scheduler.submit(1, "plan", plan)
+        assert await scheduler.drain(5)
+        await asyncio.sleep(0.05)
+
+        assert peak == 2  # Предварительный пост не занял место уже завершенной задачи плана
+        assert posts.take(1, 10) == "Пост: день 1"
+        assert posts.start(1, plan_id=11, prompt="день 1 нового плана")
+        await asyncio.sleep(0.05)
+        posts.discard(1)
+
+    asyncio.run(scenario())
+
+    rendered = metrics.render()
+    assert 'bot_speculative_posts_total{event="started"} 2' in rendered
+    assert 'bot_speculative_posts_total{event="hits"} 1' in rendered
+    assert 'bot_speculative_posts_total{event="discarded"} 1' in rendered
+    assert "bot_speculative_wasted_tokens_total 50" in rendered
+    assert "bot_speculative_hit_rate 0.5" in rendered
@@ -0,0 +1,97 @@
+import asyncio
+
+from app.database import requests
+from app.database.write_buffer import WriteBehindBuffer
+
+
+class Recorder:
+    def __init__(self, fail: int = 0):
+        self.batches = []
+        self.fail = fail  # Сколько первых записей завершится ошибкой
+        self.release = None  # Event: запись ждет его, пока пачка «пишется»
+
+    async def write(self, rows):
+        if self.release is not None:
+            await self.release.wait()
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("БД недоступна")
+        self.batches.append(list(rows))
+
+
+def test_flush_when_batch_is_full():
+    async def scenario():
+        recorder = Recorder()
+        buffer = WriteBehindBuffer(recorder.write, max_rows=3, max_delay=60)
+        for row in range(3):
+            buffer.add(row)
+        await asyncio.sleep(0)
+        # Полная пачка ушла сразу, не дожидаясь таймера
+        assert recorder.batches == [[0, 1, 2]]
+
+        buffer.add(3)
+        await asyncio.sleep(0)
+        assert len(buffer) == 1  # Неполная пачка ждет таймера или остановки
+        await buffer.close()
+        assert recorder.batches == [[0, 1, 2], [3]]
+        assert len(buffer) == 0
+
+    asyncio.run(scenario())
+
+
+def test_flush_after_interval():
+    async def scenario():
+        recorder = Recorder()
+        buffer = WriteBehindBuffer(recorder.write, max_rows=100, max_delay=0.05)
+        buffer.add("a")
+        buffer.add("b")
+        await asyncio.sleep(0.01)
+        assert recorder.batches == []
+        await asyncio.sleep(0.1)
+        assert recorder.batches == [["a", "b"]]
+        assert buffer.flushes == 1
+
+    asyncio.run(scenario())
+
+
+def test_failed_batch_is_kept_and_retried():
+    async def scenario():
+        recorder = Recorder(fail=1)
+        buffer = WriteBehindBuffer(recorder.write, max_rows=100, max_delay=0.01, max_pending=2)
+        for row in range(3):
+            buffer.add(row)
+        await asyncio.sleep(0.05)
+        # Первая запись не удалась: сверх max_pending отброшены самые старые строки, остальные записаны повтором
+        assert recorder.batches == [[1, 2]]
+
+    asyncio.run(scenario())
+
+
+def test_user_sees_own_unwritten_preferences(run_db):
+    async def scenario():
+        buffer = requests.preference_buffer
+        await requests.save_user_preference(201, "topic_audience", "кофейня")
+        await buffer.close()  # Первый ответ уже в БД
+
+        recorder = Recorder()
+        recorder.release = asyncio.Event()
+        write = buffer.write
+        buffer.write = recorder.write
+        try:
+            await requests.save_user_preference(201, "goal", "продажи")  # Пишется прямо сейчас
+            flushing = asyncio.ensure_future(buffer.flush())
+            await asyncio.sleep(0)
+            await requests.save_user_preference(201, "usp", "своя обжарка")  # Еще в буфере
+            await requests.save_user_preference(202, "goal", "чужой ответ")
+
+            rows = await requests.get_user_preferences(201)
+            assert [(row.question, row.answer) for row in rows] == [
+                ("topic_audience", "кофейня"), ("goal", "продажи"), ("usp", "своя обжарка"),
+            ]
+        finally:
+            recorder.release.set()
+            await flushing
+            buffer.write = write
+            buffer._pending.clear()
+
+    run_db(scenario)